@@ -0,0 +1,660 @@
+import asyncio
+import time as t
+import json
+import struct
+from typing import Dict, List, Union
+import Protocol as pt
+import Codec as cd
+import Compression as cz
+import Heartbeat as hb
+
+# 关闭连接时等待服务端关闭连接的最长秒数
+EXIT_TIMEOUT = 1.0
+# 断线后第一次重连前等待的秒数，之后每次失败加倍
+RECONNECT_DELAY = 0.5
+# 重连等待的最长秒数
+MAX_RECONNECT_DELAY = 30.0
+# 重连时建立连接并完成登录的最长秒数
+CONNECT_TIMEOUT = 10.0
+# 尚未被取走的消息数上限，超过后丢弃最早的消息，不会因为调用者不读取消息而停止读取连接
+MESSAGE_QUEUE_SIZE = 10000
+# 登录失败(密码错误)的登录结果
+LOGIN_FAILED = 1
+
+
+class AsyncClient(object):
+    """asyncio客户端类，用于机器人、集成程序与测试工具等无界面的场景，不依赖tkinter：
+    一个连接上可以同时有任意多个等待回复的请求，每个请求带有id，回复由后台读取任务按id交给对应的Future，
+    服务端主动发来的消息通过异步迭代(async for)取出，连接断开后自动重连并用原有登录信息重新登录，
+    重新加入此前加入的聊天室，断开时尚未收到回复的请求以ConnectionError结束，由调用者决定是否重试
+
+    属性:
+        IP(str):服务端的IP地址
+        PORT(int):服务端的端口号
+        preferredCodec(str):登录时优先请求的消息编码
+        useCompression(bool):登录时是否请求压缩
+        usePresence(bool):登录时是否订阅在线用户的增量推送
+        autoReconnect(bool):连接断开后是否自动重连
+        reconnectDelay(float):第一次重连前等待的秒数
+        maxReconnectDelay(float):重连等待的最长秒数
+        nickname(str):登录用户的昵称
+        loginInfo(str):由用户名和密码组成的登录信息，重连时再次使用
+        writer(StreamWriter):当前连接的写入流，未连接时为None
+        readTask(Task):读取当前连接的后台任务
+        task(Task):维护连接的后台任务，连接断开后负责重连
+        connected(Event):已连接并登录时置位，断线期间发出的请求在此等待
+        messages(Queue):服务端发来的、尚未被取走的消息，None表示不会再有新消息
+        pendingRequests(dict):请求id到(请求类型, Future)的映射
+        lastRequestId(int):最近分配的请求id
+        internTable(InternTable):服务端下发的昵称驻留表，每次连接时重建
+        codec(JsonCodec或BinaryCodec):登录时协商出的发送编码
+        compressor(FrameCompressor):协商了压缩时用于压缩发送的长消息，否则为None
+        presence(set):本地维护的在线用户集合
+        presenceVersion(int):本地在线用户集合的版本号，None表示服务端不支持推送
+        throttledUntil(dict):请求类型到服务端建议的恢复发送时刻的映射
+        rooms(set):已加入的聊天室，重连后重新加入
+        isClosed(bool):是否已调用close
+        stats(dict):连接、重连、请求、收发消息与丢弃消息的统计信息
+    """
+
+# 构造函数
+    def __init__(self, ip: str = '127.0.0.1', port: int = 50000, preferredCodec: str = cd.CODEC_BINARY,
+                 useCompression: bool = True, usePresence: bool = True, autoReconnect: bool = True,
+                 reconnectDelay: float = RECONNECT_DELAY, maxReconnectDelay: float = MAX_RECONNECT_DELAY,
+                 queueSize: int = MESSAGE_QUEUE_SIZE):
+        """构造函数，用于asyncio客户端对象初始化，连接在login中建立"""
+        self.__IP = ip
+        self.__PORT = port
+        self.__preferredCodec = preferredCodec
+        self.__useCompression = useCompression
+        self.__usePresence = usePresence
+        self.__autoReconnect = autoReconnect
+        self.__reconnectDelay = reconnectDelay
+        self.__maxReconnectDelay = maxReconnectDelay
+        self.__nickname = None
+        self.__loginInfo = None
+        self.__writer = None
+        self.__readTask = None
+        self.__task = None
+        self.__connected = asyncio.Event()
+        self.__messages = asyncio.Queue(queueSize)
+        self.__pendingRequests = {}
+        self.__lastRequestId = 0
+        self.__internTable = cd.InternTable()
+        self.__binaryCodec = cd.BinaryCodec(self.__internTable)
+        self.__codec = cd.JSON_CODEC
+        self.__compressor = None
+        self.__presence = set()
+        self.__presenceVersion = None
+        self.__presenceResyncing = False
+        self.__throttledUntil = {}
+        self.__rooms = set()
+        self.__isClosed = False
+        self.__stats = {'connects': 0, 'reconnects': 0, 'requests': 0, 'failedRequests': 0, 'sent': 0,
+                        'received': 0, 'dropped': 0}
+
+# 进入异步上下文
+    async def __aenter__(self) -> 'AsyncClient':
+        """async with语句中使用，退出时关闭连接"""
+        return self
+
+# 退出异步上下文
+    async def __aexit__(self, *excInfo):
+        """退出async with语句时关闭连接"""
+        await self.close()
+        return None
+
+# 登录
+    async def login(self, loginInfo: str, timeout: float = None) -> int:
+        """建立连接并登录，同时与服务端协商消息编码与压缩方式，登录成功后由后台任务维护连接，
+        之后连接断开时自动重连，登录失败时关闭客户端
+
+        参数:
+            self:表明该函数是一个实例方法
+            loginInfo(str):由用户名和密码组成的登录信息
+            timeout(float):建立连接并等待登录回复的最长秒数，None表示一直等待
+
+        返回值:
+            status(int):登录结果，0为注册成功，1为密码错误，2为登录成功
+
+        异常:
+            TimeoutError:超时没有收到登录回复
+            OSError:无法连接服务端或连接被关闭
+        """
+        if self.__task is not None or self.__isClosed:
+            raise RuntimeError("每个客户端对象只能登录一次")
+        self.__loginInfo = loginInfo
+        self.__nickname = loginInfo.split()[0]
+        try:
+            status = await asyncio.wait_for(self.__connect(), timeout)
+        except asyncio.TimeoutError:
+            self.__dropConnection()
+            raise TimeoutError("等待登录回复超时")
+        except OSError:
+            self.__dropConnection()
+            raise
+        if status == LOGIN_FAILED:
+            await self.close()
+            return status
+        self.__connected.set()
+        self.__task = asyncio.get_running_loop().create_task(self.__maintain())
+        return status
+
+# 建立连接
+    async def __connect(self) -> int:
+        """建立新的连接、启动读取任务并发送login请求，等待登录回复
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:
+            status(int):登录结果
+
+        异常:
+            OSError:无法连接服务端或登录回复之前连接被关闭
+        """
+        reader, writer = await asyncio.open_connection(self.__IP, self.__PORT)
+        hb.enableKeepalive(writer.get_extra_info("socket"))
+        self.__internTable = cd.InternTable()
+        self.__binaryCodec = cd.BinaryCodec(self.__internTable)
+        self.__codec = cd.JSON_CODEC
+        self.__compressor = None
+        self.__presence = set()
+        self.__presenceVersion = None
+        self.__presenceResyncing = False
+        self.__throttledUntil = {}
+        self.__writer = writer
+        self.__readTask = asyncio.get_running_loop().create_task(self.__readLoop(reader))
+        self.__stats['connects'] += 1
+        messageDict = {'source': self.__nickname, 'destination': None, 'type': 'login', 'data': self.__loginInfo,
+                       'codecs': [self.__preferredCodec, cd.CODEC_JSON],
+                       'compression': [cz.COMPRESSION_ZLIB] if self.__useCompression else [],
+                       'presence': self.__usePresence, 'heartbeat': True}
+        requestId, future = self.__register('login')
+        self.__write(dict(messageDict, id=requestId), plain=True)
+        reply = await future
+        if isinstance(reply, int):
+            return reply
+        return reply['data']['status']
+
+# 维护连接
+    async def __maintain(self):
+        """后台任务主体，等待当前连接的读取任务结束，连接断开且没有调用close时按指数退避重连并重新登录，
+        重新登录被拒绝或不需要重连时结束，并通知消息的迭代者不会再有新消息"""
+        try:
+            while not self.__isClosed:
+                await asyncio.wait([self.__readTask])
+                self.__dropConnection()
+                if self.__isClosed or not self.__autoReconnect:
+                    break
+                if not await self.__reconnect():
+                    break
+        finally:
+            self.__isClosed = True
+            self.__connected.set()
+            self.__dropConnection()
+            self.__failRequests()
+            self.__putMessage(None)
+        return None
+
+# 重连
+    async def __reconnect(self) -> bool:
+        """连接断开后反复尝试重新连接并登录，每次失败后等待的时间加倍，直到成功或调用了close
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:
+            bool:True 表明已重新登录；False 表明登录被拒绝或客户端已关闭
+        """
+        delay = self.__reconnectDelay
+        while not self.__isClosed:
+            await asyncio.sleep(delay)
+            if self.__isClosed:
+                return False
+            try:
+                status = await asyncio.wait_for(self.__connect(), CONNECT_TIMEOUT)
+            except (OSError, asyncio.TimeoutError) as error:
+                print("重连失败：{}".format(str(error) or "登录超时"))
+                self.__dropConnection()
+                delay = min(delay * 2, self.__maxReconnectDelay)
+                continue
+            if status == LOGIN_FAILED:
+                print("重新登录被拒绝")
+                return False
+            self.__stats['reconnects'] += 1
+        # 重新加入聊天室，回复不需要等待
+            for room in self.__rooms:
+                requestId, future = self.__register('join')
+                future.add_done_callback(lambda done: done.cancelled() or done.exception())
+                self.__write(dict(self.processMessage(None, "join", room), id=requestId))
+            self.__connected.set()
+            return True
+        return False
+
+# 读取连接
+    async def __readLoop(self, reader: 'StreamReader'):
+        """读取任务主体，解析并处理当前连接上收到的消息，连接断开后未完成的请求以ConnectionError结束
+
+        参数:
+            self:表明该函数是一个实例方法
+            reader(StreamReader):当前连接的读取流
+
+        返回值:None
+        """
+        decoder = pt.FrameDecoder()
+        try:
+            while True:
+                data = await reader.read(pt.RECEIVE_SIZE)
+                if not data:
+                    break
+                for frame in decoder.feed(data):
+                    self.__handleFrame(frame)
+        except pt.FrameError:
+            print("接收到非法数据帧")
+        except OSError:
+            print("与服务端的连接已被关闭")
+        finally:
+            self.__connected.clear()
+            self.__failRequests()
+        return None
+
+# 处理一帧数据
+    def __handleFrame(self, frame: Union[bytes, memoryview]):
+        """解码一帧数据，intern消息用于更新驻留表，ping消息直接回应pong，login回复先应用协商结果，
+        throttle通知记录被限速的请求类型，带有等待中的请求id的回复完成对应的Future，
+        presence消息用于更新本地在线用户集合，其余消息放入消息队列
+
+        参数:
+            self:表明该函数是一个实例方法
+            frame(bytes|memoryview):一个完整帧的帧体
+
+        返回值:None
+        """
+    # 不支持协商的服务端的登录回复只有登录结果数字
+        if len(frame) > 0 and chr(frame[0]).isdigit() and bytes(frame).isdigit():
+            self.__completeRequest(None, 'login', int(bytes(frame)))
+            return None
+        try:
+            messageDict = cd.decodeMessage(frame, self.__binaryCodec)
+        except (ValueError, struct.error):
+            print("接收到无法解码的消息")
+            return None
+        self.__stats['received'] += 1
+        messageType = messageDict['type']
+        if messageType == 'intern':
+        # 昵称为None表示服务端已释放该id
+            for userId, name in messageDict['data']:
+                if name is None:
+                    self.__internTable.forget(userId)
+                else:
+                    self.__internTable.define(userId, name)
+            return None
+        if messageType == 'ping':
+        # 服务端在连接空闲时发送ping，回应pong表明客户端仍然在线
+            self.__write({'source': self.__nickname, 'destination': None, 'type': 'pong', 'data': None})
+            return None
+        if messageType == 'login' and isinstance(messageDict['data'], dict):
+            self.__applyLogin(messageDict['data'])
+        elif messageType == 'throttle':
+            data = messageDict['data']
+            self.__throttledUntil[data['request']] = t.monotonic() + data['retryAfter']
+        if self.__completeRequest(cd.getRequestId(messageDict), messageType, messageDict):
+            return None
+        if messageType != 'presence' or self.__applyPresence(messageDict['data']):
+            self.__putMessage(messageDict)
+        return None
+
+# 应用登录协商结果
+    def __applyLogin(self, result: dict):
+        """根据登录回复设置驻留表、发送编码与压缩方式"""
+        for userId, name in result.get('users', []):
+            self.__internTable.define(userId, name)
+        if result.get('codec') == cd.CODEC_BINARY:
+            self.__codec = self.__binaryCodec
+        if result.get('compression') is not None:
+            self.__compressor = cz.FrameCompressor()
+        return None
+
+# 更新在线用户集合
+    def __applyPresence(self, data: dict) -> bool:
+        """根据服务端推送的快照或增量更新本地在线用户集合，增量出现缺口时向服务端请求新的快照
+
+        参数:
+            self:表明该函数是一个实例方法
+            data(dict):presence消息的内容，快照包含users，增量包含joined或left
+
+        返回值:
+            bool:True 表明本地在线用户集合发生了变化；False 表明没有变化
+        """
+        version = data['version']
+        if 'users' in data:
+            if self.__presenceVersion is not None and version <= self.__presenceVersion:
+                return False
+            self.__presence = set(data['users'])
+            self.__presenceVersion = version
+            self.__presenceResyncing = False
+            return True
+        if self.__presenceVersion is None or self.__presenceResyncing or version <= self.__presenceVersion:
+            return False
+        if version != self.__presenceVersion + 1:
+            self.__presenceResyncing = True
+            self.__write(self.processMessage(None, "presence", None))
+            return False
+        self.__presence.update(data.get('joined', []))
+        self.__presence.difference_update(data.get('left', []))
+        self.__presenceVersion = version
+        return True
+
+# 放入消息队列
+    def __putMessage(self, messageDict: Union[dict, None]):
+        """将消息放入队列，队列已满时丢弃最早的消息，None表示不会再有新消息"""
+        if self.__messages.full():
+            self.__messages.get_nowait()
+            self.__stats['dropped'] += 1
+        self.__messages.put_nowait(messageDict)
+        return None
+
+# 登记请求
+    def __register(self, messageType: str) -> tuple:
+        """分配请求id并登记等待回复的Future
+
+        参数:
+            self:表明该函数是一个实例方法
+            messageType(str):请求类型
+
+        返回值:
+            tuple:请求id与Future
+        """
+        self.__lastRequestId = self.__lastRequestId % cd.MAX_REQUEST_ID + 1
+        future = asyncio.get_running_loop().create_future()
+        self.__pendingRequests[self.__lastRequestId] = (messageType, future)
+        self.__stats['requests'] += 1
+        return self.__lastRequestId, future
+
+# 完成请求
+    def __completeRequest(self, requestId: Union[int, None], messageType: str, reply: Union[dict, int]) -> bool:
+        """将回复交给等待中的请求，没有带回id的登录回复交给等待中的login请求
+
+        参数:
+            self:表明该函数是一个实例方法
+            requestId(int):回复带回的请求id
+            messageType(str):回复的消息类型
+            reply(dict或int):回复
+
+        返回值:
+            bool:True 表明回复已交给等待中的请求
+        """
+        entry = self.__pendingRequests.pop(requestId, None)
+        if entry is None and requestId is None and messageType == 'login':
+            for pendingId, (pendingType, future) in self.__pendingRequests.items():
+                if pendingType == 'login':
+                    entry = self.__pendingRequests.pop(pendingId)
+                    break
+        if entry is None:
+            return False
+        if not entry[1].done():
+            entry[1].set_result(reply)
+        return True
+
+# 结束等待中的请求
+    def __failRequests(self):
+        """连接断开时调用，等待中的请求以ConnectionError结束"""
+        pending = list(self.__pendingRequests.values())
+        self.__pendingRequests.clear()
+        for messageType, future in pending:
+            if not future.done():
+                self.__stats['failedRequests'] += 1
+                future.set_exception(ConnectionError("与服务端的连接已被关闭"))
+        return None
+
+# 关闭当前连接
+    def __dropConnection(self):
+        """关闭当前连接的写入流并取消其读取任务"""
+        if self.__readTask is not None and not self.__readTask.done():
+            self.__readTask.cancel()
+        if self.__writer is not None:
+            self.__writer.close()
+            self.__writer = None
+        return None
+
+# 写入消息
+    def __write(self, messageDict: dict, plain: bool = False):
+        """按协商的编码与压缩方式封装消息并写入当前连接，不等待发送完成
+
+        参数:
+            self:表明该函数是一个实例方法
+            messageDict(dict):消息字典
+            plain(bool):为True时使用JSON编码且不压缩，用于协商之前的login消息
+
+        返回值:None
+
+        异常:
+            ConnectionError:当前没有连接
+        """
+        if self.__writer is None or self.__writer.is_closing():
+            raise ConnectionError("与服务端的连接已被关闭")
+        if plain:
+            frame = pt.packFrame(json.dumps(messageDict).encode())
+        else:
+            payload = self.__codec.encode(messageDict)
+            frame = self.__compressor.packFrame(payload) if self.__compressor is not None else pt.packFrame(payload)
+        self.__writer.write(frame)
+        self.__stats['sent'] += 1
+        return None
+
+# 等待连接可用
+    async def __waitConnected(self, deadline: Union[float, None]):
+        """断线重连期间等待重新登录完成
+
+        参数:
+            self:表明该函数是一个实例方法
+            deadline(float):截止时刻(事件循环时间)，None表示一直等待
+
+        返回值:None
+
+        异常:
+            TimeoutError:超时仍未重新登录
+            ConnectionError:客户端已关闭或尚未登录
+        """
+        if not self.__connected.is_set() and not self.__isClosed:
+            remaining = None if deadline is None else deadline - asyncio.get_running_loop().time()
+            try:
+                await asyncio.wait_for(self.__connected.wait(), remaining)
+            except asyncio.TimeoutError:
+                raise TimeoutError("等待重新连接超时")
+        if self.__isClosed or self.__writer is None:
+            raise ConnectionError("与服务端的连接已被关闭")
+        return None
+
+# 消息处理
+    def processMessage(self, targetUser: Union[str, None], messageType: str, message) -> dict:
+        """构造以当前用户为发送者的消息字典
+
+        参数:
+            self:表明该函数是一个实例方法
+            targetUser(str):消息目标用户的昵称或聊天室名称
+            messageType(str):消息的类别
+            message:消息的具体内容
+
+        返回值:
+            messageDict(dict):消息字典
+        """
+        return {'source': self.__nickname, 'destination': targetUser, 'type': messageType, 'data': message}
+
+# 发送消息
+    async def send(self, messageDict: dict, timeout: float = None):
+        """发送不需要回复的消息(如public与private)，断线重连期间等待重新登录后再发送
+
+        参数:
+            self:表明该函数是一个实例方法
+            messageDict(dict):消息字典
+            timeout(float):等待重新连接的最长秒数，None表示一直等待
+
+        返回值:None
+
+        异常:
+            TimeoutError:超时仍未重新登录
+            ConnectionError:客户端已关闭
+        """
+        deadline = None if timeout is None else asyncio.get_running_loop().time() + timeout
+        await self.__waitConnected(deadline)
+        writer = self.__writer
+        self.__write(messageDict)
+        await writer.drain()
+        return None
+
+# 发送请求
+    async def request(self, messageDict: dict, timeout: float = None) -> dict:
+        """为消息分配请求id后发送并等待带有该id的回复，多个协程可以同时发出请求，
+        请求在服务端按发送顺序处理，回复按到达顺序分别交给各自的调用者
+
+        参数:
+            self:表明该函数是一个实例方法
+            messageDict(dict):消息字典
+            timeout(float):等待重新连接与回复的最长秒数，None表示一直等待
+
+        返回值:
+            dict:回复的消息字典，请求被限速时为throttle通知
+
+        异常:
+            TimeoutError:超时没有收到回复
+            ConnectionError:客户端已关闭，或收到回复之前连接断开(请求可能已被处理)
+        """
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        await self.__waitConnected(deadline)
+        writer = self.__writer
+        requestId, future = self.__register(messageDict['type'])
+        try:
+            self.__write(dict(messageDict, id=requestId))
+            await writer.drain()
+            remaining = None if deadline is None else deadline - loop.time()
+            reply = await asyncio.wait_for(future, remaining)
+        except asyncio.TimeoutError:
+            raise TimeoutError("等待服务端回复超时")
+        finally:
+            self.__pendingRequests.pop(requestId, None)
+    # 记录加入的聊天室，重连后重新加入
+        if reply['type'] != 'throttle' and isinstance(reply['data'], dict) and 'error' not in reply['data']:
+            if messageDict['type'] == 'join':
+                self.__rooms.add(messageDict['data'])
+            elif messageDict['type'] == 'leave':
+                self.__rooms.discard(messageDict['data'])
+        return reply
+
+# 查询在线用户
+    async def queryOnlineUsers(self, timeout: float = None) -> List[str]:
+        """发送get请求并等待回复，用于服务端不推送在线用户时
+
+        参数:
+            self:表明该函数是一个实例方法
+            timeout(float):等待回复的最长秒数，None表示一直等待
+
+        返回值:
+            List[str]:除自己以外的在线用户昵称，请求被限速时为空列表
+        """
+        reply = await self.request(self.processMessage(None, "get", None), timeout)
+        if reply['type'] != 'get' or not reply['data']:
+            return []
+        return reply['data'].split(" ")
+
+# 接收消息字典
+    async def receiveMessageDict(self) -> Union[dict, None]:
+        """取出服务端发来的下一条消息，重连不会中断消息的接收
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:
+            messageDict(dict):消息字典，None表示客户端已关闭且没有剩余的消息
+        """
+        messageDict = await self.__messages.get()
+        if messageDict is None:
+        # 放回结束标记，其他等待消息的协程同样能够结束
+            self.__messages.put_nowait(None)
+        return messageDict
+
+# 异步迭代器
+    def __aiter__(self) -> 'AsyncClient':
+        """以async for的方式逐条取出服务端发来的消息，客户端关闭后迭代结束"""
+        return self
+
+# 下一条消息
+    async def __anext__(self) -> dict:
+        """返回下一条消息，客户端关闭且没有剩余的消息时结束迭代"""
+        messageDict = await self.receiveMessageDict()
+        if messageDict is None:
+            raise StopAsyncIteration
+        return messageDict
+
+# 限速剩余时间
+    def retryAfter(self, messageType: str) -> float:
+        """返回服务端对该类请求的限速还需持续的秒数，调用者可据此推迟发送"""
+        return max(0.0, self.__throttledUntil.get(messageType, 0.0) - t.monotonic())
+
+# 是否支持在线用户推送
+    def hasPresence(self) -> bool:
+        """返回服务端是否推送在线用户，为False时需要使用get请求查询"""
+        return self.__presenceVersion is not None
+
+# 获取在线用户
+    def getOnlineUsers(self) -> List[str]:
+        """返回本地在线用户集合中除自己以外的昵称，无需访问服务端"""
+        return sorted(self.__presence - {self.__nickname})
+
+# 是否已连接
+    def isConnected(self) -> bool:
+        """返回当前是否已连接并登录，断线重连期间为False"""
+        return self.__connected.is_set() and not self.__isClosed
+
+# 返回当前连接状态
+    def isClosed(self) -> bool:
+        """返回客户端是否已关闭，关闭后不会再重连"""
+        return self.__isClosed
+
+# 获取统计信息
+    def getStats(self) -> Dict[str, int]:
+        """返回连接与重连次数、请求数、因断线失败的请求数、收发消息数、丢弃的消息数以及等待回复的请求数
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:
+            Dict[str, int]:统计信息
+        """
+        stats = dict(self.__stats)
+        stats['pending'] = len(self.__pendingRequests)
+        stats['queued'] = self.__messages.qsize()
+        return stats
+
+# 关闭连接
+    async def close(self, timeout: float = EXIT_TIMEOUT):
+        """关闭客户端，不再重连，发送exit后等待服务端关闭连接，超时仍未关闭时由客户端直接关闭，
+        等待中的请求以ConnectionError结束，消息的迭代者取完剩余的消息后结束迭代
+
+        参数:
+            self:表明该函数是一个实例方法
+            timeout(float):等待服务端关闭连接的最长秒数
+
+        返回值:None
+        """
+        if self.__isClosed and self.__task is None:
+            return None
+        self.__isClosed = True
+        self.__connected.set()
+        if self.__readTask is not None and not self.__readTask.done():
+            try:
+                self.__write(self.processMessage(None, "exit", None), plain=True)
+                await asyncio.wait([self.__readTask], timeout=timeout)
+            except OSError:
+                pass
+        self.__dropConnection()
+        task, self.__task = self.__task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.wait([task])
+        else:
+            self.__failRequests()
+            self.__putMessage(None)
+        return None
@@ -0,0 +1,468 @@
+import socket as sk
+import asyncio
+import sys
+from typing import Dict, List, Tuple, Union
+import Protocol as pt
+import Outbound as ob
+import Codec as cd
+import Compression as cz
+import Heartbeat as hb
+import Mailbox as mb
+from Server import Server, raiseFileLimit, MALFORMED_ERRORS
+
+
+class StreamConnection(object):
+    """asyncio流连接类，对StreamWriter进行封装，供发送队列的写协程使用
+
+    属性:
+        writer(StreamWriter):asyncio为该连接创建的写入流
+        writable(asyncio.Event):发送队列的背压解除时被设置，用于唤醒暂停读取的协程
+    """
+
+# 构造函数
+    def __init__(self, writer: 'StreamWriter'):
+        """构造函数，用于流连接对象初始化"""
+        self.__writer = writer
+        self.writable = asyncio.Event()
+
+# 发送数据
+    def writeFrames(self, frames: list):
+        """将多个帧写入发送缓冲区，由事件循环负责实际发送，调用不会阻塞
+
+        参数:
+            self:表明该函数是一个实例方法
+            frames(list):将要发送的帧
+
+        返回值:None
+        """
+        self.__writer.writelines(frames)
+        return None
+
+# 等待缓冲区排空
+    async def drain(self):
+        """等待发送缓冲区回落到低水位以下，接收方读取过慢时该协程会一直等待
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:None
+        """
+        await self.__writer.drain()
+        return None
+
+# 直接发送数据
+    def sendall(self, data: bytes):
+        """与socket.sendall接口一致，用于不经过发送队列直接回复尚未登录的连接，数据写入发送缓冲区后立即返回
+
+        参数:
+            self:表明该函数是一个实例方法
+            data(bytes):将要发送的数据
+
+        返回值:None
+        """
+        self.__writer.write(data)
+        return None
+
+# 对端地址
+    def getpeername(self) -> Union[tuple, None]:
+        """与socket.getpeername接口一致，返回该连接对端的地址
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:
+            Union[tuple, None]:对端地址，无法获取时为None
+        """
+        return self.__writer.get_extra_info("peername")
+
+# 关闭连接
+    def close(self):
+        """关闭该连接对应的写入流
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:None
+        """
+        if not self.__writer.is_closing():
+            self.__writer.close()
+        return None
+
+
+class AsyncServer(Server):
+    """asyncio模式的服务端类，连接的接收、消息的读取、分发与转发全部运行在同一个事件循环中，
+    不再为每个连接创建线程，消息类型与线程模式保持一致(login/get/public/private/exit)
+
+    属性:
+        IP(str):服务端程序使用的IP地址
+        PORT(int):服务端程序使用的端口号
+        listenSocket(socket对象):监听套接字，交由事件循环进行异步accept
+        server(asyncio.Server):事件循环中运行的服务对象
+        closedEvent(asyncio.Event):服务端关闭时被设置，用于结束事件循环
+        isClosed(bool):用于标识服务端是否已经关闭
+        lastAcceptTime(float):最近一次接收到新连接的时间，用于空闲关闭判断
+        flushDelay(float):写协程合并发送的延迟预算(秒)，0表示立即发送
+        outboundStats(dict):写协程的发送轮次、写入次数、发送的帧数以及延迟发送的轮次
+    """
+
+# 构造函数
+    def __init__(self, ip: str = '127.0.0.1', port: int = 50000, slowConsumerPolicy: str = ob.POLICY_DROP,
+                 databaseUtils: 'DatabaseUtils' = None, compressionThreshold: Union[int, None] = cz.COMPRESSION_THRESHOLD,
+                 adminUsers: List[str] = (), metricsInterval: float = 60, reusePort: bool = False,
+                 shardBus: 'ShardBus' = None, idleTimeout: float = hb.IDLE_TIMEOUT,
+                 probeTimeout: float = hb.PROBE_TIMEOUT, loginTimeout: float = hb.LOGIN_TIMEOUT,
+                 rateLimits: Dict[str, Tuple[float, float]] = None, mailboxSize: int = mb.MAILBOX_SIZE,
+                 mailboxMemory: int = mb.MAILBOX_MEMORY, flushDelay: float = ob.FLUSH_DELAY,
+                 writeBatch: int = ob.WRITE_BATCH):
+        """构造函数，用于服务端对象初始化"""
+        super().__init__(ip=ip, port=port, slowConsumerPolicy=slowConsumerPolicy, databaseUtils=databaseUtils,
+                         compressionThreshold=compressionThreshold, adminUsers=adminUsers,
+                         metricsInterval=metricsInterval, reusePort=reusePort, shardBus=shardBus,
+                         idleTimeout=idleTimeout, probeTimeout=probeTimeout, loginTimeout=loginTimeout,
+                         rateLimits=rateLimits, mailboxSize=mailboxSize, mailboxMemory=mailboxMemory,
+                         flushDelay=flushDelay, writeBatch=writeBatch)
+        self.__reusePort = reusePort
+        self.__loop = None
+        self.__IP = ip
+        self.__PORT = port
+        self.__listenSocket = None
+        self.__server = None
+        self.__closedEvent = None
+        self.__isClosed = False
+        self.__lastAcceptTime = 0.0
+        self.__flushDelay = flushDelay
+        self.__outboundStats = {'flushes': 0, 'sendCalls': 0, 'frames': 0, 'delayedFlushes': 0}
+
+# 启动服务器
+    def startServer(self):
+        """服务端启动函数，创建非阻塞的监听套接字并给出提示信息
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:None
+        """
+        raiseFileLimit()
+        self.__listenSocket = sk.socket(sk.AF_INET, sk.SOCK_STREAM)
+        self.__listenSocket.setsockopt(sk.SOL_SOCKET, sk.SO_REUSEADDR, True)
+        if self.__reusePort:
+            self.__listenSocket.setsockopt(sk.SOL_SOCKET, sk.SO_REUSEPORT, True)
+        self.__listenSocket.bind((self.__IP, self.__PORT))
+        self.__listenSocket.listen(sk.SOMAXCONN)
+        self.__listenSocket.setblocking(False)
+        self.startServices()
+        print("服务端(asyncio模式)启动成功，等待客户端连接·······")
+        return None
+
+# 连接处理
+    async def connectionProcess(self, reader: 'StreamReader', writer: 'StreamWriter'):
+        """连接处理协程，每个客户端连接对应一个协程，负责读取请求并进行分发
+
+        参数:
+            self:表明该函数是一个实例方法
+            reader(StreamReader):该连接的读取流
+            writer(StreamWriter):该连接的写入流
+
+        返回值:None
+        """
+        loop = asyncio.get_running_loop()
+        self.__lastAcceptTime = loop.time()
+        conn = StreamConnection(writer)
+        decoder = pt.FrameDecoder()
+        hb.enableKeepalive(writer.get_extra_info("socket"))
+        ob.enableNoDelay(writer.get_extra_info("socket"))
+        liveness = self.trackConnection(conn)
+        peer = self.peerAddress(conn)
+        isAlive = True
+        try:
+            while isAlive:
+                if liveness.session is not None and liveness.session.queue.isBackpressured():
+                    await self.__waitWritable(conn, liveness.session.queue)
+                receiveData = await reader.read(pt.RECEIVE_SIZE)
+                if not receiveData:
+                    break
+                liveness.touch()
+                for frame in decoder.feed(receiveData):
+                    startTime = loop.time()
+                    size = pt.HEADER.size + len(frame)
+                    try:
+                        messageDict = self.decodeMessage(frame)
+                        self.validateRequest(messageDict)
+                    except MALFORMED_ERRORS:
+                        self.recordMalformed(size)
+                        continue
+                    isAdmitted, waitTime = self.admitRequest(peer, liveness, messageDict)
+                    if not isAdmitted:
+                        continue
+                    if waitTime > 0:
+                        await asyncio.sleep(waitTime)
+                    try:
+                    # 身份验证需要访问数据库，放入线程池执行以免阻塞事件循环
+                        if messageDict['type'] == 'login':
+                            nickname, status = await loop.run_in_executor(None, self.identityVerification,
+                                                                          messageDict['data'])
+                            session = self.completeLogin(conn, messageDict, nickname, status, size)
+                            if session is not None:
+                                entries = await loop.run_in_executor(None, self.takeMailbox, nickname)
+                                self.deliverMailbox(session, entries)
+                    # 未登录连接的history请求与其他请求一样由dispatchMessage拒绝
+                        elif messageDict['type'] == 'history' and self.authenticatedSession(liveness) is not None:
+                            session = liveness.session
+                            session.recordIn(size)
+                            historyDict = await loop.run_in_executor(None, self.loadHistory, session.nickname,
+                                                                     messageDict['destination'], messageDict['data'])
+                            self.sendMessage(session.nickname, historyDict, cd.getRequestId(messageDict))
+                    # 发给不在线用户的私聊消息需要确认对方已注册才能存入离线信箱，查询放入线程池执行
+                        elif (messageDict['type'] == 'private' and self.authenticatedSession(liveness) is not None
+                              and not self.isReachable(messageDict['destination'])):
+                            session = liveness.session
+                            session.recordIn(size)
+                            isRegistered = await loop.run_in_executor(None, self.isRegisteredUser,
+                                                                      messageDict['destination'])
+                            self.relayPrivateMessage(session.nickname, messageDict['destination'], messageDict['data'],
+                                                     isRegistered)
+                        else:
+                            isAlive = self.dispatchMessage(conn, liveness, messageDict, size)
+                    except Exception:
+                        self.recordFailure(messageDict['type'])
+                        continue
+                    self.recordRequest(messageDict['type'], size, loop.time() - startTime)
+                    if not isAlive:
+                        break
+        except pt.FrameError as error:
+            print("非法数据帧：{}".format(error))
+        except ConnectionError:
+            print("连接异常断开")
+        finally:
+            self.releaseConnection(liveness)
+            conn.close()
+        return None
+
+# 创建发送队列
+    def createOutboundQueue(self, conn: 'StreamConnection') -> 'OutboundQueue':
+        """为连接创建发送队列，并启动负责该队列的写协程
+
+        参数:
+            self:表明该函数是一个实例方法
+            conn(StreamConnection):客户端对应的流连接
+
+        返回值:
+            OutboundQueue:该连接的发送队列
+        """
+        readyEvent = asyncio.Event()
+        queue = ob.OutboundQueue(conn, lambda queue: readyEvent.set(), onWritable=lambda queue: conn.writable.set())
+        asyncio.get_running_loop().create_task(self.__drainQueue(queue, readyEvent))
+        return queue
+
+# 发送队列写协程
+    async def __drainQueue(self, queue: 'OutboundQueue', readyEvent: 'asyncio.Event'):
+        """写协程，队列中有数据时将其全部写入发送缓冲区并等待排空，
+        配置了延迟预算时先等待flushDelay秒，使随后放入的帧与第一帧在一次写入中发出，
+        等待期间新的消息继续进入有界队列，队列满时由慢消费者策略处理
+
+        参数:
+            self:表明该函数是一个实例方法
+            queue(OutboundQueue):需要发送的队列
+            readyEvent(asyncio.Event):队列有新数据或被关闭时被设置
+
+        返回值:None
+        """
+        conn = queue.connection
+        try:
+            while not queue.isClosed():
+                await readyEvent.wait()
+                if self.__flushDelay > 0 and queue.queuedBytes() < ob.COALESCE_BYTES and not queue.isClosed():
+                    await asyncio.sleep(self.__flushDelay)
+                    self.__outboundStats['delayedFlushes'] += 1
+                readyEvent.clear()
+                frames = queue.popAll()
+                if len(frames) == 0:
+                    continue
+                self.__outboundStats['flushes'] += 1
+                self.__outboundStats['sendCalls'] += 1
+                self.__outboundStats['frames'] += len(frames)
+                try:
+                    conn.writeFrames([view for view, tracker in frames])
+                    await conn.drain()
+                finally:
+                    for view, tracker in frames:
+                        if tracker is not None:
+                            tracker.done()
+        except ConnectionError:
+            queue.close()
+        finally:
+            conn.close()
+        return None
+
+# 获取发送合并统计
+    def getOutboundStats(self) -> dict:
+        """返回写协程的发送统计，asyncio模式下每轮发送是对传输层的一次写入，sendCalls即写入次数
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:
+            dict:统计信息
+        """
+        stats = dict(self.__outboundStats, flushDelayMs=self.__flushDelay * 1000)
+        stats['framesPerCall'] = stats['frames'] / stats['sendCalls'] if stats['sendCalls'] > 0 else 0.0
+        return stats
+
+# 等待发送队列回落
+    async def __waitWritable(self, conn: 'StreamConnection', queue: 'OutboundQueue'):
+        """发送队列超过高水位时暂停读取该连接，直到写协程将队列取空或队列被关闭
+
+        参数:
+            self:表明该函数是一个实例方法
+            conn(StreamConnection):客户端对应的流连接
+            queue(OutboundQueue):该连接的发送队列
+
+        返回值:None
+        """
+        startTime = asyncio.get_running_loop().time()
+        while queue.isBackpressured() and not queue.isClosed():
+            conn.writable.clear()
+            if queue.isBackpressured():
+                await conn.writable.wait()
+        self.recordBackpressure(asyncio.get_running_loop().time() - startTime)
+        return None
+
+# 中断连接
+    def abortConnection(self, conn: 'StreamConnection'):
+        """关闭连接的写入流，传输层关闭后读取协程会读到EOF并结束
+
+        参数:
+            self:表明该函数是一个实例方法
+            conn(StreamConnection):客户端对应的流连接
+
+        返回值:None
+        """
+        conn.close()
+        return None
+
+# 空闲连接回收
+    async def __reapLoop(self):
+        """每个时间轮刻度检查一次到期的连接，回收操作与其他协程运行在同一个事件循环中
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:None
+        """
+        while not self.__isClosed:
+            await asyncio.sleep(hb.WHEEL_TICK)
+            try:
+                self.reapIdleConnections()
+            except Exception as error:
+                print("空闲连接检查失败：{}".format(error))
+        return None
+
+# 空闲检测
+    async def __idleWatcher(self):
+        """与线程模式的accept超时逻辑保持一致：180秒内没有新连接且没有已登录的客户端时关闭服务端，
+        否则每隔120秒再次检测
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:None
+        """
+        loop = asyncio.get_running_loop()
+        timeout = 180
+        while not self.__isClosed:
+            await asyncio.sleep(timeout)
+            if loop.time() - self.__lastAcceptTime < timeout:
+                continue
+            if self.connectionCount() == 0:
+                print("长时间无连接，服务器已关闭")
+                self.closeServer()
+            else:
+                timeout = 120
+        return None
+
+# 运行服务
+    async def __serve(self):
+        """在事件循环中启动服务并等待其结束
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:None
+        """
+        self.__loop = asyncio.get_running_loop()
+        self.__lastAcceptTime = self.__loop.time()
+        self.__closedEvent = asyncio.Event()
+        self.__server = await asyncio.start_server(self.connectionProcess, sock=self.__listenSocket)
+        watcher = asyncio.create_task(self.__idleWatcher())
+        reaper = asyncio.create_task(self.__reapLoop())
+        try:
+            await self.__closedEvent.wait()
+        finally:
+            watcher.cancel()
+            reaper.cancel()
+        return None
+
+# 收到分片消息
+    def onBusMessage(self, message: dict):
+        """分片总线在自己的接收线程中调用此函数，发送队列只能在事件循环中操作，因此转交给事件循环处理，
+        事件循环启动前本分片还没有会话，可以直接处理
+
+        参数:
+            self:表明该函数是一个实例方法
+            message(dict):其他分片发来的消息
+
+        返回值:None
+        """
+        loop = self.__loop
+        if loop is None:
+            self.handleBusMessage(message)
+        else:
+            loop.call_soon_threadsafe(self.handleBusMessage, message)
+        return None
+
+# 关闭服务端
+    def closeServer(self):
+        """关闭事件循环中的服务对象以及监听套接字
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:None
+        """
+        self.__isClosed = True
+        if self.__server is not None:
+            self.__server.close()
+            self.__closedEvent.set()
+        else:
+            self.__listenSocket.close()
+        self.stopServices()
+        return None
+
+# 获取服务端状态
+    def isClosed(self) -> bool:
+        """返回服务端当前状态
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:
+            bool:True 表明服务端已关闭；False 表明服务端未关闭
+        """
+        return self.__isClosed
+
+# 主函数
+    def main(self) -> int:
+        """用于运行事件循环，所有连接都在该事件循环中处理
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:
+            int:返回数字0表明程序正常执行结束
+        """
+        try:
+            asyncio.run(self.__serve())
+        except KeyboardInterrupt:
+            self.closeServer()
+            sys.exit("程序已退出")
+        return 0
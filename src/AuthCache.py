@@ -0,0 +1,135 @@
+import threading as td
+import time as t
+import hashlib
+import hmac
+from collections import OrderedDict
+from typing import Dict, Union
+
+
+# 计算密码摘要
+def passwordDigest(password: str) -> bytes:
+    """计算密码的摘要，缓存中只保存摘要而不保存密码原文
+
+    参数:
+        password(str):密码
+
+    返回值:
+        bytes:密码的SHA-256摘要
+    """
+    return hashlib.sha256(password.encode()).digest()
+
+
+class AuthCache(object):
+    """身份验证缓存类，缓存用户名到数据库中密码摘要的映射，使短时间内重新登录的用户无需再次查询数据库，
+    缓存容量有限，超过容量时淘汰最久未使用的用户，缓存项超过有效期后失效
+
+    属性:
+        maxSize(int):缓存的最大用户数
+        ttl(float):缓存项的有效期(秒)
+        entries(OrderedDict):用户名到(密码摘要, 过期时间)的映射，按最近使用顺序排列
+        stats(dict):命中、未命中、淘汰、过期与失效的次数
+    """
+
+# 构造函数
+    def __init__(self, maxSize: int = 10000, ttl: float = 300):
+        """构造函数，用于身份验证缓存对象初始化"""
+        self.__maxSize = maxSize
+        self.__ttl = ttl
+        self.__entries = OrderedDict()
+        self.__lock = td.Lock()
+        self.__stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'invalidations': 0}
+
+# 查询缓存
+    def get(self, name: str) -> Union[bytes, None]:
+        """查询用户的密码摘要，命中时将该用户移到最近使用的位置
+
+        参数:
+            self:表明该函数是一个实例方法
+            name(str):用户名
+
+        返回值:
+            bytes:缓存的密码摘要，None表示未命中或已过期
+        """
+        with self.__lock:
+            entry = self.__entries.get(name)
+            if entry is None:
+                self.__stats['misses'] += 1
+                return None
+            digest, expireTime = entry
+            if expireTime < t.monotonic():
+                del self.__entries[name]
+                self.__stats['expirations'] += 1
+                self.__stats['misses'] += 1
+                return None
+            self.__entries.move_to_end(name)
+            self.__stats['hits'] += 1
+        return digest
+
+# 写入缓存
+    def put(self, name: str, digest: bytes):
+        """写入用户的密码摘要，超过容量时淘汰最久未使用的用户
+
+        参数:
+            self:表明该函数是一个实例方法
+            name(str):用户名
+            digest(bytes):数据库中该用户密码的摘要
+
+        返回值:None
+        """
+        with self.__lock:
+            self.__entries[name] = (digest, t.monotonic() + self.__ttl)
+            self.__entries.move_to_end(name)
+            while len(self.__entries) > self.__maxSize:
+                self.__entries.popitem(last=False)
+                self.__stats['evictions'] += 1
+        return None
+
+# 使缓存失效
+    def invalidate(self, name: str):
+        """用户注册或修改密码时调用，删除该用户的缓存
+
+        参数:
+            self:表明该函数是一个实例方法
+            name(str):用户名
+
+        返回值:None
+        """
+        with self.__lock:
+            if self.__entries.pop(name, None) is not None:
+                self.__stats['invalidations'] += 1
+        return None
+
+# 验证密码
+    def verify(self, name: str, password: str) -> Union[bool, None]:
+        """使用缓存验证用户的密码
+
+        参数:
+            self:表明该函数是一个实例方法
+            name(str):用户名
+            password(str):用户输入的密码
+
+        返回值:
+            bool:True 表明密码正确；False 表明密码错误
+            None:缓存未命中，需要查询数据库
+        """
+        digest = self.get(name)
+        if digest is None:
+            return None
+        return hmac.compare_digest(digest, passwordDigest(password))
+
+# 获取统计信息
+    def getStats(self) -> Dict[str, Union[int, float]]:
+        """返回缓存的统计信息
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:
+            Dict:当前缓存数量、命中率以及命中、未命中、淘汰、过期与失效的次数
+        """
+        with self.__lock:
+            stats = dict(self.__stats)
+            stats['size'] = len(self.__entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['hitRate'] = stats['hits'] / lookups if lookups > 0 else 0.0
+        return stats
@@ -1,6 +1,18 @@
 import socket as sk
+import threading as td
 import time as t
 import json
+import struct
+import select
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, List, Union
+import Protocol as pt
+import Codec as cd
+import Compression as cz
+
+# 关闭连接时等待服务端关闭连接的最长秒数
+EXIT_TIMEOUT = 1.0
 
 
 class Client(object):
@@ -12,24 +24,94 @@ class Client(object):
         connectSocket(socket对象):连接套接字，用于与服务端建立连接
         nickname(str):当前客户端对应的用户的昵称，用于登陆验证以及聊天消息的处理
         isClosed(bool):用于标识客户端与服务端的连接是否关闭
+        decoder(FrameDecoder):增量帧解码器，用于从接收到的数据中解析出完整的消息
+        pendingMessages(deque):已经解析出但尚未被取走的消息
+        preferredCodec(str):登录时优先请求的消息编码
+        internTable(InternTable):服务端下发的昵称驻留表
+        codec(JsonCodec或BinaryCodec):登录时协商出的发送编码
+        useCompression(bool):登录时是否请求压缩
+        compressor(FrameCompressor):协商了压缩时用于压缩发送的长消息，否则为None
+        usePresence(bool):登录时是否订阅在线用户的增量推送
+        presence(set):本地维护的在线用户集合，由服务端推送的快照与增量更新
+        presenceVersion(int):本地在线用户集合的版本号，None表示服务端不支持推送
+        sendLock(Lock):保证接收线程与界面线程发送的帧不会交错
+        throttledUntil(dict):请求类型到服务端建议的恢复发送时刻的映射，由throttle通知更新
+        pendingRequests(dict):请求id到(请求类型, Future)的映射，收到带有该id的回复时完成对应的Future
+        lastRequestId(int):最近分配的请求id
+        requestLock(Lock):保护请求id的分配与pendingRequests
+        readCondition(Condition):同一时刻只有一个线程读取连接，其他等待回复或消息的线程在此等待
+        isReading(bool):是否有线程正在读取连接
+        backlog(deque):读取到的、需要交给receiveMessageDict调用者的消息
+        isEnded(bool):服务端是否已关闭连接
 
     """
 
 # 构造方法
-    def __init__(self):
+    def __init__(self, ip: str = '127.0.0.1', port: int = 50000, preferredCodec: str = cd.CODEC_BINARY,
+                 useCompression: bool = True, usePresence: bool = True):
         """构造函数，用于初始化client对象"""
-        self.__IP = '127.0.0.1'
-        self.__PORT = 50000
+        self.__IP = ip
+        self.__PORT = port
         self.__connectSocket = None
         self.__nickname = None
         self.__isClosed = False
+        self.__decoder = pt.FrameDecoder()
+        self.__pendingMessages = deque()
+        self.__preferredCodec = preferredCodec
+        self.__internTable = cd.InternTable()
+        self.__binaryCodec = cd.BinaryCodec(self.__internTable)
+        self.__codec = cd.JSON_CODEC
+        self.__useCompression = useCompression
+        self.__compressor = None
+        self.__usePresence = usePresence
+        self.__presence = set()
+        self.__presenceVersion = None
+        self.__presenceResyncing = False
+        self.__sendLock = td.Lock()
+        self.__throttledUntil = {}
+        self.__pendingRequests = {}
+        self.__lastRequestId = 0
+        self.__requestLock = td.Lock()
+        self.__readCondition = td.Condition()
+        self.__isReading = False
+        self.__backlog = deque()
+        self.__isEnded = False
 
 # 建立连接
-    def getConnection(self):
-        """连接函数，用于与服务端建立连接，返回值为空"""
-        self.__connectSocket = sk.socket(sk.AF_INET, sk.SOCK_STREAM)
+    def getConnection(self, timeout: float = None):
+        """连接函数，用于与服务端建立连接，已有连接时先关闭原有连接并清空与其相关的状态，
+        因此可以用于登录超时或连接断开后的重试，调用时不能有其他线程正在读取连接
+
+        参数:
+            self:表明该函数是一个实例方法
+            timeout(float):建立连接的最长秒数，None表示使用系统默认值
+
+        返回值:None
+
+        异常:
+            OSError:无法连接服务端
+        """
+        if self.__connectSocket is not None:
+            self.__connectSocket.close()
+            self.__endConnection()
         address = (self.__IP, self.__PORT)
-        self.__connectSocket.connect(address)
+        connectSocket = sk.create_connection(address, timeout)
+        connectSocket.settimeout(None)
+        self.__decoder = pt.FrameDecoder()
+        self.__pendingMessages.clear()
+        self.__internTable = cd.InternTable()
+        self.__binaryCodec = cd.BinaryCodec(self.__internTable)
+        self.__codec = cd.JSON_CODEC
+        self.__compressor = None
+        self.__presence = set()
+        self.__presenceVersion = None
+        self.__presenceResyncing = False
+        self.__throttledUntil = {}
+        with self.__readCondition:
+            self.__backlog.clear()
+            self.__isEnded = False
+        self.__connectSocket = connectSocket
+        self.__isClosed = False
         return None
 
 # 设置昵称
@@ -46,25 +128,323 @@ class Client(object):
         return None
 
 # 登录验证
-    def loginCheck(self, loginInfo: str) -> int:
-        """登录验证函数，用于客户端在登录时进行身份的验证
+    def loginCheck(self, loginInfo: str, timeout: float = None) -> int:
+        """登录验证函数，用于客户端在登录时进行身份的验证，同时与服务端协商消息编码与压缩方式，
+        不支持协商的服务端只回复登录结果，此时继续使用JSON编码且不压缩，收到回复后立即返回
 
         参数:
             self:表明该函数是一个实例方法
             loginInfo(str):用户输入登录信息，由用户名和密码组成的字符串
+            timeout(float):等待回复的最长秒数，None表示一直等待
 
         返回值:
             status(int):不同的值代表了不同的登录结果
+
+        异常:
+            TimeoutError:超时没有收到回复
+            ConnectionError:连接已被关闭
         """
-        messageDict = {'source': self.__nickname, 'destination': None, 'type': 'login', 'data': loginInfo}
-        messageJSON = json.dumps(messageDict)
-        self.__connectSocket.send(messageJSON.encode())
-        t.sleep(0.3)
-        status = int(self.__connectSocket.recv(10).decode())
-        return status
+        return self.waitLogin(self.requestLogin(loginInfo), timeout)
+
+# 等待登录结果
+    def waitLogin(self, future: 'Future', timeout: float = None) -> int:
+        """等待requestLogin返回的Future完成并取出登录结果
+
+        参数:
+            self:表明该函数是一个实例方法
+            future(Future):requestLogin返回的Future
+            timeout(float):等待回复的最长秒数，None表示一直等待
+
+        返回值:
+            status(int):不同的值代表了不同的登录结果
+
+        异常:
+            TimeoutError:超时没有收到回复
+            ConnectionError:连接已被关闭
+        """
+        reply = self.waitResponse(future, timeout)
+        if isinstance(reply, int):
+            return reply
+        return reply['data']['status']
+
+# 发送登录请求
+    def requestLogin(self, loginInfo: str) -> 'Future':
+        """发送带有请求id的login消息，登录回复由读取连接的线程处理后完成返回的Future，
+        Future的结果为登录回复的消息字典，不支持协商的服务端回复的是登录结果数字
+
+        参数:
+            self:表明该函数是一个实例方法
+            loginInfo(str):用户输入登录信息，由用户名和密码组成的字符串
+
+        返回值:
+            Future:登录回复
+        """
+        messageDict = {'source': self.__nickname, 'destination': None, 'type': 'login', 'data': loginInfo,
+                       'codecs': [self.__preferredCodec, cd.CODEC_JSON],
+                       'compression': [cz.COMPRESSION_ZLIB] if self.__useCompression else [],
+                       'presence': self.__usePresence, 'heartbeat': True}
+        return self.request(messageDict, plain=True)
+
+# 应用登录协商结果
+    def __applyLogin(self, result: dict):
+        """根据登录回复设置驻留表、发送编码与压缩方式，在读取线程中处理回复时调用，
+        因此之后的消息一定按协商结果解码
+
+        参数:
+            self:表明该函数是一个实例方法
+            result(dict):login回复的内容
+
+        返回值:None
+        """
+        for userId, name in result.get('users', []):
+            self.__internTable.define(userId, name)
+        if result.get('codec') == cd.CODEC_BINARY:
+            self.__codec = self.__binaryCodec
+        if result.get('compression') is not None:
+            self.__compressor = cz.FrameCompressor()
+        return None
+
+# 发送请求
+    def request(self, messageDict: dict, plain: bool = False) -> 'Future':
+        """为消息分配请求id后发送，不等待回复，多个请求可以连续发送，
+        服务端带回该id的回复由读取连接的线程交给返回的Future，不再经由receiveMessageDict返回
+
+        参数:
+            self:表明该函数是一个实例方法
+            messageDict(dict):将要被发送的消息字典
+            plain(bool):为True时使用JSON编码且不压缩，用于协商之前的login消息
+
+        返回值:
+            Future:结果为回复的消息字典，请求被限速时为throttle通知，连接关闭时为ConnectionError异常
+        """
+        future = Future()
+        with self.__requestLock:
+            self.__lastRequestId = self.__lastRequestId % cd.MAX_REQUEST_ID + 1
+            requestId = self.__lastRequestId
+            self.__pendingRequests[requestId] = (messageDict['type'], future)
+        try:
+            if plain:
+                self.sendMessage(json.dumps(dict(messageDict, id=requestId)), compress=False)
+            else:
+                self.sendMessage(dict(messageDict, id=requestId))
+        except OSError:
+            with self.__requestLock:
+                self.__pendingRequests.pop(requestId, None)
+            raise
+        return future
+
+# 查询在线用户
+    def queryOnlineUsers(self, timeout: float = None) -> List[str]:
+        """发送get请求并等待回复，用于服务端不推送在线用户时
+
+        参数:
+            self:表明该函数是一个实例方法
+            timeout(float):等待回复的最长秒数，None表示一直等待
+
+        返回值:
+            List[str]:除自己以外的在线用户昵称，请求被限速时为空列表
+        """
+        reply = self.waitResponse(self.request(self.processMessage(None, "get", None)), timeout)
+        if reply['type'] != 'get' or not reply['data']:
+            return []
+        return reply['data'].split(" ")
+
+# 等待回复
+    def waitResponse(self, future: 'Future', timeout: float = None) -> Union[dict, int]:
+        """等待request返回的Future完成，没有其他线程在读取连接时由当前线程读取，
+        期间读到的其他消息留给receiveMessageDict的调用者
+
+        参数:
+            self:表明该函数是一个实例方法
+            future(Future):request返回的Future
+            timeout(float):等待的最长秒数，None表示一直等待
+
+        返回值:
+            dict或int:回复的消息字典，不支持协商的服务端的登录结果为数字
+
+        异常:
+            TimeoutError:超时没有收到回复
+            ConnectionError:连接已被关闭
+        """
+        deadline = None if timeout is None else t.monotonic() + timeout
+        if not self.__waitFor(future.done, deadline):
+            with self.__requestLock:
+                for requestId, (messageType, pending) in list(self.__pendingRequests.items()):
+                    if pending is future:
+                        del self.__pendingRequests[requestId]
+            raise TimeoutError("等待服务端回复超时")
+        return future.result()
+
+# 等待条件成立
+    def __waitFor(self, predicate: Callable[[], bool], deadline: Union[float, None]) -> bool:
+        """等待条件成立，有其他线程在读取连接时等待其处理完一条消息后再检查，
+        否则由当前线程读取并处理一条消息，连接关闭后不再等待
+
+        参数:
+            self:表明该函数是一个实例方法
+            predicate(Callable):条件
+            deadline(float):截止时刻(time.monotonic的秒数)，None表示一直等待
+
+        返回值:
+            bool:True 表明条件成立；False 表明超时或连接已关闭而条件仍不成立
+        """
+        while True:
+            with self.__readCondition:
+                while not predicate() and self.__isReading and not self.__isEnded:
+                    remaining = None if deadline is None else deadline - t.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self.__readCondition.wait(remaining)
+                if predicate():
+                    return True
+                if self.__isEnded or (deadline is not None and t.monotonic() >= deadline):
+                    return False
+                self.__isReading = True
+            try:
+                self.__readMessage(deadline)
+            finally:
+                with self.__readCondition:
+                    self.__isReading = False
+                    self.__readCondition.notify_all()
+
+# 接收一帧数据
+    def __receiveFrame(self, deadline: float = None) -> Union[bytes, memoryview, None]:
+        """从连接中读取数据直到至少解析出一个完整的帧，一次读取得到的多个帧会被缓存供后续调用使用
+
+        参数:
+            self:表明该函数是一个实例方法
+            deadline(float):截止时刻(time.monotonic的秒数)，None表示一直等待
+
+        返回值:
+            bytes|memoryview:一个完整帧的帧体(指向读取到的数据的memoryview)，连接被服务端关闭时返回空字节串，超时返回None
+        """
+        while len(self.__pendingMessages) == 0:
+            if deadline is not None:
+                remaining = deadline - t.monotonic()
+                if remaining <= 0 or not select.select([self.__connectSocket], [], [], remaining)[0]:
+                    return None
+            data = self.__connectSocket.recv(pt.RECEIVE_SIZE)
+            if len(data) == 0:
+                return b''
+            self.__pendingMessages.extend(self.__decoder.feed(data))
+        return self.__pendingMessages.popleft()
+
+# 读取一条消息
+    def __readMessage(self, deadline: float = None):
+        """读取并处理一条消息，需要交给receiveMessageDict调用者的消息放入backlog，
+        只由持有读取权的线程调用
+
+        参数:
+            self:表明该函数是一个实例方法
+            deadline(float):截止时刻(time.monotonic的秒数)，None表示一直等待
+
+        返回值:None
+        """
+        try:
+            frame = self.__receiveFrame(deadline)
+            if frame is None:
+                return None
+            if len(frame) == 0:
+                self.__endConnection()
+                return None
+        # 不支持协商的服务端的登录回复只有登录结果数字
+            if chr(frame[0]).isdigit() and bytes(frame).isdigit():
+                self.__completeRequest(None, 'login', int(bytes(frame)))
+                return None
+            messageDict = cd.decodeMessage(frame, self.__binaryCodec)
+        except pt.FrameError:
+            print("接收到非法数据帧")
+            self.__endConnection()
+            return None
+        except OSError:
+            print("与服务端的连接已被关闭")
+            self.__endConnection()
+            return None
+        except (ValueError, struct.error):
+            print("接收到无法解码的消息")
+            return None
+        if self.__handleMessage(messageDict):
+            with self.__readCondition:
+                self.__backlog.append(messageDict)
+        return None
+
+# 处理消息
+    def __handleMessage(self, messageDict: dict) -> bool:
+        """intern消息用于更新驻留表，ping消息直接回应pong，login回复先应用协商结果，
+        throttle通知记录被限速的请求类型，带有等待中的请求id的回复完成对应的Future，
+        presence消息用于更新本地在线用户集合
+
+        参数:
+            self:表明该函数是一个实例方法
+            messageDict(dict):消息字典
+
+        返回值:
+            bool:True 表明该消息需要交给receiveMessageDict的调用者
+        """
+        messageType = messageDict['type']
+        if messageType == 'intern':
+        # 昵称为None表示服务端已释放该id
+            for userId, name in messageDict['data']:
+                if name is None:
+                    self.__internTable.forget(userId)
+                else:
+                    self.__internTable.define(userId, name)
+            return False
+        if messageType == 'ping':
+        # 服务端在连接空闲时发送ping，回应pong表明客户端仍然在线
+            try:
+                self.sendMessage({'source': self.__nickname, 'destination': None, 'type': 'pong', 'data': None})
+            except OSError:
+                pass
+            return False
+        if messageType == 'login' and isinstance(messageDict['data'], dict):
+            self.__applyLogin(messageDict['data'])
+        elif messageType == 'throttle':
+            data = messageDict['data']
+            self.__throttledUntil[data['request']] = t.monotonic() + data['retryAfter']
+        if self.__completeRequest(cd.getRequestId(messageDict), messageType, messageDict):
+            return False
+        return messageType != 'presence' or self.__applyPresence(messageDict['data'])
+
+# 完成请求
+    def __completeRequest(self, requestId: Union[int, None], messageType: str, reply: Union[dict, int]) -> bool:
+        """将回复交给等待中的请求，没有带回id的登录回复交给最早的等待中的login请求
+
+        参数:
+            self:表明该函数是一个实例方法
+            requestId(int):回复带回的请求id
+            messageType(str):回复的消息类型
+            reply(dict或int):回复
+
+        返回值:
+            bool:True 表明回复已交给等待中的请求
+        """
+        with self.__requestLock:
+            entry = self.__pendingRequests.pop(requestId, None)
+            if entry is None and requestId is None and messageType == 'login':
+                for pendingId, (pendingType, future) in self.__pendingRequests.items():
+                    if pendingType == 'login':
+                        entry = self.__pendingRequests.pop(pendingId)
+                        break
+        if entry is None:
+            return False
+        entry[1].set_result(reply)
+        return True
+
+# 连接结束
+    def __endConnection(self):
+        """服务端关闭连接后调用，等待中的请求以ConnectionError结束"""
+        with self.__requestLock:
+            pending = list(self.__pendingRequests.values())
+            self.__pendingRequests.clear()
+        with self.__readCondition:
+            self.__isEnded = True
+        for messageType, future in pending:
+            future.set_exception(ConnectionError("与服务端的连接已被关闭"))
+        return None
 
 # 消息处理
-    def processMessage(self, targetUser: str, messageType: str, message: str) -> str:
+    def processMessage(self, targetUser: str, messageType: str, message: str) -> dict:
         """消息处理函数，用于发送消息前对消息进行一定的处理
 
         参数:
@@ -74,23 +454,32 @@ class Client(object):
             message(str):消息的具体内容
 
         返回值:
-            messageJSON(str):经过处理后以json格式封装的消息数据
+            messageDict(dict):经过处理后的消息字典，发送时按协商的编码进行编码
         """
         messageDict = {'source': self.__nickname, 'destination': targetUser, 'type': messageType, 'data': message}
-        messageJSON = json.dumps(messageDict)
-        return messageJSON
+        return messageDict
 
 # 发送消息
-    def sendMessage(self, message: str):
+    def sendMessage(self, message: Union[dict, str], compress: bool = True):
         """消息发送函数，用于将封装好的消息发送给服务端
 
         参数:
             self:表明该函数是一个实例方法
-            message(str):将要被发送的消息数据
+            message(dict或str):将要被发送的消息字典，或已经以json格式封装的消息数据
+            compress(bool):为False时即使协商了压缩也不压缩
 
         返回值:None
         """
-        self.__connectSocket.send(message.encode())
+        if isinstance(message, str):
+            payload = message.encode()
+        else:
+            payload = self.__codec.encode(message)
+        if self.__compressor is not None and compress:
+            frame = self.__compressor.packFrame(payload)
+        else:
+            frame = pt.packFrame(payload)
+        with self.__sendLock:
+            self.__connectSocket.sendall(frame)
         return None
 
 # 接收消息
@@ -101,29 +490,134 @@ class Client(object):
             self:表明该函数是一个实例方法
 
         返回值:
-            message(str):经过解码后的消息数据
+            message(str):以json格式封装的消息数据，连接已关闭时为空字符串
 
         """
-        message = None
-        try:
-            message = self.__connectSocket.recv(1024).decode()
-        except ConnectionResetError:
-            print("与服务端的连接已被关闭")
-        return message
+        messageDict = self.receiveMessageDict()
+        if messageDict is None:
+            return ''
+        return json.dumps(messageDict)
+
+# 接收消息字典
+    def receiveMessageDict(self) -> Union[dict, None]:
+        """消息接收函数，接收服务端发来的下一条消息并解码为消息字典，
+        自动识别消息使用的编码，intern消息只用于更新驻留表，不返回给调用者，
+        presence消息用于更新本地在线用户集合，只有集合发生变化时才返回给调用者，
+        服务端的ping消息在此直接回应pong，不返回给调用者，throttle通知会记录被限速的请求类型并返回给调用者，
+        对request发出的请求的回复交给对应的Future，不返回给调用者
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:
+            messageDict(dict):消息字典，None表示连接已关闭或收到非法数据
+        """
+        while True:
+            with self.__readCondition:
+                while len(self.__backlog) == 0 and self.__isReading and not self.__isEnded:
+                    self.__readCondition.wait()
+                if len(self.__backlog) > 0:
+                    return self.__backlog.popleft()
+                if self.__isEnded:
+                    return None
+                self.__isReading = True
+            try:
+                self.__readMessage()
+            finally:
+                with self.__readCondition:
+                    self.__isReading = False
+                    self.__readCondition.notify_all()
+
+# 更新在线用户集合
+    def __applyPresence(self, data: dict) -> bool:
+        """根据服务端推送的快照或增量更新本地在线用户集合，增量的版本号必须紧接本地版本号，
+        出现缺口时向服务端请求新的快照，等待快照期间收到的增量被忽略
+
+        参数:
+            self:表明该函数是一个实例方法
+            data(dict):presence消息的内容，快照包含users，增量包含joined或left
+
+        返回值:
+            bool:True 表明本地在线用户集合发生了变化；False 表明没有变化
+        """
+        version = data['version']
+        if 'users' in data:
+            if self.__presenceVersion is not None and version <= self.__presenceVersion:
+                return False
+            self.__presence = set(data['users'])
+            self.__presenceVersion = version
+            self.__presenceResyncing = False
+            return True
+        if self.__presenceVersion is None or self.__presenceResyncing or version <= self.__presenceVersion:
+            return False
+        if version != self.__presenceVersion + 1:
+            self.__presenceResyncing = True
+            self.sendMessage(self.processMessage(None, "presence", None))
+            return False
+        self.__presence.update(data.get('joined', []))
+        self.__presence.difference_update(data.get('left', []))
+        self.__presenceVersion = version
+        return True
+
+# 限速剩余时间
+    def retryAfter(self, messageType: str) -> float:
+        """返回服务端对该类请求的限速还需持续的秒数，调用者可据此推迟发送
+
+        参数:
+            self:表明该函数是一个实例方法
+            messageType(str):请求类型
+
+        返回值:
+            float:剩余秒数，0表示没有被限速
+        """
+        return max(0.0, self.__throttledUntil.get(messageType, 0.0) - t.monotonic())
+
+# 是否支持在线用户推送
+    def hasPresence(self) -> bool:
+        """返回服务端是否推送在线用户，为False时需要使用get请求查询
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:
+            bool:True 表明本地在线用户集合可用
+        """
+        return self.__presenceVersion is not None
+
+# 获取在线用户
+    def getOnlineUsers(self) -> List[str]:
+        """返回本地在线用户集合中除自己以外的昵称，无需访问服务端
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:
+            List[str]:按昵称排序的在线用户列表
+        """
+        return sorted(self.__presence - {self.__nickname})
 
 # 关闭连接
-    def closeConnection(self):
-        """关闭连接函数，用于客户端与服务端之间结束通信
+    def closeConnection(self, timeout: float = EXIT_TIMEOUT):
+        """关闭连接函数，用于客户端与服务端之间结束通信，发送exit后等待服务端关闭连接，
+        服务端关闭连接即是对exit的回复，超时仍未关闭时由客户端直接关闭
 
         参数:
             self:表明该函数是一个实例方法
+            timeout(float):等待服务端关闭连接的最长秒数
 
         返回值:None
         """
+        if self.__connectSocket is None:
+            self.__isClosed = True
+            return None
         messageDict = {'source': self.__nickname, 'destination': None, 'type': 'exit', 'data': None}
         messageJSON = json.dumps(messageDict)
-        self.__connectSocket.send(messageJSON.encode())
-        t.sleep(1)
+        try:
+            with self.__sendLock:
+                self.__connectSocket.sendall(pt.packFrame(messageJSON.encode()))
+            self.__waitFor(lambda: self.__isEnded, t.monotonic() + timeout)
+        except OSError:
+            pass
         self.__connectSocket.close()
         self.__isClosed = True
         return None
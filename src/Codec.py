@@ -0,0 +1,336 @@
+import json
+import struct
+import threading as td
+from typing import List, Tuple, Union
+
+# 二进制消息头：消息类型(1字节)、标志位(1字节)、发送者id(4字节)、接收者id(4字节)，id为0表示None
+BINARY_HEADER = struct.Struct("!BBII")
+# 内联昵称的长度前缀
+NAME_LENGTH = struct.Struct("!HH")
+# 请求id，紧跟在消息头之后，只有设置了FLAG_REQUEST_ID时存在
+REQUEST_ID = struct.Struct("!I")
+# 请求id的取值范围为1到MAX_REQUEST_ID
+MAX_REQUEST_ID = 0xFFFFFFFF
+# 昵称id的取值范围为1到MAX_INTERN_ID
+MAX_INTERN_ID = 0xFFFFFFFF
+# 消息类型编号，未列出的类型使用TYPE_EXTENDED，消息体为完整的JSON
+TYPE_EXTENDED = 0
+MESSAGE_TYPES = {'login': 1, 'get': 2, 'public': 3, 'private': 4, 'exit': 5, 'history': 6, 'intern': 7,
+                 'presence': 8, 'join': 9, 'leave': 10, 'rooms': 11, 'ping': 12, 'pong': 13,
+                 'throttle': 14}
+TYPE_NAMES = {number: name for name, number in MESSAGE_TYPES.items()}
+# 标志位
+FLAG_NONE_DATA = 0x01
+FLAG_JSON_DATA = 0x02
+FLAG_INLINE_NAMES = 0x04
+FLAG_REQUEST_ID = 0x08
+# JSON消息总是以 { 开头，二进制消息的第一个字节是类型编号，据此区分两种编码
+JSON_MARK = ord("{")
+
+CODEC_JSON = "json"
+CODEC_BINARY = "binary"
+
+
+class InternTable(object):
+    """昵称驻留表，为每个昵称分配一个整数id，二进制消息中只传输id，
+    服务端全局共用一个驻留表，只保存在线用户，用户下线时释放其id，已释放的id不会马上被再次分配，
+    不在表中的昵称以内联方式传输，客户端根据服务端下发的映射维护自己的驻留表
+
+    属性:
+        ids(dict):昵称到id的映射
+        names(dict):id到昵称的映射
+        nextId(int):下一个可分配的id
+    """
+
+# 构造函数
+    def __init__(self):
+        """构造函数，用于驻留表对象初始化"""
+        self.__ids = {}
+        self.__names = {}
+        self.__nextId = 1
+        self.__lock = td.Lock()
+
+# 驻留昵称
+    def intern(self, name: str) -> Tuple[int, bool]:
+        """为昵称分配id，已分配过时直接返回原有id
+
+        参数:
+            self:表明该函数是一个实例方法
+            name(str):用户昵称
+
+        返回值:
+            Tuple[int, bool]:昵称对应的id，以及是否为新分配的id
+        """
+        userId = self.__ids.get(name)
+        if userId is not None:
+            return userId, False
+        with self.__lock:
+            userId = self.__ids.get(name)
+            if userId is not None:
+                return userId, False
+        # id按顺序分配，用尽后从头开始并跳过仍在使用的id
+            while self.__nextId in self.__names or self.__nextId > MAX_INTERN_ID:
+                self.__nextId = 1 if self.__nextId > MAX_INTERN_ID else self.__nextId + 1
+            userId = self.__nextId
+            self.__nextId += 1
+            self.__ids[name] = userId
+            self.__names[userId] = name
+        return userId, True
+
+# 定义映射
+    def define(self, userId: int, name: str):
+        """记录服务端下发的id与昵称的映射，由客户端调用
+
+        参数:
+            self:表明该函数是一个实例方法
+            userId(int):服务端分配的id
+            name(str):用户昵称
+
+        返回值:None
+        """
+        with self.__lock:
+            self.__ids[name] = userId
+            self.__names[userId] = name
+        return None
+
+# 释放昵称
+    def release(self, name: str) -> Union[int, None]:
+        """用户下线时由服务端调用，删除昵称与id的映射，之后涉及该昵称的消息以内联方式传输
+
+        参数:
+            self:表明该函数是一个实例方法
+            name(str):用户昵称
+
+        返回值:
+            int:被释放的id，None表示该昵称不在表中
+        """
+        with self.__lock:
+            userId = self.__ids.pop(name, None)
+            if userId is not None:
+                del self.__names[userId]
+        return userId
+
+# 忘记映射
+    def forget(self, userId: int):
+        """收到服务端释放id的通知时由客户端调用，此后发送时不再使用该id，
+        仍保留id到昵称的映射，用于解码释放之前已经发出的消息
+
+        参数:
+            self:表明该函数是一个实例方法
+            userId(int):被释放的id
+
+        返回值:None
+        """
+        with self.__lock:
+            name = self.__names.get(userId)
+            if name is not None and self.__ids.get(name) == userId:
+                del self.__ids[name]
+        return None
+
+# 查询id
+    def lookupId(self, name: Union[str, None]) -> Union[int, None]:
+        """返回昵称对应的id，None对应0，未驻留的昵称返回None"""
+        if name is None:
+            return 0
+        return self.__ids.get(name)
+
+# 查询昵称
+    def lookupName(self, userId: int) -> Union[str, None]:
+        """返回id对应的昵称，0或未知的id返回None"""
+        return self.__names.get(userId)
+
+# 全部映射
+    def items(self) -> List[List[Union[int, str]]]:
+        """返回全部id与昵称的映射，用于在登录时下发给客户端"""
+        return [[userId, name] for userId, name in list(self.__names.items())]
+
+
+# 解析JSON文本
+def loadJson(text: str) -> object:
+    """解析收到的JSON文本，拒绝以\\u转义写出的孤立代理项，这样的字符串无法编码为UTF-8，
+    会在转发给二进制编码的客户端或写入数据库时失败，因此在解码时一次性拒绝，
+    合法的代理对(例如emoji)同样以\\ud开头的转义写出，只有出现这类转义时才检查
+
+    参数:
+        text(str):JSON文本
+
+    返回值:
+        object:解析结果
+
+    异常:
+        ValueError:不是合法的JSON，或包含孤立代理项(UnicodeEncodeError)
+    """
+    value = json.loads(text)
+    if "\\ud" in text or "\\uD" in text:
+        json.dumps(value, ensure_ascii=False).encode("utf-8")
+    return value
+
+
+class JsonCodec(object):
+    """JSON编码类，与原有的消息格式完全一致，作为协商失败时的后备编码"""
+    name = CODEC_JSON
+
+# 编码
+    def encode(self, messageDict: dict) -> bytes:
+        """将消息字典编码为JSON字节串"""
+        return json.dumps(messageDict).encode()
+
+# 解码
+    def decode(self, payload: Union[bytes, memoryview]) -> dict:
+        """将JSON字节串解码为消息字典，payload可以是指向接收缓冲区的memoryview"""
+        return loadJson(str(payload, "utf-8"))
+
+
+class BinaryCodec(object):
+    """紧凑二进制编码类，消息头为定长结构，消息类型使用编号，昵称使用驻留表中的id，消息内容为UTF-8字节串，
+    不在驻留表中的昵称以内联方式传输，未知的消息类型整体以JSON传输
+
+    属性:
+        internTable(InternTable):昵称驻留表
+    """
+    name = CODEC_BINARY
+
+# 构造函数
+    def __init__(self, internTable: 'InternTable'):
+        """构造函数，用于二进制编码对象初始化"""
+        self.__internTable = internTable
+
+# 编码
+    def encode(self, messageDict: dict) -> bytes:
+        """将消息字典编码为二进制字节串
+
+        参数:
+            self:表明该函数是一个实例方法
+            messageDict(dict):包含source、destination、type、data的消息字典，可以带有请求id
+
+        返回值:
+            bytes:编码后的字节串
+        """
+        messageType = MESSAGE_TYPES.get(messageDict['type'])
+        if messageType is None:
+            return BINARY_HEADER.pack(TYPE_EXTENDED, 0, 0, 0) + json.dumps(messageDict).encode()
+
+        source = messageDict['source']
+        destination = messageDict['destination']
+        data = messageDict['data']
+        flags = 0
+        if data is None:
+            flags |= FLAG_NONE_DATA
+            body = b''
+        elif isinstance(data, str):
+            body = data.encode()
+        else:
+            flags |= FLAG_JSON_DATA
+            body = json.dumps(data).encode()
+
+        sourceId = self.__internTable.lookupId(source)
+        destinationId = self.__internTable.lookupId(destination)
+        if sourceId is None or destinationId is None:
+            flags |= FLAG_INLINE_NAMES
+            sourceName = (source or "").encode()
+            destinationName = (destination or "").encode()
+            body = NAME_LENGTH.pack(len(sourceName), len(destinationName)) + sourceName + destinationName + body
+            sourceId = 0
+            destinationId = 0
+        requestId = getRequestId(messageDict)
+        if requestId is not None:
+            flags |= FLAG_REQUEST_ID
+            body = REQUEST_ID.pack(requestId) + body
+        return BINARY_HEADER.pack(messageType, flags, sourceId, destinationId) + body
+
+# 解码
+    def decode(self, payload: Union[bytes, memoryview]) -> dict:
+        """将二进制字节串解码为消息字典，字符串直接从payload的切片解码，不经过中间的bytes对象
+
+        参数:
+            self:表明该函数是一个实例方法
+            payload(bytes|memoryview):帧体，可以是指向接收缓冲区的memoryview
+
+        返回值:
+            dict:包含source、destination、type、data的消息字典，带有请求id时另有id
+        """
+        messageType, flags, sourceId, destinationId = BINARY_HEADER.unpack_from(payload)
+        offset = BINARY_HEADER.size
+        if messageType == TYPE_EXTENDED:
+            return loadJson(str(payload[offset:], "utf-8"))
+        requestId = None
+        if flags & FLAG_REQUEST_ID:
+            requestId, = REQUEST_ID.unpack_from(payload, offset)
+            offset += REQUEST_ID.size
+
+        if flags & FLAG_INLINE_NAMES:
+            sourceLength, destinationLength = NAME_LENGTH.unpack_from(payload, offset)
+            offset += NAME_LENGTH.size
+            source = str(payload[offset:offset + sourceLength], "utf-8") or None
+            offset += sourceLength
+            destination = str(payload[offset:offset + destinationLength], "utf-8") or None
+            offset += destinationLength
+        else:
+            source = self.__internTable.lookupName(sourceId)
+            destination = self.__internTable.lookupName(destinationId)
+        # 已释放的id无法还原为昵称，不能当作None处理
+            if (source is None and sourceId != 0) or (destination is None and destinationId != 0):
+                raise ValueError("未知的昵称id")
+
+        if flags & FLAG_NONE_DATA:
+            data = None
+        elif flags & FLAG_JSON_DATA:
+            data = loadJson(str(payload[offset:], "utf-8"))
+        else:
+            data = str(payload[offset:], "utf-8")
+        messageDict = {'source': source, 'destination': destination, 'type': TYPE_NAMES.get(messageType), 'data': data}
+        if requestId is not None:
+            messageDict['id'] = requestId
+        return messageDict
+
+
+JSON_CODEC = JsonCodec()
+
+
+# 获取请求id
+def getRequestId(messageDict: dict) -> Union[int, None]:
+    """返回消息携带的请求id，服务端在对该请求的回复中原样带回，客户端据此将回复与请求配对，
+    不在1到MAX_REQUEST_ID范围内的id被视为没有携带
+
+    参数:
+        messageDict(dict):消息字典
+
+    返回值:
+        int:请求id，None表示没有携带
+    """
+    requestId = messageDict.get('id')
+    if isinstance(requestId, int) and not isinstance(requestId, bool) and 0 < requestId <= MAX_REQUEST_ID:
+        return requestId
+    return None
+
+
+# 自动识别编码并解码
+def decodeMessage(payload: Union[bytes, memoryview], binaryCodec: 'BinaryCodec') -> dict:
+    """根据帧体的第一个字节判断编码方式并解码，接收方因此无需记录对端使用的编码
+
+    参数:
+        payload(bytes|memoryview):帧体
+        binaryCodec(BinaryCodec):二进制编码对象
+
+    返回值:
+        dict:解码后的消息字典
+    """
+    if len(payload) > 0 and payload[0] == JSON_MARK:
+        return JSON_CODEC.decode(payload)
+    return binaryCodec.decode(payload)
+
+
+# 协商编码
+def negotiate(offeredCodecs: Union[List[str], None]) -> str:
+    """从客户端提供的编码列表中按顺序选出第一个服务端支持的编码，都不支持时使用JSON
+
+    参数:
+        offeredCodecs(List[str]):客户端在login消息中提供的编码列表，按优先级排列
+
+    返回值:
+        str:协商结果
+    """
+    for codecName in offeredCodecs or []:
+        if codecName in (CODEC_BINARY, CODEC_JSON):
+            return codecName
+    return CODEC_JSON
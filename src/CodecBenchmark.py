@@ -0,0 +1,103 @@
+import time as t
+import json
+import sys
+import argparse
+from typing import List, Dict, Union
+import Codec as cd
+
+
+# 生成典型消息
+def sampleMessages() -> Dict[str, dict]:
+    """生成聊天室中最常见的几类消息，用于比较不同编码的大小与速度
+
+    返回值:
+        Dict[str, dict]:消息名称到消息字典的映射
+    """
+    return {
+        'public-short': {'source': "alice", 'destination': None, 'type': "public", 'data': "hello everyone"},
+        'private-short': {'source': "alice", 'destination': "bob", 'type': "private", 'data': "see you at 8"},
+        'public-long': {'source': "alice", 'destination': None, 'type': "public", 'data': "聊天消息" * 64},
+        'get': {'source': "alice", 'destination': None, 'type': "get", 'data': None},
+        'online-users': {'source': "alice", 'destination': None, 'type': "get",
+                         'data': " ".join("user{}".format(index) for index in range(50))},
+        'exit': {'source': "alice", 'destination': None, 'type': "exit", 'data': None},
+    }
+
+
+# 计时
+def measure(function, argument, iterations: int) -> float:
+    """重复调用函数并返回平均每次调用的耗时
+
+    参数:
+        function:被测函数
+        argument:传给被测函数的参数
+        iterations(int):调用次数
+
+    返回值:
+        float:平均耗时(微秒)
+    """
+    startTime = t.perf_counter()
+    for _ in range(iterations):
+        function(argument)
+    return (t.perf_counter() - startTime) / iterations * 1e6
+
+
+# 比较编码
+def benchmarkCodecs(iterations: int) -> Dict[str, Dict[str, Dict[str, Union[int, float]]]]:
+    """对每类消息分别使用JSON与二进制编码，记录编码后的字节数以及编码、解码的平均耗时
+
+    参数:
+        iterations(int):每项测试的调用次数
+
+    返回值:
+        Dict:消息名称 -> 编码名称 -> bytes、encodeUs、decodeUs
+    """
+    internTable = cd.InternTable()
+    for name in ("alice", "bob"):
+        internTable.intern(name)
+    codecs = {cd.CODEC_JSON: cd.JSON_CODEC, cd.CODEC_BINARY: cd.BinaryCodec(internTable)}
+
+    results = {}
+    for messageName, messageDict in sampleMessages().items():
+        results[messageName] = {}
+        for codecName, codec in codecs.items():
+            payload = codec.encode(messageDict)
+            assert codec.decode(payload) == messageDict
+            results[messageName][codecName] = {'bytes': len(payload),
+                                               'encodeUs': measure(codec.encode, messageDict, iterations),
+                                               'decodeUs': measure(codec.decode, payload, iterations)}
+    return results
+
+
+# 主函数
+def main(argv: List[str] = None) -> int:
+    """比较JSON编码与二进制编码的消息大小以及编码、解码耗时
+
+    参数:
+        argv(List[str]):命令行参数列表，为None时使用sys.argv
+
+    返回值:
+        int:返回数字0表明程序正常执行结束
+    """
+    parser = argparse.ArgumentParser(description="JSON编码与二进制编码的大小与速度对比测试")
+    parser.add_argument("--iterations", type=int, default=100000, help="每项测试的调用次数")
+    parser.add_argument("--json", dest="jsonPath", default=None, help="将结果以JSON格式写入该文件")
+    arguments = parser.parse_args(argv)
+
+    results = benchmarkCodecs(arguments.iterations)
+
+    print("{:<16}{:<8}{:>8}{:>12}{:>12}".format("message", "codec", "bytes", "encode(us)", "decode(us)"))
+    for messageName, codecResults in results.items():
+        for codecName, result in codecResults.items():
+            print("{:<16}{:<8}{:>8}{:>12.2f}{:>12.2f}".format(messageName, codecName, result['bytes'],
+                                                            result['encodeUs'], result['decodeUs']))
+
+    if arguments.jsonPath is not None:
+        with open(arguments.jsonPath, "w") as jsonFile:
+            json.dump(results, jsonFile, indent=2)
+    return 0
+
+
+# 运行程序
+if __name__ == "__main__":
+    sys.exit(main())
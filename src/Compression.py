@@ -0,0 +1,102 @@
+import threading as td
+import time as t
+import zlib
+from typing import Dict, List, Union
+import Protocol as pt
+
+COMPRESSION_ZLIB = "zlib"
+# 帧体不小于该字节数时才尝试压缩，短消息压缩收益很小且浪费CPU
+COMPRESSION_THRESHOLD = 1024
+COMPRESSION_LEVEL = 6
+
+
+class FrameCompressor(object):
+    """帧压缩类，帧体超过阈值时使用zlib压缩，压缩后没有变小时仍发送原始帧体，
+    同时统计压缩比与压缩消耗的CPU时间，用于调整压缩阈值
+
+    属性:
+        threshold(int):尝试压缩的最小帧体长度
+        level(int):zlib压缩级别
+        stats(dict):帧数、压缩帧数、低于阈值帧数、无法压缩帧数、压缩前后字节数以及CPU时间
+    """
+
+# 构造函数
+    def __init__(self, threshold: int = COMPRESSION_THRESHOLD, level: int = COMPRESSION_LEVEL):
+        """构造函数，用于帧压缩对象初始化"""
+        self.__threshold = threshold
+        self.__level = level
+        self.__lock = td.Lock()
+        self.__stats = {'frames': 0, 'compressedFrames': 0, 'belowThreshold': 0, 'incompressible': 0,
+                        'bytesIn': 0, 'bytesOut': 0, 'cpuSeconds': 0.0}
+
+# 封装帧
+    def packFrame(self, payload: bytes) -> bytes:
+        """将帧体封装成帧，帧体超过阈值且压缩后变小时发送压缩帧
+
+        参数:
+            self:表明该函数是一个实例方法
+            payload(bytes):编码后的帧体
+
+        返回值:
+            bytes:带有长度前缀的帧数据
+        """
+        if len(payload) < self.__threshold:
+            with self.__lock:
+                self.__stats['frames'] += 1
+                self.__stats['belowThreshold'] += 1
+            return pt.packFrame(payload)
+
+    # 使用线程CPU时间，不受其他线程与等待时间影响
+        startTime = t.thread_time()
+        compressedPayload = zlib.compress(payload, self.__level)
+        cpuSeconds = t.thread_time() - startTime
+        isSmaller = len(compressedPayload) < len(payload)
+        with self.__lock:
+            self.__stats['frames'] += 1
+            self.__stats['cpuSeconds'] += cpuSeconds
+            self.__stats['bytesIn'] += len(payload)
+            if isSmaller:
+                self.__stats['compressedFrames'] += 1
+                self.__stats['bytesOut'] += len(compressedPayload)
+            else:
+                self.__stats['incompressible'] += 1
+                self.__stats['bytesOut'] += len(payload)
+        if isSmaller:
+            return pt.packFrame(compressedPayload, compressed=True)
+        return pt.packFrame(payload)
+
+# 获取统计信息
+    def getStats(self) -> Dict[str, Union[int, float]]:
+        """返回压缩统计信息，ratio为尝试压缩的帧体压缩后与压缩前的字节数之比
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:
+            Dict:统计信息
+        """
+        with self.__lock:
+            stats = dict(self.__stats)
+        attempts = stats['compressedFrames'] + stats['incompressible']
+        stats['threshold'] = self.__threshold
+        stats['ratio'] = stats['bytesOut'] / stats['bytesIn'] if stats['bytesIn'] > 0 else 1.0
+        stats['savedBytes'] = stats['bytesIn'] - stats['bytesOut']
+        stats['cpuUsPerFrame'] = stats['cpuSeconds'] / attempts * 1e6 if attempts > 0 else 0.0
+        stats['mbPerCpuSecond'] = stats['bytesIn'] / stats['cpuSeconds'] / 1e6 if stats['cpuSeconds'] > 0 else 0.0
+        return stats
+
+
+# 协商压缩方式
+def negotiate(offeredCompressions: Union[List[str], None]) -> Union[str, None]:
+    """从客户端在login消息中提供的压缩方式中选出服务端支持的一种
+
+    参数:
+        offeredCompressions(List[str]):客户端支持的压缩方式，按优先级排列
+
+    返回值:
+        str:协商结果，None表示不压缩
+    """
+    for compression in offeredCompressions or []:
+        if compression == COMPRESSION_ZLIB:
+            return compression
+    return None
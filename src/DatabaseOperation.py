@@ -1,5 +1,197 @@
-import pymysql as pq
-from typing import List, Tuple, Union
+import threading as td
+import time as t
+from collections import deque
+from typing import Callable, Dict, Iterable, List, Tuple, Union
+import AuthCache as ac
+import StorageBackend as sb
+
+# searchMany单条查询语句中包含的最大用户名数量
+SEARCH_BATCH_SIZE = 1000
+
+
+class PoolTimeoutError(Exception):
+    """在规定时间内没有可用的数据库连接"""
+    pass
+
+
+class ConnectionPool(object):
+    """数据库连接池类，复用已建立的数据库连接，避免每次操作都重新进行TCP连接和身份认证
+
+    属性:
+        connect(Callable):用于创建新连接的函数，可替换为其它驱动或测试用的假驱动
+        maxSize(int):连接池允许的最大连接数(包括空闲和已借出的连接)
+        maxIdleTime(float):空闲连接的最长保留时间(秒)，超过后被关闭
+        checkoutTimeout(float):借出连接的最长等待时间(秒)
+        healthCheckInterval(float):空闲超过该时间(秒)的连接在借出前先进行健康检查
+        idleConnections(deque):空闲连接及其归还时间
+        size(int):当前连接总数
+        stats(dict):连接池的统计信息
+    """
+
+# 构造函数
+    def __init__(self, connect: Callable[[], 'Connection'], maxSize: int = 10, maxIdleTime: float = 300,
+                 checkoutTimeout: float = 5, healthCheckInterval: float = 30):
+        """构造函数，用于连接池对象初始化"""
+        self.__connect = connect
+        self.__maxSize = maxSize
+        self.__maxIdleTime = maxIdleTime
+        self.__checkoutTimeout = checkoutTimeout
+        self.__healthCheckInterval = healthCheckInterval
+        self.__idleConnections = deque()
+        self.__size = 0
+        self.__condition = td.Condition()
+        self.__stats = {'created': 0, 'closed': 0, 'checkouts': 0, 'waits': 0, 'timeouts': 0,
+                        'evicted': 0, 'healthCheckFailures': 0}
+
+# 关闭连接
+    def __discard(self, conn: 'Connection'):
+        """关闭一个连接并将其从连接总数中扣除，调用时不持有锁
+
+        参数:
+            self:表明该函数是一个实例方法
+            conn(Connection):需要关闭的连接
+
+        返回值:None
+        """
+        try:
+            conn.close()
+        except Exception:
+            pass
+        with self.__condition:
+            self.__size -= 1
+            self.__stats['closed'] += 1
+            self.__condition.notify()
+        return None
+
+# 健康检查
+    def __isHealthy(self, conn: 'Connection') -> bool:
+        """检查连接是否仍然可用，驱动不支持ping时视为可用
+
+        参数:
+            self:表明该函数是一个实例方法
+            conn(Connection):需要检查的连接
+
+        返回值:
+            bool:True 表明连接可用
+        """
+        ping = getattr(conn, "ping", None)
+        if ping is None:
+            return True
+        try:
+            ping(reconnect=False)
+        except Exception:
+            return False
+        return True
+
+# 借出连接
+    def acquire(self) -> 'Connection':
+        """从连接池借出一个连接，没有空闲连接且未达到上限时创建新连接，否则等待其它线程归还
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:
+            conn(Connection):可用的数据库连接
+        """
+        deadline = t.monotonic() + self.__checkoutTimeout
+        while True:
+            conn = None
+            expired = []
+            with self.__condition:
+                now = t.monotonic()
+            # 淘汰空闲时间过长的连接，最早归还的连接位于队首
+                while len(self.__idleConnections) > 0 and now - self.__idleConnections[0][1] > self.__maxIdleTime:
+                    expired.append(self.__idleConnections.popleft()[0])
+                    self.__stats['evicted'] += 1
+                if len(self.__idleConnections) > 0:
+                # 优先使用最近归还的连接
+                    conn, releaseTime = self.__idleConnections.pop()
+                    needCheck = now - releaseTime > self.__healthCheckInterval
+                elif self.__size - len(expired) < self.__maxSize:
+                    self.__size += 1
+                    needCheck = False
+                else:
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        self.__stats['timeouts'] += 1
+                        raise PoolTimeoutError("{}秒内没有可用的数据库连接".format(self.__checkoutTimeout))
+                    self.__stats['waits'] += 1
+                    self.__condition.wait(remaining)
+                    continue
+            for expiredConn in expired:
+                self.__discard(expiredConn)
+
+            if conn is None:
+                try:
+                    conn = self.__connect()
+                except Exception:
+                    with self.__condition:
+                        self.__size -= 1
+                        self.__condition.notify()
+                    raise
+                with self.__condition:
+                    self.__stats['created'] += 1
+            elif needCheck and not self.__isHealthy(conn):
+                with self.__condition:
+                    self.__stats['healthCheckFailures'] += 1
+                self.__discard(conn)
+                continue
+
+            with self.__condition:
+                self.__stats['checkouts'] += 1
+            return conn
+
+# 归还连接
+    def release(self, conn: 'Connection', broken: bool = False):
+        """归还借出的连接，出现异常的连接直接关闭而不放回连接池
+
+        参数:
+            self:表明该函数是一个实例方法
+            conn(Connection):借出的连接
+            broken(bool):连接在使用过程中是否出现异常
+
+        返回值:None
+        """
+        if broken:
+            self.__discard(conn)
+            return None
+        with self.__condition:
+            self.__idleConnections.append((conn, t.monotonic()))
+            self.__condition.notify()
+        return None
+
+# 关闭连接池
+    def closeAll(self):
+        """关闭全部空闲连接，已借出的连接在归还后仍会放回连接池
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:None
+        """
+        with self.__condition:
+            idleConnections = [conn for conn, releaseTime in self.__idleConnections]
+            self.__idleConnections.clear()
+        for conn in idleConnections:
+            self.__discard(conn)
+        return None
+
+# 获取统计信息
+    def getStats(self) -> Dict[str, int]:
+        """返回连接池的统计信息
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:
+            Dict[str, int]:连接总数、空闲数、借出数以及创建、关闭、借出、等待、超时、淘汰和健康检查失败的次数
+        """
+        with self.__condition:
+            stats = dict(self.__stats)
+            stats['size'] = self.__size
+            stats['idle'] = len(self.__idleConnections)
+            stats['inUse'] = self.__size - len(self.__idleConnections)
+        return stats
 
 
 class DatabaseUtils(object):
@@ -12,21 +204,77 @@ class DatabaseUtils(object):
         password(str):数据库用户的密码
         database(str):存储数据的数据库名
         table(str):存储数据的数据表名
+        backend(StorageBackend):存储后端，负责创建连接并提供语句方言，未指定时使用MySQL
+        pool(ConnectionPool):数据库连接池，所有操作共用池中的连接
+        insertSQL(str):插入用户的参数化语句
+        searchSQL(str):查询单个用户的参数化语句
+        authCache(AuthCache):身份验证缓存，isExist优先使用缓存进行验证
     """
 
 # 构造函数
-    def __init__(self, host="localhost", port=3306, user=None, password=None, database=None, table=None):
-        """构造方法，用于对实例对象初始化"""
+    def __init__(self, host="localhost", port=3306, user=None, password=None, database=None, table=None,
+                 poolSize=10, maxIdleTime=300, checkoutTimeout=5, connector=None, authCache=None, backend=None):
+        """构造方法，用于对实例对象初始化，connector用于替换存储后端默认的连接函数"""
         self.__host = host
         self.__port = port
         self.__user = user
         self.__password = password
         self.__database = database
         self.__table = table
+        if backend is None:
+            backend = sb.MySQLBackend(host=host, port=port, user=user, password=password,
+                                      database=database, table=table)
+        self.__backend = backend
+        self.__connector = connector or backend.connect
+        self.__isInitialized = False
+        self.__initLock = td.Lock()
+        self.__pool = ConnectionPool(self.__connect, maxSize=poolSize,
+                                     maxIdleTime=maxIdleTime, checkoutTimeout=checkoutTimeout)
+    # 语句只在初始化时生成一次，数据全部以参数形式传递
+        tableName = backend.userTable
+        name = backend.quoteIdentifier("name")
+        password = backend.quoteIdentifier("password")
+        mark = backend.placeholder
+        self.__insertSQL = "insert into {} ({}, {}) values ({}, {})".format(tableName, name, password, mark, mark)
+        self.__searchSQL = "select {}, {} from {} where {} = {}".format(name, password, tableName, name, mark)
+        self.__searchManySQL = "select {}, {} from {} where {} in ({{}})".format(name, password, tableName, name)
+        self.__updatePasswordSQL = "update {} set {} = {} where {} = {}".format(tableName, password, mark, name, mark)
+        self.__authCache = authCache if authCache is not None else ac.AuthCache()
+        messageColumns = "conversation, source, destination, type, data, createdAt"
+        self.__insertMessageSQL = "insert into {} ({}) values ({})".format(
+            backend.messageTable, messageColumns, backend.placeholders(6))
+        self.__searchMessageSQL = "select id, {} from {} where conversation = {} and id < {} " \
+                                  "order by id desc limit {}".format(messageColumns, backend.messageTable,
+                                                                     mark, mark, mark)
+        mailboxColumns = "recipient, source, data, createdAt"
+        self.__insertMailboxSQL = "insert into {} ({}) values ({})".format(
+            backend.mailboxTable, mailboxColumns, backend.placeholders(4))
+        self.__takeMailboxSQL = "select id, source, data, createdAt from {} where recipient = {} " \
+                                "order by id limit {}".format(backend.mailboxTable, mark, mark)
+        self.__deleteMailboxSQL = "delete from {} where recipient = {} and id <= {}".format(
+            backend.mailboxTable, mark, mark)
+        self.__countMailboxSQL = "select recipient, count(*) from {} group by recipient".format(backend.mailboxTable)
+
+# 创建数据库连接
+    def __connect(self) -> 'Connection':
+        """数据库连接函数，供连接池在需要新连接时调用，第一个连接建立后由存储后端初始化数据表
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:
+            conn(Connection):Connection类的对象，用于后续对数据库的操作
+        """
+        conn = self.__connector()
+        with self.__initLock:
+            if not self.__isInitialized:
+                self.__backend.initialize(conn)
+                self.__isInitialized = True
+        return conn
 
 # 与数据库连接
     def __getConnection(self) -> 'Connection':
-        """数据库连接函数，用于与数据库进行连接操作
+        """从连接池中借出一个数据库连接
 
         参数:
             self:表明该函数是一个实例方法
@@ -34,23 +282,74 @@ class DatabaseUtils(object):
         返回值:
             conn(Connection):Connection类的对象，用于后续对数据库的操作
         """
-        conn = pq.connect(host=self.__host, port=self.__port, db=self.__database,
-                          user=self.__user, password=self.__password, charset="utf8", autocommit=True)
-        return conn
+        return self.__pool.acquire()
 
 # 关闭连接
-    def __closeConnection(self, conn: 'Connection'):
-        """关闭连接函数，用于执行操作完成后与数据库断开连接
+    def __closeConnection(self, conn: 'Connection', broken: bool = False):
+        """操作完成后将连接归还连接池，出现异常的连接会被关闭
 
         参数:
             self:表明该函数是一个实例方法
             conn(Connection):Connection类的对象，用于后续对数据库的操作
+            broken(bool):连接在使用过程中是否出现异常
 
         返回值:None
         """
-        conn.close()
+        self.__pool.release(conn, broken)
         return None
 
+# 获取连接池统计信息
+    def getPoolStats(self) -> Dict[str, int]:
+        """返回连接池的统计信息
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:
+            Dict[str, int]:连接池的统计信息
+        """
+        return self.__pool.getStats()
+
+# 获取身份验证缓存统计信息
+    def getAuthCacheStats(self) -> Dict[str, Union[int, float]]:
+        """返回身份验证缓存的统计信息
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:
+            Dict:身份验证缓存的命中、未命中等统计信息
+        """
+        return self.__authCache.getStats()
+
+# 执行语句
+    def __execute(self, sql: str, args: Union[tuple, List[tuple]] = None, many: bool = False) -> tuple:
+        """查询层的统一入口，使用参数化的方式执行语句，借出的连接在执行完成后归还连接池
+
+        参数:
+            self:表明该函数是一个实例方法
+            sql(str):使用存储后端占位符的语句
+            args(tuple):语句参数，many为True时为参数元组的列表
+            many(bool):是否使用executemany批量执行
+
+        返回值:
+            tuple:查询结果，非查询语句为空元组
+        """
+        conn = self.__getConnection()
+        try:
+            cursor = conn.cursor()
+            if many:
+                cursor.executemany(sql, args)
+            else:
+                cursor.execute(sql, args)
+            data = cursor.fetchall()
+            cursor.close()
+        except Exception:
+            self.__closeConnection(conn, broken=True)
+            raise
+        self.__closeConnection(conn)
+        return data
+
 # 数据插入
     def insertValues(self, name: str, password: str):
         """数据插入函数，用于将用户的注册信息存入数据库
@@ -62,13 +361,40 @@ class DatabaseUtils(object):
 
         返回值:None
         """
-        sql = "insert into `%s`.`%s` (`name`, `password`) values ('%s', '%s');" % (
-            self.__database, self.__table, name, password)
-        conn = self.__getConnection()
-        cursor = conn.cursor()
-        cursor.execute(sql)
-        cursor.close()
-        self.__closeConnection(conn)
+        self.__execute(self.__insertSQL, (name, password))
+        self.__authCache.invalidate(name)
+        return None
+
+# 批量数据插入
+    def insertMany(self, users: Iterable[Tuple[str, str]]):
+        """批量插入函数，使用executemany在一次请求中插入多个用户，用于批量导入用户
+
+        参数:
+            self:表明该函数是一个实例方法
+            users(Iterable[Tuple[str, str]]):由用户名和密码组成的二元组序列
+
+        返回值:None
+        """
+        users = list(users)
+        if len(users) > 0:
+            self.__execute(self.__insertSQL, users, many=True)
+            for name, password in users:
+                self.__authCache.invalidate(name)
+        return None
+
+# 修改密码
+    def updatePassword(self, name: str, password: str):
+        """修改用户的密码，并使该用户的身份验证缓存失效
+
+        参数:
+            self:表明该函数是一个实例方法
+            name(str):用户名
+            password(str):新密码
+
+        返回值:None
+        """
+        self.__execute(self.__updatePasswordSQL, (password, name))
+        self.__authCache.invalidate(name)
         return None
 
 # 数据查询
@@ -83,17 +409,140 @@ class DatabaseUtils(object):
             Tuple[str, str]:表示成功查找到用户的数据，返回一个存储用户昵称和密码的二元组
             Tuple[None, None]:表示用户的数据不存在
         """
-        sql = "select name, password from `%s`.`%s` where name = '%s';" % (self.__database, self.__table, name)
-        conn = self.__getConnection()
-        cursor = conn.cursor()
-        cursor.execute(sql)
-        data = cursor.fetchall()
-        cursor.close()
-        self.__closeConnection(conn)
+        data = self.__execute(self.__searchSQL, (name, ))
         if len(data) == 0:
             data = ((None, None),)
         return data[0]
 
+# 批量数据查询
+    def searchMany(self, names: Iterable[str]) -> Dict[str, str]:
+        """批量查询函数，使用 where name in (...) 在一次请求中查询多个用户，
+        用户名数量超过SEARCH_BATCH_SIZE时分成多条语句
+
+        参数:
+            self:表明该函数是一个实例方法
+            names(Iterable[str]):需要查询的用户名
+
+        返回值:
+            Dict[str, str]:存在的用户名到密码的映射，不存在的用户不会出现在结果中
+        """
+        names = list(dict.fromkeys(names))
+        result = {}
+        for start in range(0, len(names), SEARCH_BATCH_SIZE):
+            batch = names[start:start + SEARCH_BATCH_SIZE]
+            sql = self.__searchManySQL.format(self.__backend.placeholders(len(batch)))
+            for name, password in self.__execute(sql, tuple(batch)):
+                result[name] = password
+        return result
+
+
+# 批量写入聊天记录
+    def insertMessages(self, messages: List[tuple]):
+        """在一个事务中批量写入聊天记录
+
+        参数:
+            self:表明该函数是一个实例方法
+            messages(List[tuple]):由会话、发送者、接收者、消息类型、消息内容和时间组成的元组列表
+
+        返回值:None
+        """
+        if len(messages) > 0:
+            self.__executeTransaction(lambda cursor: cursor.executemany(self.__insertMessageSQL, messages))
+        return None
+
+# 执行事务
+    def __executeTransaction(self, work: Callable[['Cursor'], object]) -> object:
+        """借出一个连接并在一个事务中执行work，成功时提交，出现异常时回滚并关闭该连接
+
+        参数:
+            self:表明该函数是一个实例方法
+            work(Callable):接收游标并执行语句的函数
+
+        返回值:
+            object:work的返回值
+        """
+        conn = self.__getConnection()
+        try:
+            self.__backend.beginTransaction(conn)
+            cursor = conn.cursor()
+            result = work(cursor)
+            cursor.close()
+            conn.commit()
+        except Exception:
+            try:
+                conn.rollback()
+            except Exception:
+                pass
+            self.__closeConnection(conn, broken=True)
+            raise
+        self.__closeConnection(conn)
+        return result
+
+# 分页查询聊天记录
+    def searchMessages(self, conversation: str, beforeId: int = None, limit: int = 50) -> List[tuple]:
+        """按消息id倒序查询某个会话中id小于beforeId的聊天记录，使用(conversation, id)索引
+
+        参数:
+            self:表明该函数是一个实例方法
+            conversation(str):会话标识
+            beforeId(int):游标，只返回id小于该值的记录，None表示从最新的记录开始
+            limit(int):最多返回的记录数
+
+        返回值:
+            List[tuple]:由id、会话、发送者、接收者、消息类型、消息内容和时间组成的元组列表
+        """
+        if beforeId is None:
+            beforeId = 2 ** 63 - 1
+        return list(self.__execute(self.__searchMessageSQL, (conversation, beforeId, limit)))
+
+
+# 批量写入离线消息
+    def insertMailbox(self, entries: List[tuple]):
+        """在一个事务中批量写入离线消息
+
+        参数:
+            self:表明该函数是一个实例方法
+            entries(List[tuple]):由接收者、发送者、消息内容和时间组成的元组列表
+
+        返回值:None
+        """
+        if len(entries) > 0:
+            self.__executeTransaction(lambda cursor: cursor.executemany(self.__insertMailboxSQL, entries))
+        return None
+
+# 取出离线消息
+    def takeMailbox(self, recipient: str, limit: int) -> List[tuple]:
+        """在一个事务中按id正序读取用户最早的若干条离线消息并将其删除，使用(recipient, id)索引
+
+        参数:
+            self:表明该函数是一个实例方法
+            recipient(str):接收者的昵称
+            limit(int):最多取出的消息数
+
+        返回值:
+            List[tuple]:由id、发送者、消息内容和时间组成的元组列表
+        """
+        def take(cursor: 'Cursor') -> List[tuple]:
+            cursor.execute(self.__takeMailboxSQL, (recipient, limit))
+            rows = list(cursor.fetchall())
+            if len(rows) > 0:
+                cursor.execute(self.__deleteMailboxSQL, (recipient, rows[-1][0]))
+            return rows
+
+        return self.__executeTransaction(take)
+
+# 统计离线消息
+    def countMailboxes(self) -> Dict[str, int]:
+        """返回数据库中每个用户的离线消息数，用于服务端启动时恢复信箱容量的计数
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:
+            Dict[str, int]:接收者昵称到离线消息数的映射
+        """
+        return {recipient: count for recipient, count in self.__execute(self.__countMailboxSQL, ())}
+
 
 # 数据信息是否存在
     def isExist(self, name: str, password: str) -> int:
@@ -108,15 +557,46 @@ class DatabaseUtils(object):
             flag(int):用于标识数据的查询结果，flag为0说明账号不存在，flag为1说明账号存在但密码错误，flag为2说明账号密码都正确
         """
         flag = 0
+    # 缓存命中时无需查询数据库
+        verified = self.__authCache.verify(name, password)
+        if verified is not None:
+            return 2 if verified else 1
+
         data = self.searchValues(name)
 
         if (data[0] == None and data[1] == None):
-            flag = 0
-            self.insertValues(name=name, password=password)
-        else:
-            if data[1] == password:
-                flag = 2
+            try:
+                self.insertValues(name=name, password=password)
+            except self.__backend.integrityError:
+            # 同一用户名被两个连接同时首次登录，另一个连接已经完成注册，按已存在的用户重新验证
+                data = self.searchValues(name)
             else:
-                flag = 1
+                self.__authCache.put(name, ac.passwordDigest(password))
+                return flag
+
+        self.__authCache.put(name, ac.passwordDigest(data[1]))
+        if data[1] == password:
+            flag = 2
+        else:
+            flag = 1
 
         return flag
+
+# 用户是否已注册
+    def isRegistered(self, name: str) -> bool:
+        """判断用户名是否已经注册，用于拒绝发给不存在用户的离线消息，缓存命中时无需查询数据库
+
+        参数:
+            self:表明该函数是一个实例方法
+            name(str):用户名
+
+        返回值:
+            bool:True 表明该用户已注册；False 表明该用户不存在
+        """
+        if self.__authCache.get(name) is not None:
+            return True
+        data = self.searchValues(name)
+        if data[0] == None and data[1] == None:
+            return False
+        self.__authCache.put(name, ac.passwordDigest(data[1]))
+        return True
@@ -0,0 +1,315 @@
+import socket as sk
+import threading as td
+import time as t
+from typing import Callable, List, Union
+
+# 时间轮的刻度(秒)、每层的槽数与层数，三层可以覆盖约64*64*64秒
+WHEEL_TICK = 1.0
+WHEEL_SLOTS = 64
+WHEEL_LEVELS = 3
+# 已登录的连接空闲该秒数后发送ping探测
+IDLE_TIMEOUT = 60
+# 发送ping后在该秒数内没有任何数据则回收连接
+PROBE_TIMEOUT = 15
+# 建立连接后在该秒数内没有完成登录则回收连接
+LOGIN_TIMEOUT = 30
+# TCP保活参数：空闲秒数、探测间隔秒数与探测次数，用于不支持心跳的旧客户端
+KEEPALIVE_IDLE = 60
+KEEPALIVE_INTERVAL = 15
+KEEPALIVE_COUNT = 4
+
+
+# 开启TCP保活
+def enableKeepalive(sock: 'socket'):
+    """为连接开启TCP保活，不支持应用层心跳的客户端断线后由操作系统探测并关闭连接，
+    平台不支持的选项会被跳过
+
+    参数:
+        sock(socket对象):客户端连接
+
+    返回值:None
+    """
+    try:
+        sock.setsockopt(sk.SOL_SOCKET, sk.SO_KEEPALIVE, True)
+        for option, value in (("TCP_KEEPIDLE", KEEPALIVE_IDLE), ("TCP_KEEPINTVL", KEEPALIVE_INTERVAL),
+                              ("TCP_KEEPCNT", KEEPALIVE_COUNT)):
+            if hasattr(sk, option):
+                sock.setsockopt(sk.IPPROTO_TCP, getattr(sk, option), value)
+    except OSError:
+        pass
+    return None
+
+
+class TimingWheel(object):
+    """分层时间轮类，第0层每个槽对应一个刻度，第n层每个槽对应WHEEL_SLOTS^n个刻度，
+    添加定时项与每个刻度的推进都是O(1)，高层槽到期时其中的定时项被重新放入低层，
+    超出最高层范围的定时项放在最高层的最远槽中，到期时由调用者重新检查
+
+    属性:
+        tick(float):刻度(秒)
+        slots(int):每层的槽数
+        levels(list):各层的槽，每个槽是(到期刻度, 定时项)组成的列表
+        currentTick(int):当前刻度
+        size(int):时间轮中的定时项数
+    """
+
+# 构造函数
+    def __init__(self, tick: float = WHEEL_TICK, slots: int = WHEEL_SLOTS, levels: int = WHEEL_LEVELS,
+                 now: float = None):
+        """构造函数，用于时间轮对象初始化"""
+        self.__tick = tick
+        self.__slots = slots
+        self.__levels = [[[] for _ in range(slots)] for _ in range(levels)]
+        self.__currentTick = int((t.monotonic() if now is None else now) / tick)
+        self.__size = 0
+
+# 添加定时项
+    def schedule(self, item: object, deadline: float):
+        """添加一个在deadline时刻到期的定时项，不支持取消，调用者在到期时检查定时项是否仍然有效
+
+        参数:
+            self:表明该函数是一个实例方法
+            item(object):定时项
+            deadline(float):到期时刻(time.monotonic的秒数)
+
+        返回值:None
+        """
+        targetTick = max(-int(-deadline // self.__tick), self.__currentTick + 1)
+        self.__place(targetTick, item)
+        self.__size += 1
+        return None
+
+# 放入槽中
+    def __place(self, targetTick: int, item: object):
+        """根据到期刻度与当前刻度之差选择层，再根据到期刻度选择槽"""
+        span = self.__slots
+        for level, slots in enumerate(self.__levels):
+            if targetTick - self.__currentTick < span or level == len(self.__levels) - 1:
+                targetTick = min(targetTick, self.__currentTick + span - 1)
+                slots[(targetTick * self.__slots // span) % self.__slots].append((targetTick, item))
+                return None
+            span *= self.__slots
+        return None
+
+# 推进时间轮
+    def advance(self, now: float = None) -> List[object]:
+        """将时间轮推进到now，返回期间到期的全部定时项
+
+        参数:
+            self:表明该函数是一个实例方法
+            now(float):当前时刻(time.monotonic的秒数)
+
+        返回值:
+            List[object]:到期的定时项
+        """
+        targetTick = int((t.monotonic() if now is None else now) / self.__tick)
+        expired = []
+        while self.__currentTick < targetTick:
+            self.__currentTick += 1
+        # 从高层到低层，当前刻度是该层槽宽的整数倍时将对应槽中的定时项重新放入低层
+            span = self.__slots ** (len(self.__levels) - 1)
+            for level in range(len(self.__levels) - 1, 0, -1):
+                if self.__currentTick % span == 0:
+                    slot = self.__levels[level][(self.__currentTick // span) % self.__slots]
+                    entries = list(slot)
+                    slot.clear()
+                    for entryTick, item in entries:
+                        if entryTick <= self.__currentTick:
+                            expired.append(item)
+                            self.__size -= 1
+                        else:
+                            self.__place(entryTick, item)
+                span //= self.__slots
+            slot = self.__levels[0][self.__currentTick % self.__slots]
+            for entryTick, item in slot:
+                expired.append(item)
+            self.__size -= len(slot)
+            slot.clear()
+        return expired
+
+# 定时项数量
+    def __len__(self) -> int:
+        """返回时间轮中的定时项数量"""
+        return self.__size
+
+
+class Liveness(object):
+    """连接活跃状态类，每个客户端连接对应一个，读取到数据时只更新最近活动时间，不访问时间轮
+
+    属性:
+        connection(object):客户端连接
+        session(Session):登录后的会话，未登录时为None
+        heartbeat(bool):客户端是否支持ping/pong心跳，支持时空闲后发送ping探测
+        createdTime(float):建立连接的时刻
+        lastActivity(float):最近一次收到数据的时刻
+        isProbed(bool):是否已发送ping并等待回应
+        probeTime(float):最近一次发送ping的时刻
+        isClosed(bool):连接是否已经结束
+    """
+
+# 构造函数
+    def __init__(self, connection: object, now: float):
+        """构造函数，用于连接活跃状态对象初始化"""
+        self.connection = connection
+        self.session = None
+        self.heartbeat = False
+        self.createdTime = now
+        self.lastActivity = now
+        self.isProbed = False
+        self.probeTime = 0.0
+        self.isClosed = False
+
+# 记录活动
+    def touch(self):
+        """收到该连接的数据时调用"""
+        self.lastActivity = t.monotonic()
+        return None
+
+
+class IdleReaper(object):
+    """空闲连接回收类，使用分层时间轮为每个连接安排下一次检查，检查时按最近活动时间决定：
+    未登录的连接超过登录时限后回收；支持心跳的已登录连接空闲超过idleTimeout后发送ping，
+    再经过probeTimeout仍没有数据则回收；其他情况按最近活动时间重新安排检查，
+    连接收到数据时只更新时间戳，因此每个连接的开销与数据量无关
+
+    属性:
+        onProbe(Callable):需要发送ping时调用的函数
+        onReap(Callable):需要回收连接时调用的函数，参数为连接活跃状态与原因(login或idle)
+        idleTimeout(float):空闲多少秒后发送ping
+        probeTimeout(float):发送ping后等待的秒数
+        loginTimeout(float):建立连接后完成登录的时限
+        wheel(TimingWheel):时间轮
+        connections(dict):连接到连接活跃状态的映射
+        stats(dict):探测次数、各原因的回收次数
+    """
+
+# 构造函数
+    def __init__(self, onProbe: Callable[['Liveness'], None], onReap: Callable[['Liveness', str], None],
+                 idleTimeout: float = IDLE_TIMEOUT, probeTimeout: float = PROBE_TIMEOUT,
+                 loginTimeout: float = LOGIN_TIMEOUT):
+        """构造函数，用于空闲连接回收对象初始化"""
+        self.__onProbe = onProbe
+        self.__onReap = onReap
+        self.__idleTimeout = idleTimeout
+        self.__probeTimeout = probeTimeout
+        self.__loginTimeout = loginTimeout
+        self.__wheel = TimingWheel()
+        self.__connections = {}
+        self.__lock = td.Lock()
+        self.__stopEvent = td.Event()
+        self.__thread = None
+        self.__stats = {'probes': 0, 'reapedLogin': 0, 'reapedIdle': 0}
+
+# 登记连接
+    def track(self, connection: object) -> 'Liveness':
+        """登记新建立的连接，并安排在登录时限到达时检查
+
+        参数:
+            self:表明该函数是一个实例方法
+            connection(object):客户端连接
+
+        返回值:
+            Liveness:该连接的活跃状态
+        """
+        liveness = Liveness(connection, t.monotonic())
+        with self.__lock:
+            self.__connections[connection] = liveness
+            self.__wheel.schedule(liveness, liveness.createdTime + self.__loginTimeout)
+        return liveness
+
+# 查找连接
+    def lookup(self, connection: object) -> Union['Liveness', None]:
+        """返回连接的活跃状态，None表示该连接未登记"""
+        return self.__connections.get(connection)
+
+# 注销连接
+    def release(self, liveness: 'Liveness'):
+        """连接结束时调用，时间轮中的定时项在到期时被丢弃"""
+        liveness.isClosed = True
+        with self.__lock:
+            self.__connections.pop(liveness.connection, None)
+        return None
+
+# 检查到期的连接
+    def tick(self, now: float = None) -> int:
+        """推进时间轮并检查到期的连接，回调函数在释放锁之后调用
+
+        参数:
+            self:表明该函数是一个实例方法
+            now(float):当前时刻(time.monotonic的秒数)
+
+        返回值:
+            int:本次回收的连接数
+        """
+        now = t.monotonic() if now is None else now
+        probes = []
+        reaped = []
+        with self.__lock:
+            for liveness in self.__wheel.advance(now):
+                if liveness.isClosed:
+                    continue
+                if liveness.session is None:
+                    deadline = liveness.createdTime + self.__loginTimeout
+                    if now >= deadline:
+                        reaped.append((liveness, "login"))
+                    else:
+                        self.__wheel.schedule(liveness, deadline)
+                elif not liveness.heartbeat:
+                    continue
+            # 发送ping之后没有收到任何数据
+                elif liveness.isProbed and liveness.lastActivity < liveness.probeTime:
+                    reaped.append((liveness, "idle"))
+                elif now - liveness.lastActivity < self.__idleTimeout:
+                    liveness.isProbed = False
+                    self.__wheel.schedule(liveness, liveness.lastActivity + self.__idleTimeout)
+                else:
+                    liveness.isProbed = True
+                    liveness.probeTime = now
+                    probes.append(liveness)
+                    self.__wheel.schedule(liveness, now + self.__probeTimeout)
+            self.__stats['probes'] += len(probes)
+            for liveness, reason in reaped:
+                self.__stats["reapedLogin" if reason == "login" else "reapedIdle"] += 1
+                self.__connections.pop(liveness.connection, None)
+                liveness.isClosed = True
+        for liveness in probes:
+            self.__onProbe(liveness)
+        for liveness, reason in reaped:
+            self.__onReap(liveness, reason)
+        return len(reaped)
+
+# 启动检查线程
+    def start(self):
+        """启动每个刻度检查一次的后台线程，线程模式使用；asyncio模式在事件循环中定期调用tick"""
+        self.__thread = td.Thread(target=self.__run, name="IdleReaper", daemon=True)
+        self.__thread.start()
+        return None
+
+# 线程主体
+    def __run(self):
+        """每个刻度调用一次tick，直到被停止"""
+        while not self.__stopEvent.wait(WHEEL_TICK):
+            try:
+                self.tick()
+            except Exception as error:
+                print("空闲连接检查失败：{}".format(error))
+        return None
+
+# 停止检查线程
+    def stop(self):
+        """停止后台线程"""
+        self.__stopEvent.set()
+        if self.__thread is not None:
+            self.__thread.join()
+        return None
+
+# 获取统计信息
+    def getStats(self) -> dict:
+        """返回登记的连接数、时间轮中的定时项数、探测次数与回收次数"""
+        with self.__lock:
+            return dict(self.__stats, tracked=len(self.__connections), scheduled=len(self.__wheel))
+
+# 登记的连接数量
+    def __len__(self) -> int:
+        """返回登记的连接数量"""
+        return len(self.__connections)
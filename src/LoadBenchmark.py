@@ -0,0 +1,333 @@
+import threading as td
+import time as t
+import json
+import os
+import sys
+import random
+import argparse
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import List, Dict, Union
+import Codec as cd
+from Client import Client
+from Server import raiseFileLimit
+from ServerModeBenchmark import startServerProcess
+
+# 参与统计的延迟类别
+LATENCY_TYPES = ("connect", "login", "get", "public", "private", "exit")
+
+
+# 计算延迟分布
+def summarize(samples: List[float]) -> Dict[str, Union[int, float]]:
+    """计算一组延迟样本的平均值与百分位数
+
+    参数:
+        samples(List[float]):延迟样本(秒)
+
+    返回值:
+        Dict:count为样本数，其余为平均值、p50、p99、p999与最大值(毫秒)
+    """
+    if len(samples) == 0:
+        return {'count': 0, 'meanMs': 0.0, 'p50Ms': 0.0, 'p99Ms': 0.0, 'p999Ms': 0.0, 'maxMs': 0.0}
+    ordered = sorted(samples)
+
+    def percentile(fraction: float) -> float:
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000
+
+    return {'count': len(ordered), 'meanMs': sum(ordered) / len(ordered) * 1000, 'p50Ms': percentile(0.50),
+            'p99Ms': percentile(0.99), 'p999Ms': percentile(0.999), 'maxMs': ordered[-1] * 1000}
+
+
+class SimulatedUser(object):
+    """模拟用户类，每个模拟用户使用一个Client对象与服务端通信，并由一个接收线程记录收到消息的延迟，
+    public与private消息的内容中携带发送时刻，get请求通过请求id与回复配对
+
+    属性:
+        nickname(str):模拟用户的昵称
+        client(Client):该用户使用的客户端对象
+        latencies(dict):各类别的延迟样本(秒)
+        received(int):收到的public、private与get消息数
+        throttled(int):收到的限速通知数
+        exitTime(float):发送exit请求的时刻，None表示尚未退出
+    """
+
+# 构造函数
+    def __init__(self, nickname: str, ip: str, port: int, codec: str, useCompression: bool, usePresence: bool):
+        """构造函数，用于模拟用户对象初始化"""
+        self.nickname = nickname
+        self.client = Client(ip, port, codec, useCompression, usePresence)
+        self.latencies = {latencyType: [] for latencyType in LATENCY_TYPES}
+        self.received = 0
+        self.throttled = 0
+        self.exitTime = None
+        self.__thread = None
+
+# 登录
+    def login(self, password: str) -> int:
+        """建立连接并登录，分别记录建立连接与登录的耗时
+
+        参数:
+            self:表明该函数是一个实例方法
+            password(str):登录密码
+
+        返回值:
+            int:登录结果
+        """
+        startTime = t.perf_counter()
+        self.client.getConnection()
+        connectedTime = t.perf_counter()
+        status = self.client.loginCheck("{} {}".format(self.nickname, password))
+        self.latencies['connect'].append(connectedTime - startTime)
+        self.latencies['login'].append(t.perf_counter() - connectedTime)
+        self.client.setNickname(self.nickname)
+        return status
+
+# 启动接收线程
+    def start(self):
+        """启动负责接收消息并记录延迟的线程"""
+        self.__thread = td.Thread(target=self.__receiveLoop, name="Receiver-{}".format(self.nickname), daemon=True)
+        self.__thread.start()
+        return None
+
+# 接收循环
+    def __receiveLoop(self):
+        """接收线程主体，连接关闭时记录exit请求的耗时"""
+        while True:
+            messageDict = self.client.receiveMessageDict()
+            receiveTime = t.perf_counter()
+            if messageDict is None:
+                if self.exitTime is not None:
+                    self.latencies['exit'].append(receiveTime - self.exitTime)
+                return None
+            messageType = messageDict['type']
+            if messageType in ("public", "private"):
+                sendTime = float(messageDict['data'].split(" ", 1)[0])
+                self.latencies[messageType].append(receiveTime - sendTime)
+            elif messageType == "throttle":
+                self.throttled += 1
+                continue
+            else:
+                continue
+            self.received += 1
+
+# 收到get回复
+    def __onGetReply(self, sendTime: float, future: 'Future'):
+        """get请求的Future完成时在接收线程中调用，记录延迟，被限速的请求收到的是throttle通知"""
+        receiveTime = t.perf_counter()
+        if future.exception() is not None:
+            return None
+        if future.result()['type'] == "throttle":
+            self.throttled += 1
+        else:
+            self.latencies['get'].append(receiveTime - sendTime)
+            self.received += 1
+        return None
+
+# 发送消息
+    def send(self, messageType: str, targetUser: Union[str, None] = None, padding: str = ""):
+        """发送一条get、public或private消息，聊天消息的内容以发送时刻开头
+
+        参数:
+            self:表明该函数是一个实例方法
+            messageType(str):消息类别
+            targetUser(str):私聊对象的昵称
+            padding(str):附加在消息内容后面的填充数据
+
+        返回值:None
+        """
+        sendTime = t.perf_counter()
+        if messageType == "get":
+            future = self.client.request(self.client.processMessage(targetUser, messageType, None))
+            future.add_done_callback(lambda future: self.__onGetReply(sendTime, future))
+            return None
+        message = "{:.9f} {}".format(sendTime, padding)
+        self.client.sendMessage(self.client.processMessage(targetUser, messageType, message))
+        return None
+
+# 退出
+    def exit(self):
+        """发送exit请求，服务端关闭连接后由接收线程记录耗时"""
+        self.exitTime = t.perf_counter()
+        self.client.sendMessage(self.client.processMessage(None, "exit", None))
+        return None
+
+# 等待接收线程结束
+    def join(self, timeout: float):
+        """等待接收线程结束"""
+        if self.__thread is not None:
+            self.__thread.join(timeout)
+        return None
+
+
+# 解析消息比例
+def parseMix(mix: str) -> Dict[str, float]:
+    """解析形如 public=1,private=8,get=1 的消息比例
+
+    参数:
+        mix(str):消息比例字符串
+
+    返回值:
+        Dict[str, float]:消息类别到权重的映射
+    """
+    weights = {}
+    for item in mix.split(","):
+        messageType, weight = item.split("=")
+        if messageType not in ("get", "public", "private"):
+            raise ValueError("未知的消息类别：{}".format(messageType))
+        weights[messageType] = float(weight)
+    return weights
+
+
+# 运行负载测试
+def runLoad(arguments: argparse.Namespace) -> Dict[str, dict]:
+    """登录全部模拟用户，按固定速率发送混合消息，等待消息送达后全部退出，汇总吞吐量与延迟分布
+
+    参数:
+        arguments(Namespace):解析后的命令行参数
+
+    返回值:
+        Dict:测试配置、吞吐量、各类别延迟分布以及错误计数
+    """
+    users = [SimulatedUser("{}{}".format(arguments.prefix, index), arguments.ip, arguments.port,
+                           arguments.codec, arguments.compression, arguments.presence) for index in range(arguments.users)]
+    errors = {'login': 0, 'send': 0}
+
+    loginStart = t.perf_counter()
+    with ThreadPoolExecutor(max_workers=arguments.loginConcurrency) as executor:
+        for status in executor.map(lambda user: user.login(arguments.password), users):
+            if status == 1:
+                errors['login'] += 1
+    loginSeconds = t.perf_counter() - loginStart
+    for user in users:
+        user.start()
+
+    weights = parseMix(arguments.mix)
+    messageTypes = list(weights.keys())
+    typeWeights = [weights[messageType] for messageType in messageTypes]
+    padding = "x" * arguments.size
+    randomGenerator = random.Random(arguments.seed)
+    sent = {messageType: 0 for messageType in messageTypes}
+    total = int(arguments.rate * arguments.duration)
+
+# 按计划时刻发送，发送落后时不补偿等待，保证总发送量不变
+    sendStart = t.perf_counter()
+    for index in range(total):
+        delay = sendStart + index / arguments.rate - t.perf_counter()
+        if delay > 0:
+            t.sleep(delay)
+        user = users[randomGenerator.randrange(len(users))]
+        messageType = randomGenerator.choices(messageTypes, typeWeights)[0]
+        targetUser = None
+        if messageType == "private":
+            targetUser = users[randomGenerator.randrange(len(users))].nickname
+        try:
+            user.send(messageType, targetUser, padding)
+            sent[messageType] += 1
+        except OSError:
+            errors['send'] += 1
+    sendSeconds = t.perf_counter() - sendStart
+
+    expected = sent.get("public", 0) * (len(users) - 1) + sent.get("private", 0) + sent.get("get", 0)
+    deadline = t.perf_counter() + arguments.drainTimeout
+    while sum(user.received for user in users) < expected and t.perf_counter() < deadline:
+        t.sleep(0.05)
+    deliverSeconds = t.perf_counter() - sendStart
+    received = sum(user.received for user in users)
+
+    for user in users:
+    # 过载时连接可能已被服务端按慢消费者策略断开
+        try:
+            user.exit()
+        except OSError:
+            errors['send'] += 1
+    for user in users:
+        user.join(arguments.drainTimeout)
+
+    latencies = {latencyType: summarize([sample for user in users for sample in user.latencies[latencyType]])
+                 for latencyType in LATENCY_TYPES}
+    return {
+        'config': {'users': arguments.users, 'rate': arguments.rate, 'duration': arguments.duration,
+                   'mix': weights, 'size': arguments.size, 'codec': arguments.codec,
+                   'compression': arguments.compression, 'presence': arguments.presence, 'mode': arguments.mode},
+        'throughput': {'loginsPerSecond': len(users) / loginSeconds if loginSeconds > 0 else 0.0,
+                       'sent': sent, 'sentPerSecond': sum(sent.values()) / sendSeconds if sendSeconds > 0 else 0.0,
+                       'expectedDeliveries': expected, 'deliveries': received,
+                       'deliveriesPerSecond': received / deliverSeconds if deliverSeconds > 0 else 0.0},
+        'latency': latencies,
+        'errors': dict(errors, lost=expected - received, throttled=sum(user.throttled for user in users)),
+    }
+
+
+# 主函数
+def main(argv: List[str] = None) -> int:
+    """无界面负载测试，模拟大量用户登录、发送get、public、private请求并退出，
+    输出吞吐量以及建立连接、登录和各类消息送达延迟的百分位数
+
+    参数:
+        argv(List[str]):命令行参数列表，为None时使用sys.argv
+
+    返回值:
+        int:返回数字0表明程序正常执行结束
+    """
+    parser = argparse.ArgumentParser(description="在线聊天室无界面负载与延迟测试")
+    parser.add_argument("--users", type=int, default=50, help="模拟用户数")
+    parser.add_argument("--rate", type=float, default=200, help="所有用户合计每秒发送的消息数")
+    parser.add_argument("--duration", type=float, default=10, help="发送阶段持续的秒数")
+    parser.add_argument("--mix", default="public=1,private=8,get=1", help="各类消息的比例")
+    parser.add_argument("--size", type=int, default=32, help="聊天消息内容的填充字节数")
+    parser.add_argument("--codec", choices=(cd.CODEC_BINARY, cd.CODEC_JSON), default=cd.CODEC_BINARY,
+                        help="模拟用户登录时请求的编码")
+    parser.add_argument("--no-compression", dest="compression", action="store_false", help="模拟用户不请求压缩")
+    parser.add_argument("--no-presence", dest="presence", action="store_false", help="模拟用户不订阅在线用户推送")
+    parser.add_argument("--prefix", default="bench", help="模拟用户昵称前缀")
+    parser.add_argument("--password", default="bench", help="模拟用户的登录密码")
+    parser.add_argument("--login-concurrency", dest="loginConcurrency", type=int, default=32,
+                        help="同时进行登录的用户数")
+    parser.add_argument("--drain-timeout", dest="drainTimeout", type=float, default=10,
+                        help="发送结束后等待消息全部送达的最长秒数")
+    parser.add_argument("--seed", type=int, default=1, help="随机数种子")
+    parser.add_argument("--ip", default="127.0.0.1", help="被测服务端的IP地址")
+    parser.add_argument("--port", type=int, default=61100, help="被测服务端的端口号")
+    parser.add_argument("--mode", choices=("threaded", "asyncio", "external"), default="threaded",
+                        help="启动指定模式的服务端子进程；external 表示连接已经运行的服务端")
+    parser.add_argument("--db-path", dest="dbPath", default=None,
+                        help="服务端子进程使用的SQLite数据库文件，默认在临时目录中新建")
+    parser.add_argument("--json", dest="jsonPath", default=None, help="将结果以JSON格式写入该文件")
+    arguments = parser.parse_args(argv)
+    raiseFileLimit()
+
+    process = None
+    if arguments.mode != "external":
+        dbPath = arguments.dbPath or os.path.join("/tmp" if os.path.isdir("/tmp") else ".",
+                                                  "loadbench-{}.db".format(os.getpid()))
+        process = startServerProcess(arguments.mode, arguments.port, ["--storage", "sqlite", "--db-path", dbPath,
+                                                                      "--rate-limits", "none"])
+    try:
+        results = runLoad(arguments)
+    finally:
+        if process is not None:
+            process.kill()
+            process.wait()
+            if arguments.dbPath is None:
+                for suffix in ("", "-wal", "-shm"):
+                    if os.path.exists(dbPath + suffix):
+                        os.remove(dbPath + suffix)
+
+    throughput = results['throughput']
+    print("logins/s {:.1f}  sent/s {:.1f}  deliveries/s {:.1f}  lost {}".format(
+        throughput['loginsPerSecond'], throughput['sentPerSecond'], throughput['deliveriesPerSecond'],
+        results['errors']['lost']))
+    print("{:<10}{:>8}{:>10}{:>10}{:>10}{:>10}{:>10}".format("type", "count", "mean", "p50", "p99", "p999", "max"))
+    for latencyType, summary in results['latency'].items():
+        print("{:<10}{:>8}{:>10.2f}{:>10.2f}{:>10.2f}{:>10.2f}{:>10.2f}".format(
+            latencyType, summary['count'], summary['meanMs'], summary['p50Ms'], summary['p99Ms'],
+            summary['p999Ms'], summary['maxMs']))
+
+    if arguments.jsonPath is not None:
+        with open(arguments.jsonPath, "w") as jsonFile:
+            json.dump(results, jsonFile, indent=2)
+    return 0
+
+
+# 运行程序
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,9 +1,19 @@
 import tkinter as tk
-import time as t
+import threading as td
+import queue
 from tkinter import messagebox
 from tkinter import ttk
 from Client import *
 
+# 建立连接与等待登录回复各自的最长秒数
+LOGIN_TIMEOUT = 10.0
+# 超时或连接失败后自动重试的次数，每次重试都重新建立连接
+LOGIN_RETRIES = 2
+# 主线程每隔多少毫秒处理一次登录事件
+EVENT_INTERVAL = 16
+# 各登录阶段完成时进度条的取值
+LOGIN_PROGRESS = {'connected': 1 / 3, 'sent': 2 / 3, 'verified': 1.0}
+
 
 class LoginWindow(tk.Tk):
     """客户端登录界面类，封装了一些创建界面需要用到的方法
@@ -12,15 +22,24 @@ class LoginWindow(tk.Tk):
         width(int):登录界面的宽度
         height(int):登陆界面的高度
         client(Client):客户端类的实例对象，用于调用客户端类的相关函数
+        timeout(float):建立连接与等待登录回复各自的最长秒数
+        retries(int):超时或连接失败后自动重试的次数
+        loginEvents(Queue):登录线程与主线程之间的事件队列
+        eventJob(str):主线程下一次处理登录事件的after任务，None表示没有正在进行的登录
     """
 
 # 构造函数
-    def __init__(self, client: 'Client' = None, master=None):
+    def __init__(self, client: 'Client' = None, master=None, timeout: float = LOGIN_TIMEOUT,
+                 retries: int = LOGIN_RETRIES):
         """构造函数，用于登录界面的初始化"""
         super().__init__(master)
         self.width = 450
         self.height = 300
         self.client = client
+        self.timeout = timeout
+        self.retries = retries
+        self.__loginEvents = queue.Queue()
+        self.__eventJob = None
         self.createLoginWindow()
 
 # 设置窗口居中
@@ -125,14 +144,17 @@ class LoginWindow(tk.Tk):
         return None
 
 # 进度条显示
-    def __progressBarDisplay(self):
-        """用于在登录界面显示一个进度条，以便用户了解程序的运行状态"""
+    def __progressBarDisplay(self, value: float):
+        """用于在登录界面显示一个进度条，以便用户了解程序的运行状态
+
+        参数:
+            self:表明该函数是一个实例方法
+            value(float):进度，0到1之间
+
+        返回值:None
+        """
         self.progressBarFrame.place(x=0, y=280)
-        for i in range(0, 12, 1):
-            self.progressBar['value'] = i * 0.1
-            t.sleep(0.1)
-            self.progressBarFrame.update()
-        self.progressBarFrame.place_forget()
+        self.progressBar['value'] = value
         return None
 
 # 绑定鼠标事件--确定按钮
@@ -151,12 +173,71 @@ class LoginWindow(tk.Tk):
         if ((len(name) + len(password) == 0) or (name.isspace() or password.isspace()) == True):
             # 输出提示信息
             messagebox.showinfo("提示", "用户名或密码不能为空")
-        else:
-            # 发送登录信息
-            self.__progressBarDisplay()
-            status = self.client.loginCheck(loginInfo)
-            self.client.setNickname(nickname=name)
-            self.__showPromptInfo(status)
+        elif self.__eventJob is None:
+            # 在后台线程中登录，界面只根据登录事件更新进度
+            self.buttonConfirm.configure(state=tk.DISABLED)
+            self.__progressBarDisplay(0)
+            td.Thread(target=self.__loginProcess, args=(name, loginInfo), name="Login", daemon=True).start()
+            self.__eventJob = self.after(EVENT_INTERVAL, self.__processLoginEvents)
+        return None
+
+# 登录线程
+    def __loginProcess(self, name: str, loginInfo: str):
+        """登录线程主体，依次建立连接、发送登录信息、等待验证结果，每完成一步放入一个登录事件，
+        超时或连接失败时重新建立连接并重试，不访问界面组件，
+        服务端会关闭在同一连接上重复登录的会话，因此每次登录都使用新建立的连接
+
+        参数:
+            self:表明该函数是一个实例方法
+            name(str):用户名
+            loginInfo(str):由用户名和密码组成的字符串
+
+        返回值:None
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                self.client.getConnection(self.timeout)
+                self.__loginEvents.put(("connected",))
+                future = self.client.requestLogin(loginInfo)
+                self.__loginEvents.put(("sent",))
+                status = self.client.waitLogin(future, self.timeout)
+            except TimeoutError:
+                error = "登录超时"
+            except OSError:
+                error = "无法连接服务端"
+            else:
+                self.__loginEvents.put(("verified", name, status))
+                return None
+            if attempt < self.retries:
+                self.__loginEvents.put(("retry", attempt + 1))
+        self.__loginEvents.put(("failed", error))
+        return None
+
+# 处理登录事件
+    def __processLoginEvents(self):
+        """在主线程中定期调用，根据登录线程放入的事件更新进度条，登录结束后显示结果"""
+        while True:
+            try:
+                event = self.__loginEvents.get_nowait()
+            except queue.Empty:
+                break
+            if event[0] in LOGIN_PROGRESS:
+                self.__progressBarDisplay(LOGIN_PROGRESS[event[0]])
+            elif event[0] == "retry":
+                self.title("登录(第{}次重试)".format(event[1]))
+                self.__progressBarDisplay(0)
+            if event[0] in ("verified", "failed"):
+                self.__eventJob = None
+                self.title("登录")
+                self.progressBarFrame.place_forget()
+                self.buttonConfirm.configure(state=tk.NORMAL)
+                if event[0] == "failed":
+                    messagebox.showerror("提示", event[1])
+                else:
+                    self.client.setNickname(nickname=event[1])
+                    self.__showPromptInfo(event[2])
+                return None
+        self.__eventJob = self.after(EVENT_INTERVAL, self.__processLoginEvents)
         return None
 
 # 关闭窗口
@@ -169,6 +250,8 @@ class LoginWindow(tk.Tk):
 
         返回值:None
         """
+        if self.__eventJob is not None:
+            self.after_cancel(self.__eventJob)
         self.progressBarFrame.place_forget()
         self.destroy()
         self.client.closeConnection()
@@ -0,0 +1,330 @@
+import sys
+import threading as td
+import time as t
+from collections import deque
+from typing import Dict, List, Tuple, Union
+
+# 每个用户的离线信箱最多保存的消息数(内存与数据库中的合计)，信箱已满时丢弃新消息
+MAILBOX_SIZE = 1000
+# 全部信箱在内存中占用的字节数上限，超过后由后台线程将最大的信箱转存到数据库，直到回落到一半
+MAILBOX_MEMORY = 16 * 1024 * 1024
+# 每条离线消息除消息内容外的估算内存开销(元组与字符串对象头等)
+ENTRY_OVERHEAD = 120
+# 后台线程检查内存占用的最长间隔(秒)
+SPILL_INTERVAL = 0.5
+# 多进程模式下从数据库重新读取各信箱消息数的间隔(秒)，其他分片的存入与取出由此反映到本分片的计数中
+COUNT_REFRESH_INTERVAL = 5.0
+
+
+# 估算离线消息的内存占用
+def entrySize(entry: Tuple[str, str, float]) -> int:
+    """按消息内容的长度加上固定开销估算一条离线消息占用的内存字节数"""
+    return len(entry[1]) + ENTRY_OVERHEAD
+
+
+class MailboxStore(object):
+    """离线信箱类，为不在线的私聊对象保存消息，对方登录时一次性取出并批量投递：
+    消息以(发送者, 内容, 时间)元组的形式保存在每个用户的双端队列中，发送者昵称经过驻留，
+    全部信箱的内存占用超过memoryLimit时，后台线程将消息最多的信箱整体转存到数据库，
+    因此数据库中的消息总是早于内存中的消息，取出时先取数据库再取内存即可保持顺序，
+    多进程模式下(shared为True)消息全部转存到数据库，用户登录到任何一个分片都能取到，
+    数据库中的消息数定期从数据库重新读取，用户在其他分片登录时由release清零并交出尚未转存的消息
+
+    属性:
+        databaseUtils(DatabaseUtils):数据库工具对象
+        maxMessages(int):每个用户的信箱最多保存的消息数
+        memoryLimit(int):全部信箱在内存中占用的字节数上限
+        shared(bool):信箱是否由多个分片共用，为True时取出信箱总要查询数据库
+        mailboxes(dict):用户昵称到内存中离线消息队列的映射
+        storedCounts(dict):用户昵称到数据库中离线消息数的映射，多进程模式下包括其他分片存入的消息
+        memoryBytes(int):内存中离线消息的估算字节数
+        memoryCount(int):内存中离线消息的条数
+        storageLock(Lock):转存与取出信箱时持有，保证正在转存的消息不会被取出信箱遗漏
+        stats(dict):存入、投递、丢弃、转存条数以及失败次数等统计信息
+    """
+
+# 构造函数
+    def __init__(self, databaseUtils: 'DatabaseUtils', maxMessages: int = MAILBOX_SIZE,
+                 memoryLimit: int = MAILBOX_MEMORY, shared: bool = False):
+        """构造函数，用于离线信箱对象初始化"""
+        self.__databaseUtils = databaseUtils
+        self.__maxMessages = maxMessages
+        self.__memoryLimit = 0 if shared else memoryLimit
+        self.__shared = shared
+        self.__mailboxes = {}
+        self.__storedCounts = {}
+        self.__memoryBytes = 0
+        self.__memoryCount = 0
+        self.__condition = td.Condition()
+        self.__storageLock = td.Lock()
+        self.__stats = {'deposited': 0, 'delivered': 0, 'dropped': 0, 'restored': 0, 'spilled': 0,
+                        'spills': 0, 'spillErrors': 0, 'drainErrors': 0, 'maxDepth': 0}
+        self.__isRunning = False
+        self.__thread = None
+        self.__refreshTime = 0.0
+
+# 启动后台线程
+    def start(self):
+        """读取数据库中已有的离线消息数，并启动负责转存的后台线程
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:None
+        """
+        self.refreshCounts()
+        self.__isRunning = True
+        self.__thread = td.Thread(target=self.__spillLoop, name="MailboxStore", daemon=True)
+        self.__thread.start()
+        return None
+
+# 存入离线消息
+    def deposit(self, recipient: str, source: str, message: str) -> bool:
+        """将一条私聊消息存入不在线用户的信箱，只做一次加锁的入队操作，不访问数据库，
+        recipient是否为已注册用户由调用者在存入之前确认，信箱因此不会为编造的昵称创建
+
+        参数:
+            self:表明该函数是一个实例方法
+            recipient(str):消息目标用户的昵称
+            source(str):消息发送者的昵称
+            message(str):消息的具体内容
+
+        返回值:
+            bool:True 表明已存入；False 表明该用户的信箱已满，消息被丢弃
+        """
+        entry = (sys.intern(source), message, t.time())
+        with self.__condition:
+            mailbox = self.__mailboxes.get(recipient)
+            depth = (0 if mailbox is None else len(mailbox)) + self.__storedCounts.get(recipient, 0)
+            if depth >= self.__maxMessages:
+                self.__stats['dropped'] += 1
+                return False
+            if mailbox is None:
+                mailbox = self.__mailboxes[recipient] = deque()
+            mailbox.append(entry)
+            self.__memoryBytes += entrySize(entry)
+            self.__memoryCount += 1
+            self.__stats['deposited'] += 1
+            if depth + 1 > self.__stats['maxDepth']:
+                self.__stats['maxDepth'] = depth + 1
+            if self.__memoryBytes > self.__memoryLimit:
+                self.__condition.notify()
+        return True
+
+# 放回离线消息
+    def restore(self, recipient: str, entries: List[Tuple[str, str, float]]):
+        """将取出后未能投递的消息按原有顺序放回信箱队首，放回的消息不受信箱容量限制
+
+        参数:
+            self:表明该函数是一个实例方法
+            recipient(str):消息目标用户的昵称
+            entries(List[tuple]):按时间正序排列的(发送者, 内容, 时间)元组
+
+        返回值:None
+        """
+        if len(entries) == 0:
+            return None
+        with self.__condition:
+            mailbox = self.__mailboxes.get(recipient)
+            restored = deque(entries)
+            if mailbox is not None:
+                restored.extend(mailbox)
+            self.__mailboxes[recipient] = restored
+            self.__memoryBytes += sum(entrySize(entry) for entry in entries)
+            self.__memoryCount += len(entries)
+            self.__stats['restored'] += len(entries)
+            self.__stats['delivered'] -= len(entries)
+            if self.__memoryBytes > self.__memoryLimit:
+                self.__condition.notify()
+        return None
+
+# 取出信箱
+    def drain(self, recipient: str) -> List[Tuple[str, str, float]]:
+        """取出并清空用户的信箱，先取出数据库中较早的消息，再取出内存中的消息，
+        该函数可能访问数据库，asyncio模式下在线程池中执行
+
+        参数:
+            self:表明该函数是一个实例方法
+            recipient(str):登录用户的昵称
+
+        返回值:
+            List[tuple]:按时间正序排列的(发送者, 内容, 时间)元组，读取数据库失败时返回空列表，消息留在信箱中
+        """
+        with self.__storageLock:
+            with self.__condition:
+                stored = self.__storedCounts.pop(recipient, 0)
+            rows = []
+            if stored > 0 or self.__shared:
+                try:
+                    rows = self.__databaseUtils.takeMailbox(recipient, self.__maxMessages)
+                except Exception as error:
+                    print("离线消息读取失败：{}".format(error))
+                    with self.__condition:
+                        self.__stats['drainErrors'] += 1
+                        if stored > 0:
+                            self.__storedCounts[recipient] = self.__storedCounts.get(recipient, 0) + stored
+                    return []
+            with self.__condition:
+            # 单次读取有条数上限，剩余的消息留到下一次登录
+                if stored > len(rows):
+                    self.__storedCounts[recipient] = self.__storedCounts.get(recipient, 0) + stored - len(rows)
+                mailbox = self.__mailboxes.pop(recipient, ())
+                self.__memoryBytes -= sum(entrySize(entry) for entry in mailbox)
+                self.__memoryCount -= len(mailbox)
+                entries = [(row[1], row[2], row[3]) for row in rows]
+                entries.extend(mailbox)
+                self.__stats['delivered'] += len(entries)
+        return entries
+
+# 交出信箱
+    def release(self, recipient: str) -> List[Tuple[str, str, float]]:
+        """多进程模式下用户登录到其他分片时调用，该分片已取出数据库中的消息，
+        因此清零本分片记录的数据库消息数，并交出内存中尚未转存的消息，由调用者转发给该用户所在的分片，
+        持有storageLock，正在进行的转存完成之后才会交出
+
+        参数:
+            self:表明该函数是一个实例方法
+            recipient(str):登录到其他分片的用户的昵称
+
+        返回值:
+            List[tuple]:按时间正序排列的(发送者, 内容, 时间)元组
+        """
+        with self.__storageLock:
+            with self.__condition:
+                self.__storedCounts.pop(recipient, None)
+                mailbox = self.__mailboxes.pop(recipient, ())
+                self.__memoryBytes -= sum(entrySize(entry) for entry in mailbox)
+                self.__memoryCount -= len(mailbox)
+                self.__stats['delivered'] += len(mailbox)
+        return list(mailbox)
+
+# 重新读取数据库中的消息数
+    def refreshCounts(self):
+        """从数据库读取每个信箱的消息数替换本地的计数，多进程模式下由后台线程定期调用，
+        其他分片存入或取出的消息因此计入信箱容量，持有storageLock，读取期间不会有本分片的转存写入
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:None
+        """
+        with self.__storageLock:
+            try:
+                counts = self.__databaseUtils.countMailboxes()
+            except Exception as error:
+                print("离线消息数读取失败：{}".format(error))
+                return None
+            with self.__condition:
+                self.__storedCounts = dict(counts)
+            self.__refreshTime = t.monotonic()
+        return None
+
+# 转存信箱
+    def spill(self, force: bool = False) -> int:
+        """内存占用超过上限时，将消息最多的信箱整体写入数据库，直到内存占用回落到上限的一半，
+        force为True时转存全部信箱，写入失败的消息被放回内存
+
+        参数:
+            self:表明该函数是一个实例方法
+            force(bool):是否转存全部信箱
+
+        返回值:
+            int:本次转存的消息数
+        """
+        with self.__storageLock:
+            with self.__condition:
+                if not force and self.__memoryBytes <= self.__memoryLimit:
+                    return 0
+                target = 0 if force else self.__memoryLimit // 2
+                spilled = {}
+                for recipient in sorted(self.__mailboxes, key=lambda name: len(self.__mailboxes[name]),
+                                        reverse=True):
+                    if self.__memoryBytes <= target:
+                        break
+                    mailbox = spilled[recipient] = self.__mailboxes.pop(recipient)
+                    self.__memoryBytes -= sum(entrySize(entry) for entry in mailbox)
+                    self.__memoryCount -= len(mailbox)
+                    self.__storedCounts[recipient] = self.__storedCounts.get(recipient, 0) + len(mailbox)
+            rows = [(recipient,) + entry for recipient, mailbox in spilled.items() for entry in mailbox]
+            if len(rows) == 0:
+                return 0
+            try:
+                self.__databaseUtils.insertMailbox(rows)
+            except Exception as error:
+                print("离线消息转存失败：{}".format(error))
+                with self.__condition:
+                    self.__stats['spillErrors'] += 1
+                    for recipient, mailbox in spilled.items():
+                        self.__storedCounts[recipient] -= len(mailbox)
+                        if self.__storedCounts[recipient] <= 0:
+                            del self.__storedCounts[recipient]
+                        current = self.__mailboxes.get(recipient)
+                        if current is not None:
+                            mailbox.extend(current)
+                        self.__mailboxes[recipient] = mailbox
+                        self.__memoryBytes += sum(entrySize(entry) for entry in mailbox)
+                        self.__memoryCount += len(mailbox)
+                return 0
+            with self.__condition:
+                self.__stats['spills'] += 1
+                self.__stats['spilled'] += len(rows)
+        return len(rows)
+
+# 后台转存循环
+    def __spillLoop(self):
+        """后台线程主体，内存占用超过上限时转存信箱"""
+        while self.__isRunning:
+            with self.__condition:
+                if self.__memoryBytes <= self.__memoryLimit:
+                    self.__condition.wait(SPILL_INTERVAL)
+            self.spill()
+            if self.__shared and t.monotonic() - self.__refreshTime >= COUNT_REFRESH_INTERVAL:
+                self.refreshCounts()
+        return None
+
+# 停止后台线程
+    def stop(self):
+        """停止后台线程，并将内存中全部的离线消息写入数据库，服务端重启后仍可投递
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:None
+        """
+        self.__isRunning = False
+        with self.__condition:
+            self.__condition.notify()
+        if self.__thread is not None:
+            self.__thread.join()
+        self.spill(force=True)
+        return None
+
+# 信箱中的消息总数
+    def depth(self) -> int:
+        """返回全部信箱中的消息总数(内存与数据库中的合计)"""
+        with self.__condition:
+            return self.__memoryCount + sum(self.__storedCounts.values())
+
+# 获取统计信息
+    def getStats(self) -> Dict[str, Union[int, float]]:
+        """返回信箱数量、内存与数据库中的消息数、内存占用以及存入、投递、丢弃和转存的统计信息
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:
+            Dict:统计信息
+        """
+        with self.__condition:
+            stats = dict(self.__stats)
+            stats['mailboxes'] = len(set(self.__mailboxes) | set(self.__storedCounts))
+            stats['memoryDepth'] = self.__memoryCount
+            stats['storedDepth'] = sum(self.__storedCounts.values())
+            stats['memoryBytes'] = self.__memoryBytes
+        return stats
+
+# 信箱数量
+    def __len__(self) -> int:
+        """返回内存或数据库中有离线消息的用户数"""
+        with self.__condition:
+            return len(set(self.__mailboxes) | set(self.__storedCounts))
@@ -8,9 +8,8 @@ def main() -> int:
     返回值:
         int:返回数字0表明程序正常执行结束
     """
-# 创建客户端实例
+# 创建客户端实例，连接在登录窗口中建立，无法连接时可以重试
     client = Client()
-    client.getConnection()
 # 创建登录窗口
     loginWindow = LoginWindow(client=client)
     loginWindow.mainloop()
@@ -1,11 +1,21 @@
 import tkinter as tk
 import threading as td
-import time as t
+import queue
+from collections import deque
 from tkinter import messagebox
 from datetime import datetime
 from typing import List, Tuple, Union
 from Client import *
 
+# 主线程每隔多少毫秒将接收队列中的消息显示到聊天框，约为一帧
+DRAIN_INTERVAL = 16
+# 每一帧最多处理的消息数，其余的留到下一帧，避免一次更新占用主线程过久
+DRAIN_BATCH_SIZE = 200
+# 聊天框最多保留的消息数，超出时删除最早的消息
+MAX_SCROLLBACK = 2000
+# 服务端不推送在线用户时，等待get请求回复的最长秒数
+QUERY_TIMEOUT = 5.0
+
 
 class ChatWindow(tk.Tk):
     """客户端聊天界面类，封装了一些创建界面需要用到的方法
@@ -13,9 +23,12 @@ class ChatWindow(tk.Tk):
     属性:
         width(int):登录界面的宽度
         height(int):登陆界面的高度
-        messageDisplayType(str):消息显示样式，不同的消息类别对应不同的样式
-        onlineUserInfo(str):在线用户信息，用于存储服务端发来的在线用户信息
         client(Client):客户端类的实例对象，用于调用客户端类的相关函数
+        incomingQueue(Queue):接收线程、查询线程与主线程之间的消息队列，元素为(显示样式, 昵称, 消息内容, 时间)，
+            显示样式为presence表示需要刷新在线用户列表，为online表示get查询结束，消息内容为查询到的在线用户列表，查询失败时为None
+        isQuerying(bool):是否有get查询正在进行，只由主线程访问，避免重复发起查询
+        displayedLines(deque):聊天框中每条消息占用的行数，用于删除最早的消息
+        drainJob(str):主线程下一次处理接收队列的after任务
     """
 
 # 构造函数
@@ -24,9 +37,11 @@ class ChatWindow(tk.Tk):
         super().__init__(master)
         self.width = 800
         self.height = 600
-        self.messageDisplayType = "selfMessage"
-        self.onlineUserInfo = None
         self.client = client
+        self.__incomingQueue = queue.Queue()
+        self.__isQuerying = False
+        self.__displayedLines = deque()
+        self.__drainJob = None
 
 # 设置窗口居中
     def setCenterWindow(self):
@@ -102,6 +117,7 @@ class ChatWindow(tk.Tk):
         self.chatBox.tag_configure("selfMessage", foreground="royalblue")
         self.chatBox.tag_configure("publicMessage", foreground="seagreen")
         self.chatBox.tag_configure("privateMessage", foreground="firebrick")
+        self.chatBox.tag_configure("systemMessage", foreground="gray")
 
 # 按钮
         self.buttonSend = tk.Button(self.rightInnerPanedWindow, text="发送", command=None, width=8,
@@ -164,8 +180,26 @@ class ChatWindow(tk.Tk):
 
 # 列表框显示在线用户
     def __displayOnlineUser(self, event=None):
-        """用于在列表框中显示在线用户昵称"""
-        onlineUserList = self.__getOnlineUser()
+        """用于刷新列表框中的在线用户昵称，服务端推送在线用户时直接读取客户端本地维护的集合，
+        否则在查询线程中发送get请求，收到回复后由主线程在__drainMessages中刷新列表"""
+        if self.client.hasPresence():
+            self.__showOnlineUser(self.client.getOnlineUsers())
+        elif not self.__isQuerying:
+            self.__isQuerying = True
+            thread = td.Thread(target=self.__queryOnlineUser, daemon=True)
+            thread.start()
+        return None
+
+# 显示在线用户
+    def __showOnlineUser(self, onlineUserList: List[str]):
+        """用于将在线用户昵称显示到列表框中
+
+        参数:
+            self:表明该函数是一个实例方法
+            onlineUserList(List[str]):在线用户昵称的字符串列表
+
+        返回值:None
+        """
     # 清空在线列表
         self.onlineUserList.delete(0, tk.END)
         for name in onlineUserList:
@@ -174,26 +208,16 @@ class ChatWindow(tk.Tk):
             self.onlineUserList.insert(tk.END, ("{}".format(name)))
         return None
 
-# 获取在线用户
-    def __getOnlineUser(self) -> List[str]:
-        """用于向服务端发送请求，获取当前在线用户信息
-
-        参数:
-            self:表明该函数是一个实例方法
-
-        返回值:
-            userList:值为当前在线用户昵称的字符串列表
-        """
-        messageDestination = "source"
-        messageType = "get"
-        message = None
-        messsageData = self.__messageProcess(messageDestination, messageType, message)
-        self.client.sendMessage(messsageData)
-        if self.onlineUserInfo == None:
-            userList = []
-        else:
-            userList = list(self.onlineUserInfo.split(" "))
-        return userList
+# 查询在线用户
+    def __queryOnlineUser(self):
+        """查询线程主体，发送带有请求id的get请求并等待对应的回复，不直接访问界面组件，
+        结果放入接收队列，查询超时或连接已断开时放入None"""
+        try:
+            userList = self.client.queryOnlineUsers(QUERY_TIMEOUT)
+        except (TimeoutError, OSError):
+            userList = None
+        self.__incomingQueue.put(("online", None, userList, None))
+        return None
 
 
 # 获取单个在线用户信息,用于向特定用户转发消息
@@ -232,7 +256,7 @@ class ChatWindow(tk.Tk):
         return (destination, messageType)
 
 # 消息处理函数
-    def __messageProcess(self, targetUser: str, messageType: str, message: str) -> str:
+    def __messageProcess(self, targetUser: str, messageType: str, message: str) -> dict:
         """消息处理函数，用于在发送消息前对消息进行一定的处理
 
         参数:
@@ -242,7 +266,7 @@ class ChatWindow(tk.Tk):
             message(str):消息的具体内容
 
         返回值:
-            data(str):经过处理后的消息字符串
+            data(dict):经过处理后的消息字典
         """
         data = self.client.processMessage(targetUser, messageType, message)
         return data
@@ -256,7 +280,6 @@ class ChatWindow(tk.Tk):
         if (len(message) == 0 or message.isspace() == True):
             messagebox.showinfo(title="提示", message="输入不能为空")
         else:
-            self.messageDisplayType = "selfMessage"
             self.__showChatMessage(message)
             messageData = self.__messageProcess(destination, messageType, message)
             self.client.sendMessage(messageData)
@@ -265,37 +288,94 @@ class ChatWindow(tk.Tk):
 
 # 接收聊天消息
     def __receiveChatMessage(self):
-        """用于接收服务端转发的来自其它客户端的消息信息并将消息显示在聊天框"""
-        while True:
-            if self.client.isClosed() == True:
+        """接收线程主体，用于接收服务端转发的来自其它客户端的消息信息，
+        只将需要显示的内容放入接收队列，不直接访问界面组件，界面由主线程在__drainMessages中更新"""
+        while self.client.isClosed() == False:
+            messageDict = self.client.receiveMessageDict()
+            if messageDict is None:
+                if self.client.isClosed() == False:
+                    self.__showChatMessage("与服务端的连接已断开", "系统", "systemMessage")
                 break
 
-            messageJSON = self.client.receiveMessage()
-
-            try:
-                messageDict = json.loads(messageJSON)
-            except json.JSONDecodeError:
-                continue
-
             messageSource = messageDict["source"]
-            messageDestination = messageDict["destination"]
             messageType = messageDict["type"]
             message = messageDict["data"]
 
             if messageType == "public":
-                self.messageDisplayType = "publicMessage"
+                displayType = "publicMessage"
+            elif messageType == "private" and isinstance(message, dict):
+                displayType = "systemMessage"
+                messageSource = "系统"
+                message = "用户{}不存在，消息未能送达".format(message['user'])
             elif messageType == "private":
-                self.messageDisplayType = "privateMessage"
-            elif messageType == "get":
-                self.onlineUserInfo = message
+                displayType = "privateMessage"
+            elif messageType == "presence":
+                self.__incomingQueue.put(("presence", None, None, None))
                 continue
+            elif messageType == "throttle":
+                displayType = "systemMessage"
+                messageSource = "系统"
+                message = "发送过快，请{:.1f}秒后再试".format(message['retryAfter'])
             else:
                 continue
 
-            self.__showChatMessage(nickname=messageSource, message=message)
+            self.__showChatMessage(message, messageSource, displayType)
 
         return None
 
+# 处理接收队列
+    def __drainMessages(self):
+        """在主线程中定期调用，每次最多取出DRAIN_BATCH_SIZE条消息，一次性显示到聊天框，
+        同一批中的多次在线用户变化只刷新一次列表，get查询的结果也在此显示"""
+        entries = []
+        isPresenceChanged = False
+        queriedUsers = None
+        for _ in range(DRAIN_BATCH_SIZE):
+            try:
+                entry = self.__incomingQueue.get_nowait()
+            except queue.Empty:
+                break
+            if entry[0] == "presence":
+                isPresenceChanged = True
+            elif entry[0] == "online":
+                self.__isQuerying = False
+                queriedUsers = entry[2] if entry[2] is not None else queriedUsers
+            else:
+                entries.append(entry)
+        if len(entries) > 0:
+            self.__renderMessages(entries)
+        if isPresenceChanged:
+            self.__displayOnlineUser()
+        elif queriedUsers is not None:
+            self.__showOnlineUser(queriedUsers)
+        self.__drainJob = self.after(DRAIN_INTERVAL, self.__drainMessages)
+        return None
+
+# 显示一批消息
+    def __renderMessages(self, entries: List[Tuple[str, str, str, str]]):
+        """将一批消息以一次插入操作追加到聊天框末尾，消息数超过MAX_SCROLLBACK时删除最早的消息
+
+        参数:
+            self:表明该函数是一个实例方法
+            entries(List[Tuple]):(显示样式, 昵称, 消息内容, 时间)组成的列表
+
+        返回值:None
+        """
+        segments = []
+        for displayType, nickname, message, timeInfo in entries:
+            messageInfo = "{}：{}\n\n".format(nickname, message)
+            segments.extend((timeInfo + '\n', "timeStyle", messageInfo, displayType))
+            self.__displayedLines.append(1 + messageInfo.count("\n"))
+        self.chatBox.configure(state="normal")
+        self.chatBox.insert(tk.END, *segments)
+        excess = len(self.__displayedLines) - MAX_SCROLLBACK
+        if excess > 0:
+            lines = sum(self.__displayedLines.popleft() for _ in range(excess))
+            self.chatBox.delete("1.0", "{}.0".format(lines + 1))
+        self.chatBox.see(tk.END)
+        self.chatBox.configure(state="disabled")
+        return None
+
 # 输入框清空发送
     def __cleanInputText(self, event=None):
         """回调函数，当用户按下相应的按钮时调用此函数清空输入框"""
@@ -303,23 +383,19 @@ class ChatWindow(tk.Tk):
         return None
 
 # 聊天框显示消息
-    def __showChatMessage(self, message: str, nickname: str = "我"):
-        """用于在聊天框显示发送和接收到的聊天消息
+    def __showChatMessage(self, message: str, nickname: str = "我", displayType: str = "selfMessage"):
+        """用于在聊天框显示发送和接收到的聊天消息，可以在任何线程中调用，
+        消息记录当前时间后放入接收队列，由主线程在下一帧显示
 
         参数:
             self:表明该函数是一个实例方法
             message(str):消息的具体内容
             nickname(str):消息的发送者的昵称
+            displayType(str):消息显示样式，不同的消息类别对应不同的样式
 
         返回值:None
         """
-        self.chatBox.configure(state="normal")
-        currentTime = self.__getSystemTime() + '\n'
-        messageInfo = "{}：{}\n\n".format(nickname, message)
-        self.chatBox.insert(tk.END, currentTime, "timeStyle")
-        self.chatBox.insert(tk.INSERT, messageInfo, self.messageDisplayType)
-        self.chatBox.see(tk.END)
-        self.chatBox.configure(state="disabled")
+        self.__incomingQueue.put((displayType, nickname, message, self.__getSystemTime()))
         return None
 
 # 清空聊天框消息
@@ -328,11 +404,13 @@ class ChatWindow(tk.Tk):
         self.chatBox.configure(state=tk.NORMAL)
         self.chatBox.delete("1.0", "end")
         self.chatBox.configure(state=tk.DISABLED)
+        self.__displayedLines.clear()
         return None
 
 # 直接关闭窗口
     def __closeWindow(self):
         """回调函数，当用户直接关闭聊天窗口时调用此函数"""
+        self.after_cancel(self.__drainJob)
         self.destroy()
         self.client.closeConnection()
         return None
@@ -343,13 +421,14 @@ class ChatWindow(tk.Tk):
     # 弹出对话框
         result = messagebox.askokcancel(title="提示", message="退出将关闭当前连接，确定要退出吗？")
         if result == True:
+            self.after_cancel(self.__drainJob)
             self.destroy()
             self.client.closeConnection()
         return None
 
 # 主函数
     def main(self) -> int:
-        """用于创建聊天窗口并开启客户端的多线程消息接收函数
+        """用于创建聊天窗口并开启客户端的多线程消息接收函数，以及主线程中定期处理接收队列的任务
 
         参数:
             self:表明该函数是一个实例方法
@@ -358,6 +437,7 @@ class ChatWindow(tk.Tk):
             int:返回数字0表明程序正常执行结束
         """
         self.createChatWindow()
+        self.__drainJob = self.after(DRAIN_INTERVAL, self.__drainMessages)
 
         try:
             thread = td.Thread(target=self.__receiveChatMessage)
@@ -0,0 +1,278 @@
+import threading as td
+import time as t
+from collections import deque
+from typing import Dict, List, Tuple, Union
+import Outbound as ob
+
+# 每页聊天记录的默认条数与最大条数
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 200
+# 批量写入失败后第一次重试的等待秒数，之后每次失败翻倍，最长不超过MAX_RETRY_DELAY
+RETRY_DELAY = 0.5
+MAX_RETRY_DELAY = 30.0
+# 同一批记录连续写入失败的次数达到该值后，将该批记录二分重试以找出无法写入的记录
+MAX_FLUSH_ATTEMPTS = 3
+# 二分查找时还没有任何记录写入成功，而单条写入失败的记录已达到该数量，认为是数据库不可用而不是记录本身的问题
+MAX_BLIND_REJECTS = 8
+
+
+# 生成会话标识
+def conversationKey(messageType: str, sourceUser: str, targetUser: str = None) -> str:
+    """根据消息类型和双方昵称生成会话标识，群聊为public，聊天室群聊为room加聊天室名称，私聊与双方顺序无关，
+    昵称与聊天室名称中不会包含空白字符，因此使用空格分隔
+
+    参数:
+        messageType(str):消息类型，public 或 private
+        sourceUser(str):消息发送者的昵称
+        targetUser(str):消息目标用户的昵称，聊天室群聊时为聊天室名称
+
+    返回值:
+        str:会话标识
+    """
+    if messageType == "public":
+        return "public" if targetUser is None else "room {}".format(targetUser)
+    first, second = sorted([sourceUser, targetUser])
+    return "private {} {}".format(first, second)
+
+
+class MessageStore(object):
+    """聊天记录存储类，采用写回(write-behind)方式：转发消息时只将记录放入内存队列，
+    由后台线程在队列达到批量大小或到达刷新间隔时，以一个事务批量写入数据库
+
+    属性:
+        databaseUtils(DatabaseUtils):数据库工具对象
+        batchSize(int):触发刷新的队列长度，也是单个事务写入的最大条数
+        flushInterval(float):最长刷新间隔(秒)
+        maxQueueSize(int):内存队列的最大长度，超过时丢弃最早的记录，写入失败放回队列的记录同样受该长度限制
+        pendingMessages(deque):等待写入数据库的记录
+        retryDelay(float):写入失败后的当前退避秒数，写入成功后归零
+        retryTime(float):退避结束的时刻(time.monotonic的秒数)，此前后台线程不再尝试写入
+        failedAttempts(int):队列开头的一批记录连续写入失败的次数
+        flushLatency(LatencyRecorder):每次批量写入的耗时统计
+        stats(dict):刷新次数、写入条数、最近批量大小、丢弃条数等统计信息
+    """
+
+# 构造函数
+    def __init__(self, databaseUtils: 'DatabaseUtils', batchSize: int = 500, flushInterval: float = 0.5,
+                 maxQueueSize: int = 100000):
+        """构造函数，用于聊天记录存储对象初始化"""
+        self.__databaseUtils = databaseUtils
+        self.__batchSize = batchSize
+        self.__flushInterval = flushInterval
+        self.__maxQueueSize = maxQueueSize
+        self.__pendingMessages = deque()
+        self.__retryDelay = 0.0
+        self.__retryTime = 0.0
+        self.__failedAttempts = 0
+        self.__condition = td.Condition()
+        self.__flushLatency = ob.LatencyRecorder()
+        self.__stats = {'appended': 0, 'flushes': 0, 'flushedMessages': 0, 'lastBatchSize': 0,
+                        'maxQueueDepth': 0, 'dropped': 0, 'flushErrors': 0}
+        self.__isRunning = False
+        self.__thread = None
+
+# 启动后台线程
+    def start(self):
+        """启动负责批量写入的后台线程
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:None
+        """
+        self.__isRunning = True
+        self.__thread = td.Thread(target=self.__flushLoop, name="MessageStore", daemon=True)
+        self.__thread.start()
+        return None
+
+# 添加记录
+    def append(self, messageType: str, sourceUser: str, targetUser: Union[str, None], message: str):
+        """将一条已转发的消息放入写回队列，只做一次加锁的入队操作，不访问数据库
+
+        参数:
+            self:表明该函数是一个实例方法
+            messageType(str):消息类型，public 或 private
+            sourceUser(str):消息发送者的昵称
+            targetUser(str):消息目标用户的昵称，群聊为None，聊天室群聊为聊天室名称
+            message(str):消息的具体内容
+
+        返回值:None
+        """
+        record = (conversationKey(messageType, sourceUser, targetUser), sourceUser, targetUser,
+                  messageType, message, t.time())
+        with self.__condition:
+            if len(self.__pendingMessages) >= self.__maxQueueSize:
+                self.__pendingMessages.popleft()
+                self.__stats['dropped'] += 1
+            self.__pendingMessages.append(record)
+            self.__stats['appended'] += 1
+            depth = len(self.__pendingMessages)
+            if depth > self.__stats['maxQueueDepth']:
+                self.__stats['maxQueueDepth'] = depth
+            if depth == self.__batchSize:
+                self.__condition.notify()
+        return None
+
+# 刷新一批记录
+    def flush(self) -> int:
+        """将队列中的记录按batchSize分批写入数据库，每批一个事务，
+        写入失败时该批记录放回队列开头等待退避后重试，队列超出最大长度的部分丢弃最早的记录，
+        连续失败MAX_FLUSH_ATTEMPTS次后二分查找并丢弃无法写入的记录(例如超出列长度)，避免一条记录阻塞之后的全部记录
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:
+            int:本次写入的记录数
+        """
+        total = 0
+        while True:
+            with self.__condition:
+                batch = [self.__pendingMessages.popleft()
+                         for _ in range(min(self.__batchSize, len(self.__pendingMessages)))]
+            if len(batch) == 0:
+                return total
+            startTime = t.perf_counter()
+            try:
+                self.__databaseUtils.insertMessages(batch)
+            except Exception as error:
+                with self.__condition:
+                    self.__failedAttempts += 1
+                    isIsolating = self.__failedAttempts >= MAX_FLUSH_ATTEMPTS
+                if isIsolating:
+                    written, rejected = self.__isolate(batch)
+                    if written > 0:
+                        print("丢弃{}条无法写入的聊天记录：{}".format(len(rejected), error))
+                        with self.__condition:
+                            self.__failedAttempts = 0
+                            self.__retryDelay = 0.0
+                            self.__stats['dropped'] += len(rejected)
+                            self.__stats['flushes'] += 1
+                            self.__stats['flushedMessages'] += written
+                            self.__stats['lastBatchSize'] = written
+                        total += written
+                        continue
+                with self.__condition:
+                    self.__pendingMessages.extendleft(reversed(batch))
+                    while len(self.__pendingMessages) > self.__maxQueueSize:
+                        self.__pendingMessages.popleft()
+                        self.__stats['dropped'] += 1
+                    self.__stats['flushErrors'] += 1
+                    self.__retryDelay = min(max(RETRY_DELAY, self.__retryDelay * 2), MAX_RETRY_DELAY)
+                    self.__retryTime = t.monotonic() + self.__retryDelay
+                    retryDelay = self.__retryDelay
+                print("聊天记录写入失败，{}秒后重试：{}".format(retryDelay, error))
+                return total
+            self.__flushLatency.record(t.perf_counter() - startTime)
+            with self.__condition:
+                self.__failedAttempts = 0
+                self.__retryDelay = 0.0
+                self.__stats['flushes'] += 1
+                self.__stats['flushedMessages'] += len(batch)
+                self.__stats['lastBatchSize'] = len(batch)
+            total += len(batch)
+
+# 找出无法写入的记录
+    def __isolate(self, batch: List[tuple]) -> Tuple[int, List[tuple]]:
+        """将连续写入失败的一批记录按顺序二分写入，只剩单条仍然失败的记录即为无法写入的记录，
+        没有任何记录写入成功时无法区分记录本身的问题与数据库不可用，此时不丢弃任何记录，
+        并在单条失败的记录达到MAX_BLIND_REJECTS条时提前结束，数据库不可用时每次重试只多尝试有限的几次写入
+
+        参数:
+            self:表明该函数是一个实例方法
+            batch(List[tuple]):连续写入失败的一批记录
+
+        返回值:
+            Tuple[int, List[tuple]]:写入成功的记录数，以及无法写入的记录
+        """
+        parts = deque([batch])
+        written = 0
+        rejected = []
+        while len(parts) > 0:
+            part = parts.popleft()
+            try:
+                self.__databaseUtils.insertMessages(part)
+                written += len(part)
+            except Exception:
+                if len(part) == 1:
+                    rejected.append(part[0])
+                    if written == 0 and len(rejected) >= MAX_BLIND_REJECTS:
+                        return 0, []
+                else:
+                    middle = len(part) // 2
+                    parts.extendleft((part[middle:], part[:middle]))
+        if written == 0:
+            return 0, []
+        return written, rejected
+
+# 后台刷新循环
+    def __flushLoop(self):
+        """后台线程主体，队列达到批量大小或到达刷新间隔时写入数据库，写入失败后等待退避结束再重试"""
+        while self.__isRunning:
+            with self.__condition:
+                backoff = self.__retryTime - t.monotonic()
+                if backoff > 0:
+                    self.__condition.wait(backoff)
+                    continue
+                if len(self.__pendingMessages) < self.__batchSize:
+                    self.__condition.wait(self.__flushInterval)
+            self.flush()
+        return None
+
+# 停止后台线程
+    def stop(self):
+        """停止后台线程，并将队列中剩余的记录写入数据库
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:None
+        """
+        self.__isRunning = False
+        with self.__condition:
+            self.__condition.notify()
+        if self.__thread is not None:
+            self.__thread.join()
+        self.flush()
+        return None
+
+# 查询聊天记录
+    def getHistory(self, messageType: str, sourceUser: str, targetUser: Union[str, None],
+                   beforeId: int = None, limit: int = HISTORY_PAGE_SIZE) -> Dict[str, Union[list, int, None]]:
+        """分页查询会话的聊天记录，尚在写回队列中的记录需要等待下一次刷新后才能查询到
+
+        参数:
+            self:表明该函数是一个实例方法
+            messageType(str):会话类型，public 或 private
+            sourceUser(str):请求者的昵称
+            targetUser(str):私聊对象的昵称，群聊为None
+            beforeId(int):游标，只返回id小于该值的记录，None表示从最新的记录开始
+            limit(int):每页条数
+
+        返回值:
+            Dict:messages为按时间正序排列的记录列表，nextCursor为下一页的游标，None表示没有更早的记录
+        """
+        limit = max(1, min(int(limit), HISTORY_MAX_PAGE_SIZE))
+        rows = self.__databaseUtils.searchMessages(conversationKey(messageType, sourceUser, targetUser),
+                                                   beforeId, limit)
+        messages = [{'id': row[0], 'source': row[2], 'destination': row[3], 'type': row[4],
+                     'data': row[5], 'time': row[6]} for row in reversed(rows)]
+        nextCursor = rows[-1][0] if len(rows) == limit else None
+        return {'messages': messages, 'nextCursor': nextCursor}
+
+# 获取统计信息
+    def getStats(self) -> Dict[str, Union[int, float, dict]]:
+        """返回写回队列深度、批量大小以及刷新耗时等统计信息
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:
+            Dict:统计信息
+        """
+        with self.__condition:
+            stats = dict(self.__stats)
+            stats['queueDepth'] = len(self.__pendingMessages)
+        stats['meanBatchSize'] = stats['flushedMessages'] / stats['flushes'] if stats['flushes'] > 0 else 0.0
+        stats['flushLatency'] = self.__flushLatency.summary()
+        return stats
@@ -0,0 +1,321 @@
+import threading as td
+import time as t
+from typing import Callable, Dict, Union
+
+# 直方图的精度：共64个子区间(SUB_BUCKET_COUNT)，小于64的值精确记录，
+# 更大的值每个2的幂区间划分为其中一半即32个子区间(HALF_BUCKET_COUNT)，相对误差约为3%
+SUB_BUCKET_BITS = 6
+SUB_BUCKET_COUNT = 1 << SUB_BUCKET_BITS
+HALF_BUCKET_COUNT = SUB_BUCKET_COUNT // 2
+# 可记录的最大值约为2^36微秒，更大的值记入最后一个区间
+MAX_SHIFT = 30
+BUCKET_COUNT = SUB_BUCKET_COUNT + MAX_SHIFT * HALF_BUCKET_COUNT
+# 输出的百分位
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+# 计算区间编号
+def bucketIndex(value: int) -> int:
+    """计算数值所在的直方图区间，小于64的值每个值一个区间，更大的值按对数分段、段内线性划分
+
+    参数:
+        value(int):记录的数值(微秒)
+
+    返回值:
+        int:区间编号
+    """
+    if value < SUB_BUCKET_COUNT:
+        return max(value, 0)
+    shift = value.bit_length() - SUB_BUCKET_BITS
+    if shift > MAX_SHIFT:
+        return BUCKET_COUNT - 1
+    return SUB_BUCKET_COUNT + (shift - 1) * HALF_BUCKET_COUNT + (value >> shift) - HALF_BUCKET_COUNT
+
+
+# 计算区间上界
+def bucketUpperBound(index: int) -> int:
+    """返回区间内的最大值，计算百分位时使用
+
+    参数:
+        index(int):区间编号
+
+    返回值:
+        int:区间上界(微秒)
+    """
+    if index < SUB_BUCKET_COUNT:
+        return index
+    shift = (index - SUB_BUCKET_COUNT) // HALF_BUCKET_COUNT + 1
+    mantissa = (index - SUB_BUCKET_COUNT) % HALF_BUCKET_COUNT + HALF_BUCKET_COUNT
+    return ((mantissa + 1) << shift) - 1
+
+
+class Histogram(object):
+    """HDR风格的延迟直方图，记录时只做一次区间计算与计数，不保存样本，
+    每个线程拥有自己的直方图，因此记录时无需加锁，读取时合并所有线程的直方图
+
+    属性:
+        counts(list):各区间的计数
+        count(int):样本数
+        total(int):样本总和(微秒)
+        maximum(int):最大样本(微秒)
+    """
+
+# 构造函数
+    def __init__(self):
+        """构造函数，用于直方图对象初始化"""
+        self.counts = [0] * BUCKET_COUNT
+        self.count = 0
+        self.total = 0
+        self.maximum = 0
+
+# 记录样本
+    def record(self, seconds: float):
+        """记录一个延迟样本
+
+        参数:
+            self:表明该函数是一个实例方法
+            seconds(float):延迟(秒)
+
+        返回值:None
+        """
+        value = int(seconds * 1e6)
+        self.counts[bucketIndex(value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.maximum:
+            self.maximum = value
+        return None
+
+# 合并
+    def merge(self, other: 'Histogram'):
+        """将另一个直方图的计数累加到本直方图"""
+        for index, count in enumerate(other.counts):
+            if count:
+                self.counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        self.maximum = max(self.maximum, other.maximum)
+        return None
+
+# 计算百分位
+    def summary(self) -> Dict[str, Union[int, float]]:
+        """返回样本数、平均值、各百分位与最大值，时间单位为毫秒
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:
+            Dict:直方图摘要
+        """
+        result = {'count': self.count, 'meanMs': self.total / self.count / 1000 if self.count else 0.0}
+        targets = [(percentile, self.count * percentile / 100) for percentile in PERCENTILES]
+        cumulative = 0
+        position = 0
+        for index, count in enumerate(self.counts):
+            if position == len(targets):
+                break
+            cumulative += count
+            while position < len(targets) and count and cumulative >= targets[position][1]:
+                percentile = targets[position][0]
+                result["p{}Ms".format(percentile)] = min(bucketUpperBound(index), self.maximum) / 1000
+                position += 1
+        for percentile, _ in targets[position:]:
+            result["p{}Ms".format(percentile)] = 0.0
+        result['maxMs'] = self.maximum / 1000
+        return result
+
+
+class MetricsShard(object):
+    """单个线程的指标分片，只由所属线程写入
+
+    属性:
+        thread(Thread):所属线程
+        counters(dict):计数器名称到数值的映射
+        histograms(dict):直方图名称到直方图的映射
+    """
+
+# 构造函数
+    def __init__(self, thread: 'Thread'):
+        """构造函数，用于指标分片对象初始化"""
+        self.thread = thread
+        self.counters = {}
+        self.histograms = {}
+
+# 合并
+    def merge(self, other: 'MetricsShard'):
+        """将另一个分片的计数器与直方图累加到本分片"""
+        for name, value in list(other.counters.items()):
+            self.counters[name] = self.counters.get(name, 0) + value
+        for name, histogram in list(other.histograms.items()):
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].merge(histogram)
+        return None
+
+
+class MetricsRegistry(object):
+    """指标注册表类，计数器与直方图按线程分片记录，记录时不加锁，
+    读取快照时合并所有分片，已结束线程的分片合并进退役分片后释放，
+    仪表盘类指标(如在线人数)在读取快照时通过回调函数计算
+
+    属性:
+        shards(list):仍在运行的线程的分片
+        retired(MetricsShard):已结束线程的分片的合并结果
+        gauges(dict):仪表盘名称到取值函数的映射
+        local(local):线程局部存储，保存当前线程的分片
+        startTime(float):注册表创建时间
+    """
+
+# 构造函数
+    def __init__(self):
+        """构造函数，用于指标注册表对象初始化"""
+        self.__shards = []
+        self.__retired = MetricsShard(None)
+        self.__gauges = {}
+        self.__local = td.local()
+        self.__lock = td.Lock()
+        self.__startTime = t.time()
+
+# 获取当前线程的分片
+    def __shard(self) -> 'MetricsShard':
+        """返回当前线程的分片，第一次调用时创建并登记"""
+        shard = getattr(self.__local, "shard", None)
+        if shard is None:
+            shard = MetricsShard(td.current_thread())
+            self.__local.shard = shard
+            with self.__lock:
+                self.__shards.append(shard)
+        return shard
+
+# 计数
+    def increment(self, name: str, amount: int = 1):
+        """将计数器增加指定的值
+
+        参数:
+            self:表明该函数是一个实例方法
+            name(str):计数器名称
+            amount(int):增加的值
+
+        返回值:None
+        """
+        counters = self.__shard().counters
+        counters[name] = counters.get(name, 0) + amount
+        return None
+
+# 记录延迟
+    def record(self, name: str, seconds: float):
+        """向直方图记录一个延迟样本
+
+        参数:
+            self:表明该函数是一个实例方法
+            name(str):直方图名称
+            seconds(float):延迟(秒)
+
+        返回值:None
+        """
+        histograms = self.__shard().histograms
+        histogram = histograms.get(name)
+        if histogram is None:
+            histogram = histograms[name] = Histogram()
+        histogram.record(seconds)
+        return None
+
+# 注册仪表盘
+    def addGauge(self, name: str, function: Callable[[], Union[int, float]]):
+        """注册一个在读取快照时计算的仪表盘类指标
+
+        参数:
+            self:表明该函数是一个实例方法
+            name(str):指标名称
+            function(Callable):返回当前值的函数
+
+        返回值:None
+        """
+        self.__gauges[name] = function
+        return None
+
+# 获取快照
+    def snapshot(self) -> Dict[str, dict]:
+        """合并所有线程的分片并计算仪表盘，返回当前全部指标
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:
+            Dict:counters为计数器，gauges为仪表盘，histograms为直方图摘要，uptime为运行秒数
+        """
+        merged = MetricsShard(None)
+        with self.__lock:
+            aliveShards = []
+            for shard in self.__shards:
+                if shard.thread.is_alive():
+                    aliveShards.append(shard)
+                else:
+                    self.__retired.merge(shard)
+            self.__shards = aliveShards
+            merged.merge(self.__retired)
+        for shard in aliveShards:
+            merged.merge(shard)
+        gauges = {}
+        for name, function in list(self.__gauges.items()):
+            try:
+                gauges[name] = function()
+            except Exception as error:
+                gauges[name] = "error: {}".format(error)
+        return {'uptime': t.time() - self.__startTime, 'counters': dict(sorted(merged.counters.items())),
+                'gauges': gauges,
+                'histograms': {name: merged.histograms[name].summary() for name in sorted(merged.histograms)}}
+
+
+# 生成文本格式
+def formatText(snapshot: Dict[str, dict]) -> str:
+    """将指标快照转换为每行一个指标的文本，便于写入日志
+
+    参数:
+        snapshot(dict):MetricsRegistry.snapshot的返回值
+
+    返回值:
+        str:文本格式的指标
+    """
+    lines = ["uptime {:.0f}".format(snapshot['uptime'])]
+    for name, value in snapshot['counters'].items():
+        lines.append("{} {}".format(name, value))
+    for name, value in snapshot['gauges'].items():
+        lines.append("{} {}".format(name, value))
+    for name, summary in snapshot['histograms'].items():
+        lines.append("{} {}".format(name, " ".join("{}={}".format(key, round(value, 3) if isinstance(value, float)
+                                                                  else value) for key, value in summary.items())))
+    return "\n".join(lines)
+
+
+class MetricsReporter(td.Thread):
+    """指标输出线程，每隔固定时间以文本格式输出一次全部指标
+
+    属性:
+        registry(MetricsRegistry):指标注册表
+        interval(float):输出间隔(秒)
+        output(Callable):输出函数，默认为print
+    """
+
+# 构造函数
+    def __init__(self, registry: 'MetricsRegistry', interval: float, output: Callable[[str], None] = print):
+        """构造函数，用于指标输出线程对象初始化"""
+        super().__init__(name="MetricsReporter", daemon=True)
+        self.__registry = registry
+        self.__interval = interval
+        self.__output = output
+        self.__stopEvent = td.Event()
+
+# 线程主体
+    def run(self):
+        """每隔interval秒输出一次指标，直到被停止"""
+        while not self.__stopEvent.wait(self.__interval):
+            self.__output(formatText(self.__registry.snapshot()))
+        return None
+
+# 停止
+    def stop(self):
+        """停止输出线程"""
+        self.__stopEvent.set()
+        self.join()
+        return None
@@ -0,0 +1,515 @@
+import socket as sk
+import threading as td
+import selectors
+import itertools
+import os
+import time as t
+from collections import deque
+from typing import Callable, Dict, List, Tuple, Union
+
+# 慢消费者处理策略：drop 直接断开该连接；lag 标记为滞后并丢弃新消息，直到队列回落
+POLICY_DROP = "drop"
+POLICY_LAG = "lag"
+# 非阻塞发送标志，不支持该标志的平台上依赖selector的可写通知
+SEND_FLAGS = getattr(sk, "MSG_DONTWAIT", 0)
+# 平台是否支持sendmsg，支持时一次系统调用发送队列中的多个帧
+HAS_SENDMSG = hasattr(sk.socket, "sendmsg")
+# 单次sendmsg最多携带的缓冲区数，受系统IOV_MAX限制
+try:
+    IOV_MAX = os.sysconf("SC_IOV_MAX")
+except (AttributeError, ValueError, OSError):
+    IOV_MAX = 16
+# 单次发送最多合并的帧数，1表示每帧一次系统调用
+WRITE_BATCH = min(IOV_MAX, 512)
+# 发送队列由空变为非空后最多等待该秒数再发送，以便合并随后放入的帧，
+# 默认为0，只合并发送时已经在队列中的帧，不增加空闲时的延迟
+FLUSH_DELAY = 0.0
+# 等待发送的字节数达到该值时不再等待，立即发送
+COALESCE_BYTES = 64 * 1024
+
+
+# 关闭Nagle算法
+def enableNoDelay(sock: 'socket'):
+    """为连接设置TCP_NODELAY，小消息的合并由发送队列按延迟预算完成，不再依赖Nagle算法等待确认，
+    平台不支持时跳过
+
+    参数:
+        sock(socket对象):客户端连接
+
+    返回值:None
+    """
+    try:
+        sock.setsockopt(sk.IPPROTO_TCP, sk.TCP_NODELAY, True)
+    except (OSError, AttributeError):
+        pass
+    return None
+
+
+class LatencyRecorder(object):
+    """延迟记录类，保存最近若干个延迟样本并提供统计摘要
+
+    属性:
+        samples(deque):最近的延迟样本，单位为秒
+        count(int):累计记录的样本总数
+        lock(Lock):保护样本数据的锁
+    """
+
+# 构造函数
+    def __init__(self, size: int = 1024):
+        """构造函数，用于延迟记录对象初始化"""
+        self.__samples = deque(maxlen=size)
+        self.__count = 0
+        self.__lock = td.Lock()
+
+# 记录样本
+    def record(self, seconds: float):
+        """记录一个延迟样本
+
+        参数:
+            self:表明该函数是一个实例方法
+            seconds(float):延迟时间，单位为秒
+
+        返回值:None
+        """
+        with self.__lock:
+            self.__samples.append(seconds)
+            self.__count += 1
+        return None
+
+# 统计摘要
+    def summary(self) -> Dict[str, float]:
+        """返回最近样本的统计摘要，时间单位为毫秒
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:
+            Dict[str, float]:包含样本总数、最近一次、平均值、p99与最大值
+        """
+        with self.__lock:
+            samples = sorted(self.__samples)
+            count = self.__count
+            last = self.__samples[-1] if self.__samples else 0.0
+        if len(samples) == 0:
+            return {'count': count, 'lastMs': 0.0, 'meanMs': 0.0, 'p99Ms': 0.0, 'maxMs': 0.0}
+        p99 = samples[min(len(samples) - 1, int(len(samples) * 0.99))]
+        return {'count': count, 'lastMs': last * 1000, 'meanMs': sum(samples) / len(samples) * 1000,
+                'p99Ms': p99 * 1000, 'maxMs': samples[-1] * 1000}
+
+
+class BroadcastTracker(object):
+    """群发跟踪类，记录一次群发从开始到最后一个接收者完成发送所用的时间，
+    没有接收者的群发不会调用onComplete，以免零耗时的样本拉低群发延迟统计
+
+    属性:
+        startTime(float):群发开始的时间
+        remaining(int):尚未完成发送的接收者数量
+        onComplete(Callable):所有接收者完成后调用，参数为耗时(秒)
+    """
+
+# 构造函数
+    def __init__(self, recipients: int, onComplete: Callable[[float], None]):
+        """构造函数，用于群发跟踪对象初始化"""
+        self.__startTime = t.perf_counter()
+        self.__remaining = recipients
+        self.__onComplete = onComplete
+        self.__lock = td.Lock()
+
+# 单个接收者完成
+    def done(self):
+        """某个接收者的发送完成(或被丢弃)时调用，最后一个接收者完成时记录总耗时
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:None
+        """
+        with self.__lock:
+            self.__remaining -= 1
+            isLast = self.__remaining == 0
+        if isLast:
+            self.__onComplete(t.perf_counter() - self.__startTime)
+        return None
+
+
+class OutboundQueue(object):
+    """连接发送队列类，每个连接一个有界队列，转发消息时只需将已编码好的帧放入队列，
+    实际发送由发送线程(线程模式)或写协程(asyncio模式)完成，慢连接不会阻塞其他连接
+
+    属性:
+        connection(socket对象):该队列对应的连接
+        notify(Callable):队列由空变为非空或队列被关闭时调用，用于唤醒发送者
+        frames(deque):等待发送的帧及其群发跟踪对象
+        queuedBytes(int):队列中等待发送的字节数
+        maxFrames(int):队列允许的最大帧数
+        maxBytes(int):队列允许的最大字节数
+        isLagging(bool):连接是否被标记为滞后
+        isClosed(bool):队列是否已关闭
+        isBackpressured(bool):队列超过高水位后为True，回落到低水位以下才恢复为False，
+            为True时服务端暂停读取该连接的请求，避免其请求产生的回复继续堆积
+        writable(Event):isBackpressured为False时被设置，线程模式的读取线程在其上等待
+        onWritable(Callable):队列回落到低水位以下时调用，asyncio模式用于唤醒读取协程
+    """
+
+# 构造函数
+    def __init__(self, connection: 'socket', notify: Callable[['OutboundQueue'], None],
+                 maxFrames: int = 1024, maxBytes: int = 8 * 1024 * 1024,
+                 onWritable: Callable[['OutboundQueue'], None] = None):
+        """构造函数，用于发送队列对象初始化"""
+        self.connection = connection
+        self.__notify = notify
+        self.__onWritable = onWritable
+        self.__isBackpressured = False
+        self.__writable = td.Event()
+        self.__writable.set()
+        self.__frames = deque()
+        self.__queuedBytes = 0
+        self.__maxFrames = maxFrames
+        self.__maxBytes = maxBytes
+        self.__isLagging = False
+        self.__isClosed = False
+        self.__lock = td.Lock()
+
+# 放入一帧
+    def push(self, frame: bytes, tracker: 'BroadcastTracker' = None) -> bool:
+        """将一帧放入发送队列，调用不会阻塞
+
+        参数:
+            self:表明该函数是一个实例方法
+            frame(bytes):已经编码好的帧，群发时所有接收者共享同一个对象
+            tracker(BroadcastTracker):群发跟踪对象，单发时为None
+
+        返回值:
+            bool:True 表明已放入队列；False 表明队列已满(连接被标记为滞后)或已关闭，该帧被丢弃
+        """
+        with self.__lock:
+            accepted = False
+            wasEmpty = len(self.__frames) == 0
+            if self.__isClosed:
+                pass
+            elif len(self.__frames) >= self.__maxFrames or self.__queuedBytes + len(frame) > self.__maxBytes:
+                self.__isLagging = True
+            elif self.__isLagging and len(self.__frames) > self.__maxFrames // 2:
+            # 滞后状态下等待队列回落到一半以下再恢复接收
+                pass
+            else:
+                self.__isLagging = False
+                self.__frames.append((memoryview(frame), tracker))
+                self.__queuedBytes += len(frame)
+                accepted = True
+                if not self.__isBackpressured and (self.__queuedBytes >= self.__maxBytes // 2
+                                                   or len(self.__frames) >= self.__maxFrames // 2):
+                    self.__isBackpressured = True
+                    self.__writable.clear()
+        if not accepted and tracker is not None:
+            tracker.done()
+        if accepted and wasEmpty:
+            self.__notify(self)
+        return accepted
+
+# 非阻塞发送
+    def sendPending(self, batchSize: int = WRITE_BATCH) -> Tuple[bool, int, int]:
+        """在不阻塞的前提下尽可能多地发送队列中的数据，只由发送线程调用，
+        每次系统调用通过sendmsg将队首最多batchSize个帧一起发送，帧不需要先拼接成一个字节串
+
+        参数:
+            self:表明该函数是一个实例方法
+            batchSize(int):单次系统调用最多发送的帧数
+
+        返回值:
+            Tuple[bool, int, int]:队列是否已清空(False表明套接字暂时不可写，仍有数据等待发送)、
+                发送的系统调用次数以及完整发送的帧数
+        """
+        calls = 0
+        completed = 0
+        while True:
+            with self.__lock:
+                if self.__isClosed or len(self.__frames) == 0:
+                    return True, calls, completed
+                views = [view for view, tracker in itertools.islice(self.__frames, batchSize)]
+            calls += 1
+            try:
+                if len(views) == 1 or not HAS_SENDMSG:
+                    sent = self.connection.send(views[0], SEND_FLAGS)
+                else:
+                    sent = self.connection.sendmsg(views, (), SEND_FLAGS)
+            except (BlockingIOError, InterruptedError):
+                return False, calls, completed
+            isPartial = sent < sum(len(view) for view in views)
+            trackers = []
+            with self.__lock:
+                if self.__isClosed:
+                    return True, calls, completed
+                self.__queuedBytes -= sent
+            # 按发送的字节数依次移出已完整发送的帧，最后一个帧可能只发送了一部分
+                while sent > 0:
+                    view, tracker = self.__frames[0]
+                    if sent < len(view):
+                        self.__frames[0] = (view[sent:], tracker)
+                        break
+                    self.__frames.popleft()
+                    sent -= len(view)
+                    trackers.append(tracker)
+                isReleased = self.__releaseBackpressure()
+            if isReleased:
+                self.__wakeReader()
+            for tracker in trackers:
+                if tracker is not None:
+                    tracker.done()
+            completed += len(trackers)
+            if isPartial:
+                return False, calls, completed
+
+# 取出全部帧
+    def popAll(self) -> List[Tuple[memoryview, 'BroadcastTracker']]:
+        """取出队列中的全部帧，由asyncio模式的写协程调用
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:
+            List[Tuple[memoryview, BroadcastTracker]]:等待发送的帧及其群发跟踪对象
+        """
+        with self.__lock:
+            frames = list(self.__frames)
+            self.__frames.clear()
+            self.__queuedBytes = 0
+            isReleased = self.__releaseBackpressure()
+        if isReleased:
+            self.__wakeReader()
+        return frames
+
+# 解除背压
+    def __releaseBackpressure(self) -> bool:
+        """队列回落到低水位(最大值的八分之一)以下或已关闭时解除背压，调用者需持有锁
+
+        返回值:
+            bool:True 表明本次调用解除了背压，调用者需在释放锁后唤醒读取者
+        """
+        if not self.__isBackpressured:
+            return False
+        if not self.__isClosed and (self.__queuedBytes > self.__maxBytes // 8
+                                    or len(self.__frames) > self.__maxFrames // 8):
+            return False
+        self.__isBackpressured = False
+        return True
+
+# 唤醒读取者
+    def __wakeReader(self):
+        """背压解除后唤醒等待中的读取线程或协程"""
+        self.__writable.set()
+        if self.__onWritable is not None:
+            self.__onWritable(self)
+        return None
+
+# 等待背压解除
+    def waitWritable(self, timeout: float = None) -> bool:
+        """阻塞等待背压解除，由线程模式的读取线程调用
+
+        参数:
+            self:表明该函数是一个实例方法
+            timeout(float):最长等待秒数，None表示一直等待
+
+        返回值:
+            bool:True 表明背压已解除；False 表明等待超时
+        """
+        return self.__writable.wait(timeout)
+
+# 获取背压状态
+    def isBackpressured(self) -> bool:
+        """返回队列是否超过高水位，为True时应暂停读取该连接的请求"""
+        return self.__isBackpressured
+
+# 关闭队列
+    def close(self):
+        """关闭队列并丢弃尚未发送的数据，连接的关闭由发送者完成
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:None
+        """
+        with self.__lock:
+            if self.__isClosed:
+                return None
+            self.__isClosed = True
+            frames = list(self.__frames)
+            self.__frames.clear()
+            self.__queuedBytes = 0
+            isReleased = self.__releaseBackpressure()
+        if isReleased:
+            self.__wakeReader()
+        for view, tracker in frames:
+            if tracker is not None:
+                tracker.done()
+        self.__notify(self)
+        return None
+
+# 获取滞后状态
+    def isLagging(self) -> bool:
+        """返回连接是否因为队列已满而被标记为滞后"""
+        return self.__isLagging
+
+# 获取关闭状态
+    def isClosed(self) -> bool:
+        """返回队列是否已关闭"""
+        return self.__isClosed
+
+# 获取待发送字节数
+    def queuedBytes(self) -> int:
+        """返回队列中等待发送的字节数"""
+        return self.__queuedBytes
+
+
+class OutboundWriter(td.Thread):
+    """发送线程类，线程模式下由一个线程通过selector统一完成所有连接的非阻塞发送，
+    队列由空变为非空后最多等待flushDelay秒，期间放入的帧不会再唤醒发送线程，到期后以向量化发送一起写出
+
+    属性:
+        selector(DefaultSelector):用于等待套接字可写
+        wakeupReader(socket对象):唤醒套接字的读端，用于打断selector的等待
+        wakeupWriter(socket对象):唤醒套接字的写端
+        readyQueues(set):有新数据或已关闭、等待发送线程处理的队列
+        delayedQueues(deque):等待合并的(发送期限, 队列)，延迟预算固定，因此按期限先后排列
+        flushDelay(float):合并发送的延迟预算(秒)，0表示立即发送
+        batchSize(int):单次系统调用最多发送的帧数
+        stats(dict):发送轮次、系统调用次数、发送的帧数以及延迟发送的轮次
+        isRunning(bool):发送线程是否在运行
+    """
+
+# 构造函数
+    def __init__(self, flushDelay: float = FLUSH_DELAY, batchSize: int = WRITE_BATCH):
+        """构造函数，用于发送线程对象初始化"""
+        super().__init__(name="OutboundWriter", daemon=True)
+        self.__selector = selectors.DefaultSelector()
+        self.__wakeupReader, self.__wakeupWriter = sk.socketpair()
+        self.__wakeupReader.setblocking(False)
+        self.__wakeupWriter.setblocking(False)
+        self.__selector.register(self.__wakeupReader, selectors.EVENT_READ)
+        self.__readyQueues = set()
+        self.__delayedQueues = deque()
+        self.__flushDelay = flushDelay
+        self.__batchSize = max(1, min(batchSize, IOV_MAX))
+        self.__stats = {'flushes': 0, 'sendCalls': 0, 'frames': 0, 'delayedFlushes': 0}
+        self.__lock = td.Lock()
+        self.__isRunning = True
+
+# 调度队列
+    def schedule(self, queue: 'OutboundQueue'):
+        """作为发送队列的notify回调，通知发送线程处理该队列，可在任意线程调用
+
+        参数:
+            self:表明该函数是一个实例方法
+            queue(OutboundQueue):有新数据或已关闭的发送队列
+
+        返回值:None
+        """
+        if queue.isClosed():
+        # 立即关闭读写方向，使阻塞在recv上的请求处理线程能够退出
+            try:
+                queue.connection.shutdown(sk.SHUT_RDWR)
+            except OSError:
+                pass
+        with self.__lock:
+            needWakeup = len(self.__readyQueues) == 0
+            self.__readyQueues.add(queue)
+        if needWakeup:
+            try:
+                self.__wakeupWriter.send(b'\0')
+            except BlockingIOError:
+                pass
+        return None
+
+# 处理单个队列
+    def __serviceQueue(self, queue: 'OutboundQueue'):
+        """尝试发送队列中的数据，并根据结果注册或注销可写事件
+
+        参数:
+            self:表明该函数是一个实例方法
+            queue(OutboundQueue):需要处理的发送队列
+
+        返回值:None
+        """
+        sock = queue.connection
+        isEmpty = True
+        if not queue.isClosed():
+            try:
+                isEmpty, calls, frames = queue.sendPending(self.__batchSize)
+                self.__stats['flushes'] += 1
+                self.__stats['sendCalls'] += calls
+                self.__stats['frames'] += frames
+            except OSError:
+                queue.close()
+        registered = self.__isRegistered(sock)
+        if queue.isClosed():
+            if registered:
+                self.__selector.unregister(sock)
+            sock.close()
+        elif not isEmpty and not registered:
+            self.__selector.register(sock, selectors.EVENT_WRITE, queue)
+        elif isEmpty and registered:
+            self.__selector.unregister(sock)
+        return None
+
+# 是否已注册
+    def __isRegistered(self, sock: 'socket') -> bool:
+        """判断套接字是否已经注册到selector中"""
+        try:
+            self.__selector.get_key(sock)
+            return True
+        except (KeyError, ValueError):
+            return False
+
+# 线程主体
+    def run(self):
+        """发送线程主循环，等待可写事件、唤醒通知或最早的合并期限，并处理对应的发送队列"""
+        while self.__isRunning:
+            timeout = None
+            if len(self.__delayedQueues) > 0:
+                timeout = max(0.0, self.__delayedQueues[0][0] - t.monotonic())
+            for key, events in self.__selector.select(timeout):
+                if key.fileobj is self.__wakeupReader:
+                    try:
+                        while self.__wakeupReader.recv(4096):
+                            pass
+                    except BlockingIOError:
+                        pass
+                else:
+                    self.__serviceQueue(key.data)
+            with self.__lock:
+                readyQueues = self.__readyQueues
+                self.__readyQueues = set()
+            now = t.monotonic()
+            for queue in readyQueues:
+                if self.__shouldDelay(queue):
+                    self.__delayedQueues.append((now + self.__flushDelay, queue))
+                else:
+                    self.__serviceQueue(queue)
+        # 队列在等待期间保持非空，不会再次通知发送线程，因此每个队列在其中至多出现一次
+            while len(self.__delayedQueues) > 0 and self.__delayedQueues[0][0] <= now:
+                self.__stats['delayedFlushes'] += 1
+                self.__serviceQueue(self.__delayedQueues.popleft()[1])
+        return None
+
+# 是否延迟发送
+    def __shouldDelay(self, queue: 'OutboundQueue') -> bool:
+        """配置了延迟预算、队列未关闭、等待发送的数据不足COALESCE_BYTES且套接字没有在等待可写时延迟发送"""
+        return (self.__flushDelay > 0 and not queue.isClosed() and queue.queuedBytes() < COALESCE_BYTES
+                and not self.__isRegistered(queue.connection))
+
+# 获取统计信息
+    def getStats(self) -> Dict[str, Union[int, float]]:
+        """返回发送轮次、系统调用次数、发送的帧数以及平均每次系统调用发送的帧数"""
+        stats = dict(self.__stats, flushDelayMs=self.__flushDelay * 1000, batchSize=self.__batchSize)
+        stats['framesPerCall'] = stats['frames'] / stats['sendCalls'] if stats['sendCalls'] > 0 else 0.0
+        return stats
+
+# 停止线程
+    def stop(self):
+        """停止发送线程"""
+        self.__isRunning = False
+        try:
+            self.__wakeupWriter.send(b'\0')
+        except BlockingIOError:
+            pass
+        return None
@@ -0,0 +1,212 @@
+import struct
+import zlib
+from typing import List, Tuple, Union
+
+# 帧头：4字节无符号整数(网络字节序)，低31位表示帧体的长度，最高位表示帧体经过zlib压缩
+HEADER = struct.Struct("!I")
+FLAG_COMPRESSED = 0x80000000
+LENGTH_MASK = 0x7FFFFFFF
+# 单帧最大长度，超过该长度的帧视为非法数据
+MAX_FRAME_SIZE = 1024 * 1024
+# 每次从套接字读取的最大字节数，也是每个连接可复用的接收缓冲区的常规大小
+RECEIVE_SIZE = 64 * 1024
+
+
+class FrameError(Exception):
+    """帧格式错误，例如帧长度超出限制"""
+    pass
+
+
+# 封装帧
+def packFrame(payload: bytes, maxFrameSize: int = MAX_FRAME_SIZE, compressed: bool = False) -> bytes:
+    """为消息数据添加长度前缀，封装成一帧
+
+    参数:
+        payload(bytes):消息的具体数据
+        maxFrameSize(int):允许的最大帧长度
+        compressed(bool):payload是否已经过zlib压缩
+
+    返回值:
+        bytes:带有长度前缀的帧数据
+    """
+    if len(payload) > maxFrameSize:
+        raise FrameError("帧长度{}超出限制{}".format(len(payload), maxFrameSize))
+    header = len(payload) | FLAG_COMPRESSED if compressed else len(payload)
+    return HEADER.pack(header) + payload
+
+
+# 解压帧体
+def decompressPayload(payload: bytes, maxFrameSize: int = MAX_FRAME_SIZE) -> bytes:
+    """解压经过zlib压缩的帧体，解压后的长度同样受最大帧长度限制
+
+    参数:
+        payload(bytes):压缩后的帧体
+        maxFrameSize(int):允许的最大帧长度
+
+    返回值:
+        bytes:解压后的帧体
+    """
+    decompressor = zlib.decompressobj()
+    try:
+        data = decompressor.decompress(payload, maxFrameSize)
+    except zlib.error as error:
+        raise FrameError("帧体解压失败：{}".format(error))
+    if decompressor.unconsumed_tail:
+        raise FrameError("解压后的帧长度超出限制{}".format(maxFrameSize))
+    return data
+
+
+class FrameDecoder(object):
+    """增量帧解码类，支持两种读取方式，压缩过的帧在返回前解压为bytes：
+    receiveInto由解码器通过recv_into把套接字数据直接读入可复用的接收缓冲区，就地解析，
+    返回的帧体是指向接收缓冲区的memoryview，只在下一次receiveInto之前有效，适合读取后立即处理完全部帧的调用者；
+    feed接收调用者读取到的字节串，完整的帧体是指向该字节串的memoryview，可以长期保存，
+    只有跨越两次读取的帧需要复制，不完整的数据保留在缓冲区中等待下一次读取
+
+    属性:
+        buffer(bytearray):接收缓冲区，receiveInto方式下第一次读取时分配，feed方式下只保存不完整的帧
+        view(memoryview):receiveInto方式下接收缓冲区的视图
+        start(int):缓冲区中尚未解析的数据的起始位置
+        end(int):缓冲区中已写入的数据的结束位置
+        bufferSize(int):接收缓冲区的常规大小，为接收大帧而扩容的缓冲区在数据处理完后恢复为该大小
+        maxFrameSize(int):允许的最大帧长度
+    """
+
+# 构造函数
+    def __init__(self, maxFrameSize: int = MAX_FRAME_SIZE, bufferSize: int = RECEIVE_SIZE):
+        """构造函数，用于解码器对象初始化"""
+        self.__buffer = bytearray()
+        self.__view = None
+        self.__start = 0
+        self.__end = 0
+        self.__bufferSize = bufferSize
+        self.__maxFrameSize = maxFrameSize
+
+# 解析帧
+    def __parse(self, view: memoryview, offset: int, size: int) -> Tuple[List[Union[memoryview, bytes]], int]:
+        """从view的offset处开始解析出所有完整的帧，帧体以memoryview切片的形式返回，不复制数据
+
+        参数:
+            self:表明该函数是一个实例方法
+            view(memoryview):待解析的数据
+            offset(int):起始位置
+            size(int):有效数据的结束位置
+
+        返回值:
+            Tuple[List, int]:解析出的帧体列表，以及第一个不完整帧的起始位置
+
+        异常:
+            FrameError:帧长度超出限制或解压失败
+        """
+        frames = []
+        while size - offset >= HEADER.size:
+            (header,) = HEADER.unpack_from(view, offset)
+            length = header & LENGTH_MASK
+            if length > self.__maxFrameSize:
+                raise FrameError("帧长度{}超出限制{}".format(length, self.__maxFrameSize))
+            end = offset + HEADER.size + length
+            if end > size:
+                break
+            payload = view[offset + HEADER.size:end]
+            if header & FLAG_COMPRESSED:
+                payload = decompressPayload(payload, self.__maxFrameSize)
+            frames.append(payload)
+            offset = end
+        return frames, offset
+
+# 从套接字读取
+    def receiveInto(self, sock: 'socket') -> Union[List[Union[memoryview, bytes]], None]:
+        """通过recv_into将数据直接读入接收缓冲区并就地解析出所有完整的帧，
+        返回的memoryview帧体在下一次调用本函数之前有效
+
+        参数:
+            self:表明该函数是一个实例方法
+            sock(socket):阻塞模式的连接套接字
+
+        返回值:
+            List:解析出的帧体列表，数据不足一帧时为空列表；None 表明对端已关闭连接
+
+        异常:
+            OSError:读取套接字失败
+            FrameError:帧长度超出限制或解压失败
+        """
+        self.__reserve()
+        count = sock.recv_into(self.__view[self.__end:])
+        if count == 0:
+            return None
+        self.__end += count
+        frames, self.__start = self.__parse(self.__view, self.__start, self.__end)
+        if self.__start == self.__end:
+            self.__start = self.__end = 0
+        return frames
+
+# 预留接收空间
+    def __reserve(self):
+        """保证缓冲区末尾有空闲空间：不完整帧的长度已知时保证能放下整帧，否则至少留出常规大小的四分之一，
+        空间不足时先把不完整的数据移到缓冲区开头，仍然不足时换用更大的缓冲区，
+        缓冲区为空且大小不是常规大小时换回常规大小，大帧占用的内存因此不会一直保留"""
+        pending = self.__end - self.__start
+        if pending == 0 and len(self.__buffer) != self.__bufferSize:
+            self.__buffer = bytearray(self.__bufferSize)
+            self.__view = memoryview(self.__buffer)
+            return None
+        required = pending + max(self.__bufferSize // 4, HEADER.size)
+        if pending >= HEADER.size:
+            length = HEADER.unpack_from(self.__view, self.__start)[0] & LENGTH_MASK
+            required = max(required, HEADER.size + length)
+        if len(self.__buffer) - self.__start >= required:
+            return None
+        if len(self.__buffer) >= required:
+            self.__view[:pending] = self.__view[self.__start:self.__end]
+        else:
+            buffer = bytearray(max(required, self.__bufferSize))
+            buffer[:pending] = self.__view[self.__start:self.__end]
+            self.__buffer = buffer
+            self.__view = memoryview(buffer)
+        self.__start = 0
+        self.__end = pending
+        return None
+
+# 输入数据
+    def feed(self, data: bytes) -> List[Union[memoryview, bytes]]:
+        """解析调用者读取到的数据中所有完整的帧，帧体是指向data的memoryview，
+        缓冲区中有上一次剩下的不完整帧时，只在这一帧补齐后把两部分拼接一次
+
+        参数:
+            self:表明该函数是一个实例方法
+            data(bytes):从套接字读取到的数据
+
+        返回值:
+            List:解析出的帧体列表，数据不足一帧时为空列表
+
+        异常:
+            FrameError:帧长度超出限制或解压失败
+        """
+        if self.__end > 0:
+            if self.__end >= HEADER.size:
+                length = HEADER.unpack_from(self.__buffer)[0] & LENGTH_MASK
+                if length <= self.__maxFrameSize and self.__end + len(data) < HEADER.size + length:
+                    self.__buffer += data
+                    self.__end += len(data)
+                    return []
+            data = b"".join((self.__buffer, data))
+            self.__buffer = bytearray()
+            self.__end = 0
+        view = memoryview(data)
+        frames, offset = self.__parse(view, 0, len(view))
+        if offset < len(view):
+            self.__buffer = bytearray(view[offset:])
+            self.__end = len(self.__buffer)
+        return frames
+
+# 缓冲区中剩余的字节数
+    def pending(self) -> int:
+        """返回缓冲区中尚未组成完整帧的字节数
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:
+            int:剩余字节数
+        """
+        return self.__end - self.__start
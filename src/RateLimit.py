@@ -0,0 +1,233 @@
+import threading as td
+import time as t
+from typing import Dict, Hashable, Tuple, Union
+
+# 全部请求共用的令牌桶名称
+ALL_REQUESTS = "*"
+# 默认限速：请求类型 -> (每秒补充的令牌数, 令牌桶容量)，*限制全部请求的总速率
+DEFAULT_RATE_LIMITS = {ALL_REQUESTS: (50, 100), 'login': (1, 5), 'public': (10, 20), 'private': (20, 40),
+                       'get': (5, 10), 'history': (5, 10), 'presence': (2, 5), 'stats': (1, 5),
+                       'join': (5, 10), 'leave': (5, 10), 'rooms': (5, 10)}
+# 不受限速的请求类型，限制它们只会让连接无法正常结束
+EXEMPT_TYPES = ('exit', 'pong')
+# 同一类型的限速通知最短间隔(秒)
+NOTICE_INTERVAL = 1.0
+# 清理长时间没有请求的限速状态的间隔(秒)
+PRUNE_INTERVAL = 60.0
+
+
+# 解析限速配置
+def parseRateLimits(text: str) -> Dict[str, Tuple[float, float]]:
+    """解析形如 "*=50/100,public=10/20" 的限速配置，斜杠前为每秒补充的令牌数，斜杠后为令牌桶容量，
+    省略容量时容量等于速率，none或空字符串表示不限速
+
+    参数:
+        text(str):限速配置
+
+    返回值:
+        Dict[str, Tuple[float, float]]:请求类型到(速率, 容量)的映射
+
+    异常:
+        ValueError:配置格式错误
+    """
+    limits = {}
+    if text.strip().lower() in ("", "none"):
+        return limits
+    for item in text.split(","):
+        name, _, value = item.partition("=")
+        rate, _, burst = value.partition("/")
+        rate = float(rate)
+        burst = float(burst) if burst else rate
+        if not name.strip() or rate <= 0 or burst < 1:
+            raise ValueError("限速配置错误：{}".format(item))
+        limits[name.strip()] = (rate, burst)
+    return limits
+
+
+class TokenBucket(object):
+    """令牌桶类，以固定速率补充令牌，容量决定允许的突发请求数，
+    同一用户或地址的多个连接共用令牌桶，由所属限速状态的锁保护
+
+    属性:
+        rate(float):每秒补充的令牌数
+        burst(float):令牌桶容量
+        tokens(float):当前令牌数，预支后可以为负数，但不低于-burst
+        updateTime(float):上一次补充令牌的时刻
+    """
+
+# 构造函数
+    def __init__(self, rate: float, burst: float, now: float):
+        """构造函数，用于令牌桶对象初始化"""
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updateTime = now
+
+# 补充令牌
+    def refill(self, now: float):
+        """按经过的时间补充令牌，令牌数不超过容量"""
+        self.tokens = min(self.burst, self.tokens + (now - self.updateTime) * self.rate)
+        self.updateTime = now
+        return None
+
+# 等待时间
+    def waitTime(self) -> float:
+        """返回获得一个令牌还需等待的秒数，0表示当前就有令牌"""
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+
+class RateState(object):
+    """单个用户或地址的限速状态，保存各类请求的令牌桶以及最近发送限速通知的时刻，
+    由RateLimiter按用户或地址创建并在多个连接之间共用
+
+    属性:
+        buckets(dict):请求类型到令牌桶的映射，第一次收到该类请求时创建
+        lastNotice(dict):请求类型到最近一次限速通知时刻的映射
+        lastUsed(float):最近一次检查请求的时刻，用于清理长时间没有请求的状态
+        lock(Lock):保护令牌桶，同一用户或地址的多个连接可能同时发来请求
+    """
+
+# 构造函数
+    def __init__(self, now: float = None):
+        """构造函数，用于限速状态对象初始化"""
+        self.buckets = {}
+        self.lastNotice = {}
+        self.lastUsed = t.monotonic() if now is None else now
+        self.lock = td.Lock()
+
+
+class RateLimiter(object):
+    """请求限速类，每个限速对象(登录用户的昵称，或登录请求与未登录连接的对端地址)对每类请求以及全部请求各有一个令牌桶，
+    一个请求需要同时从两个令牌桶中各取得一个令牌，任何一个不足时该请求被限速，
+    限速状态按限速对象保存在注册表中，重新建立连接不会重置令牌桶，
+    长时间没有请求的状态的令牌桶都已补满，与新建的状态没有区别，定期从注册表中清理
+
+    属性:
+        limits(dict):请求类型到(速率, 容量)的映射
+        states(dict):限速对象到限速状态的映射
+        idleTime(float):令牌桶从空补满所需的最长秒数，超过该时间没有请求的状态被清理
+        pruneTime(float):最近一次清理的时刻
+        lock(Lock):保护限速状态注册表
+    """
+
+# 构造函数
+    def __init__(self, limits: Dict[str, Tuple[float, float]] = None):
+        """构造函数，用于请求限速对象初始化"""
+        self.__limits = dict(DEFAULT_RATE_LIMITS if limits is None else limits)
+        self.__states = {}
+        self.__idleTime = max([burst / rate for rate, burst in self.__limits.values()], default=0.0) + NOTICE_INTERVAL
+        self.__pruneTime = t.monotonic()
+        self.__lock = td.Lock()
+
+# 获取限速状态
+    def stateFor(self, key: Hashable, now: float = None) -> 'RateState':
+        """返回限速对象的限速状态，不存在时创建，并定期清理长时间没有请求的状态
+
+        参数:
+            self:表明该函数是一个实例方法
+            key(Hashable):限速对象，例如("user", 昵称)或("address", 对端IP)
+            now(float):当前时刻(time.monotonic的秒数)
+
+        返回值:
+            RateState:该限速对象的限速状态
+        """
+        now = t.monotonic() if now is None else now
+        with self.__lock:
+            state = self.__states.get(key)
+            if state is None:
+                state = self.__states[key] = RateState(now)
+            if now - self.__pruneTime >= PRUNE_INTERVAL:
+                self.__pruneTime = now
+                for idleKey in [idleKey for idleKey, idleState in self.__states.items()
+                                if now - idleState.lastUsed > self.__idleTime]:
+                    del self.__states[idleKey]
+                self.__states[key] = state
+        return state
+
+# 是否启用
+    def isEnabled(self) -> bool:
+        """返回是否配置了任何限速"""
+        return len(self.__limits) > 0
+
+# 获取令牌桶
+    def __bucket(self, state: 'RateState', name: str, now: float) -> Union['TokenBucket', None]:
+        """返回限速状态的某类令牌桶，该类没有配置限速时返回None"""
+        bucket = state.buckets.get(name)
+        if bucket is None:
+            limit = self.__limits.get(name)
+            if limit is None:
+                return None
+            bucket = state.buckets[name] = TokenBucket(limit[0], limit[1], now)
+        else:
+            bucket.refill(now)
+        return bucket
+
+# 检查请求
+    def check(self, state: 'RateState', messageType: str, now: float = None) -> float:
+        """检查一个请求是否超出限速，没有超出时取走令牌
+
+        参数:
+            self:表明该函数是一个实例方法
+            state(RateState):发出请求的用户或地址的限速状态
+            messageType(str):请求类型
+            now(float):当前时刻(time.monotonic的秒数)
+
+        返回值:
+            float:0表示可以立即处理；否则为需要等待的秒数，该请求应被丢弃
+        """
+        if messageType in EXEMPT_TYPES:
+            return 0.0
+        now = t.monotonic() if now is None else now
+        with state.lock:
+            state.lastUsed = now
+            buckets = [bucket for bucket in (self.__bucket(state, ALL_REQUESTS, now),
+                                             self.__bucket(state, messageType, now)) if bucket is not None]
+            waitTime = max([bucket.waitTime() for bucket in buckets], default=0.0)
+            if waitTime == 0:
+                for bucket in buckets:
+                    bucket.tokens -= 1
+        return waitTime
+
+# 预支令牌
+    def reserve(self, state: 'RateState', messageType: str, now: float = None) -> Union[float, None]:
+        """令牌不足时预支令牌，调用者等待返回的秒数后处理该请求，用于需要延迟而不是丢弃的请求(login)，
+        每个令牌桶最多预支一个容量的令牌，超出时不预支，该请求应被拒绝，
+        并发的请求因此不会把令牌数压到很低，使之后的每个请求都要等待很久
+
+        参数:
+            self:表明该函数是一个实例方法
+            state(RateState):发出请求的限速对象的限速状态
+            messageType(str):请求类型
+            now(float):当前时刻(time.monotonic的秒数)
+
+        返回值:
+            Union[float, None]:处理之前需要等待的秒数，0表示可以立即处理；None表示预支已达上限
+        """
+        if messageType in EXEMPT_TYPES:
+            return 0.0
+        now = t.monotonic() if now is None else now
+        with state.lock:
+            state.lastUsed = now
+            buckets = [bucket for bucket in (self.__bucket(state, ALL_REQUESTS, now),
+                                             self.__bucket(state, messageType, now)) if bucket is not None]
+            if any(bucket.tokens - 1 < -bucket.burst for bucket in buckets):
+                return None
+            waitTime = max([bucket.waitTime() for bucket in buckets], default=0.0)
+            for bucket in buckets:
+                bucket.tokens -= 1
+        return waitTime
+
+# 是否需要发送通知
+    def shouldNotify(self, state: 'RateState', messageType: str, now: float = None) -> bool:
+        """同一类请求在NOTICE_INTERVAL秒内只发送一次限速通知，避免通知本身放大流量"""
+        now = t.monotonic() if now is None else now
+        with state.lock:
+            if now - state.lastNotice.get(messageType, float("-inf")) < NOTICE_INTERVAL:
+                return False
+            state.lastNotice[messageType] = now
+        return True
+
+# 获取配置
+    def getLimits(self) -> Dict[str, Tuple[float, float]]:
+        """返回限速配置"""
+        return dict(self.__limits)
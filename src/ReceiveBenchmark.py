@@ -0,0 +1,170 @@
+import threading as td
+import socket as sk
+import tracemalloc
+import time as t
+import json
+import sys
+import argparse
+from typing import List, Dict, Union
+import Protocol as pt
+import Codec as cd
+
+# 写入端每次发送的字节数，与帧边界错开，使部分帧跨越两次读取
+SEND_CHUNK = 48 * 1024
+
+
+class CopyingDecoder(object):
+    """与改动前的FrameDecoder相同的解码方式，作为对比基准：
+    读取到的数据追加到缓冲区，每个帧体复制为bytes后再从缓冲区开头删除已解析的数据
+
+    属性:
+        buffer(bytearray):尚未解析完成的数据
+    """
+
+# 构造函数
+    def __init__(self):
+        """构造函数，用于对比解码器对象初始化"""
+        self.__buffer = bytearray()
+
+# 从套接字读取
+    def receive(self, sock: 'socket') -> Union[List[bytes], None]:
+        """recv得到新的bytes后追加到缓冲区，解析出所有完整的帧，对端关闭连接时返回None"""
+        data = sock.recv(pt.RECEIVE_SIZE)
+        if len(data) == 0:
+            return None
+        self.__buffer += data
+        frames = []
+        offset = 0
+        size = len(self.__buffer)
+        while size - offset >= pt.HEADER.size:
+            (header,) = pt.HEADER.unpack_from(self.__buffer, offset)
+            end = offset + pt.HEADER.size + (header & pt.LENGTH_MASK)
+            if end > size:
+                break
+            frames.append(bytes(self.__buffer[offset + pt.HEADER.size:end]))
+            offset = end
+        if offset > 0:
+            del self.__buffer[:offset]
+        return frames
+
+
+# 生成测试数据
+def buildStream(bodySize: int, count: int, codec: 'BinaryCodec') -> bytes:
+    """生成count个消息内容为bodySize字节的群聊消息帧拼接而成的字节流"""
+    messageDict = {'source': "alice", 'destination': None, 'type': "public", 'data': "x" * bodySize}
+    return pt.packFrame(codec.encode(messageDict)) * count
+
+
+# 单次测试
+def receiveStream(stream: bytes, path: str, codec: 'BinaryCodec', traced: bool) -> Dict[str, Union[int, float]]:
+    """由写入线程把字节流发送到socketpair的一端，在另一端用指定的方式读取、解析并解码全部消息，
+    traced为True时在每次读取前重置tracemalloc的峰值，累计每次读取及其帧的处理过程中超出读取前内存占用的峰值字节数
+
+    参数:
+        stream(bytes):待发送的字节流
+        path(str):copy为改动前的复制方式，view为recv_into与memoryview的就地解析方式
+        codec(BinaryCodec):二进制编码对象
+        traced(bool):是否统计内存分配
+
+    返回值:
+        Dict:消息数、读取次数、累计峰值字节数与耗时
+    """
+    receiver, sender = sk.socketpair()
+# 写入端发送的切片在开始统计之前创建好，写入线程本身几乎不分配内存
+    chunks = [memoryview(stream)[offset:offset + SEND_CHUNK] for offset in range(0, len(stream), SEND_CHUNK)]
+
+    def sendAll():
+        for chunk in chunks:
+            sender.sendall(chunk)
+        sender.close()
+
+    decoder = CopyingDecoder() if path == "copy" else pt.FrameDecoder()
+    receive = decoder.receive if path == "copy" else decoder.receiveInto
+    messages = 0
+    reads = 0
+    peakBytes = 0
+    writer = td.Thread(target=sendAll, daemon=True)
+    writer.start()
+    startTime = t.perf_counter()
+    while True:
+        if traced:
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+        frames = receive(receiver)
+        if frames is None:
+            break
+        for frame in frames:
+            cd.decodeMessage(frame, codec)
+        messages += len(frames)
+        reads += 1
+        del frames
+        if traced:
+            peakBytes += tracemalloc.get_traced_memory()[1] - baseline
+    elapsed = t.perf_counter() - startTime
+    writer.join()
+    receiver.close()
+    return {'messages': messages, 'reads': reads, 'peakBytes': peakBytes, 'seconds': elapsed}
+
+
+# 比较两种接收方式
+def benchmarkReceive(bodySizes: List[int], totalBytes: int) -> List[Dict[str, Union[int, float, str]]]:
+    """对每种消息内容长度，分别用复制方式与就地解析方式接收同一个字节流，
+    一次在tracemalloc下统计每条消息的峰值分配字节数，一次不开启tracemalloc统计每条消息的耗时
+
+    参数:
+        bodySizes(List[int]):消息内容的字节数
+        totalBytes(int):每项测试发送的总字节数
+
+    返回值:
+        List[Dict]:消息内容长度、接收方式、消息数、读取次数、每条消息的峰值分配字节数与耗时
+    """
+    internTable = cd.InternTable()
+    internTable.intern("alice")
+    codec = cd.BinaryCodec(internTable)
+    results = []
+    for bodySize in bodySizes:
+        stream = buildStream(bodySize, max(1, totalBytes // (bodySize + 32)), codec)
+        for path in ("copy", "view"):
+            tracemalloc.start()
+            traced = receiveStream(stream, path, codec, True)
+            tracemalloc.stop()
+            timed = receiveStream(stream, path, codec, False)
+            results.append({'bodySize': bodySize, 'path': path, 'messages': traced['messages'],
+                            'reads': traced['reads'], 'bytesPerMessage': traced['peakBytes'] / traced['messages'],
+                            'usPerMessage': timed['seconds'] / timed['messages'] * 1e6})
+    return results
+
+
+# 主函数
+def main(argv: List[str] = None) -> int:
+    """比较改动前的复制接收方式与recv_into就地解析方式每条消息的内存分配与耗时
+
+    参数:
+        argv(List[str]):命令行参数列表，为None时使用sys.argv
+
+    返回值:
+        int:返回数字0表明程序正常执行结束
+    """
+    parser = argparse.ArgumentParser(description="接收路径每条消息的内存分配对比测试")
+    parser.add_argument("--sizes", default="64,1024,16384,262144", help="消息内容的字节数，以逗号分隔")
+    parser.add_argument("--total", type=int, default=32 * 1024 * 1024, help="每项测试发送的总字节数")
+    parser.add_argument("--json", dest="jsonPath", default=None, help="将结果以JSON格式写入该文件")
+    arguments = parser.parse_args(argv)
+
+    results = benchmarkReceive([int(value) for value in arguments.sizes.split(",")], arguments.total)
+
+    print("{:<10}{:<6}{:>10}{:>8}{:>14}{:>10}".format("body", "path", "messages", "reads", "bytes/msg", "us/msg"))
+    for result in results:
+        print("{:<10}{:<6}{:>10}{:>8}{:>14.1f}{:>10.2f}".format(result['bodySize'], result['path'],
+                                                              result['messages'], result['reads'],
+                                                              result['bytesPerMessage'], result['usPerMessage']))
+
+    if arguments.jsonPath is not None:
+        with open(arguments.jsonPath, "w") as jsonFile:
+            json.dump(results, jsonFile, indent=2)
+    return 0
+
+
+# 运行程序
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,254 @@
+import threading as td
+from typing import Dict, List, Set, Tuple, Union
+
+# 聊天室名称的最大长度
+MAX_ROOM_NAME_LENGTH = 64
+# 单个用户最多加入的聊天室数
+MAX_ROOMS_PER_USER = 100
+
+
+# 检查聊天室名称
+def isValidRoomName(room: str) -> bool:
+    """聊天室名称必须是不含空白字符的非空字符串，且长度不超过MAX_ROOM_NAME_LENGTH
+
+    参数:
+        room(str):聊天室名称
+
+    返回值:
+        bool:True 表明名称合法
+    """
+    return (isinstance(room, str) and 0 < len(room) <= MAX_ROOM_NAME_LENGTH
+            and not any(character.isspace() for character in room))
+
+
+class RoomRegistry(object):
+    """聊天室注册表类，同时维护聊天室到成员的索引与成员到聊天室的索引：
+    群发时按聊天室取出成员会话的只读快照，快照只在成员变化后的第一次群发时重建，
+    用户下线时通过成员索引只访问其加入的聊天室，清理代价与聊天室规模无关，
+    多进程模式下还记录其他分片上的成员，用于列出成员以及决定需要转发到哪些分片
+
+    属性:
+        members(dict):聊天室名称到本分片成员(昵称到会话的映射)的映射
+        memberRooms(dict):本分片用户昵称到其加入的聊天室集合的映射
+        remote(dict):聊天室名称到其他分片成员(昵称到分片编号的映射)的映射
+        remoteRooms(dict):其他分片用户昵称到其加入的聊天室集合的映射
+        snapshots(dict):聊天室名称到成员会话快照的映射，成员变化时删除
+        lock(Lock):保护注册表的锁
+    """
+
+# 构造函数
+    def __init__(self):
+        """构造函数，用于聊天室注册表对象初始化"""
+        self.__members = {}
+        self.__memberRooms = {}
+        self.__remote = {}
+        self.__remoteRooms = {}
+        self.__snapshots = {}
+        self.__lock = td.Lock()
+
+# 加入聊天室
+    def join(self, room: str, session: 'Session') -> bool:
+        """将会话加入聊天室，聊天室不存在时创建
+
+        参数:
+            self:表明该函数是一个实例方法
+            room(str):聊天室名称
+            session(Session):加入者的会话
+
+        返回值:
+            bool:True 表明已加入；False 表明已是成员或加入的聊天室数已达上限
+        """
+        with self.__lock:
+            rooms = self.__memberRooms.setdefault(session.nickname, set())
+            if room in rooms or len(rooms) >= MAX_ROOMS_PER_USER:
+                return False
+            rooms.add(room)
+            self.__members.setdefault(room, {})[session.nickname] = session
+            self.__snapshots.pop(room, None)
+        return True
+
+# 离开聊天室
+    def leave(self, room: str, nickname: str) -> bool:
+        """将用户移出聊天室，聊天室没有成员时删除
+
+        参数:
+            self:表明该函数是一个实例方法
+            room(str):聊天室名称
+            nickname(str):用户昵称
+
+        返回值:
+            bool:True 表明已移出；False 表明该用户不是成员
+        """
+        with self.__lock:
+            rooms = self.__memberRooms.get(nickname)
+            if rooms is None or room not in rooms:
+                return False
+            rooms.discard(room)
+            if not rooms:
+                del self.__memberRooms[nickname]
+            self.__removeMember(room, nickname)
+        return True
+
+# 离开全部聊天室
+    def leaveAll(self, nickname: str) -> List[str]:
+        """用户下线或重新登录时调用，只访问该用户加入的聊天室
+
+        参数:
+            self:表明该函数是一个实例方法
+            nickname(str):用户昵称
+
+        返回值:
+            List[str]:该用户此前加入的聊天室
+        """
+        with self.__lock:
+            rooms = self.__memberRooms.pop(nickname, ())
+            for room in rooms:
+                self.__removeMember(room, nickname)
+        return list(rooms)
+
+# 移除成员
+    def __removeMember(self, room: str, nickname: str):
+        """从聊天室的成员索引中移除用户并使快照失效，调用者需持有锁"""
+        members = self.__members.get(room)
+        if members is not None:
+            members.pop(nickname, None)
+            if not members:
+                del self.__members[room]
+        self.__snapshots.pop(room, None)
+        return None
+
+# 获取成员会话
+    def recipients(self, room: str) -> Tuple['Session', ...]:
+        """返回聊天室内本分片成员会话的只读快照，可在不持有锁的情况下安全遍历
+
+        参数:
+            self:表明该函数是一个实例方法
+            room(str):聊天室名称
+
+        返回值:
+            Tuple[Session, ...]:成员会话组成的元组
+        """
+        snapshot = self.__snapshots.get(room)
+        if snapshot is None:
+            with self.__lock:
+                snapshot = self.__snapshots.get(room)
+                if snapshot is None:
+                    snapshot = tuple(self.__members.get(room, {}).values())
+                    self.__snapshots[room] = snapshot
+        return snapshot
+
+# 是否为成员
+    def isMember(self, room: str, nickname: str) -> bool:
+        """判断本分片的用户是否为聊天室成员"""
+        return room in self.__memberRooms.get(nickname, ())
+
+# 用户加入的聊天室
+    def roomsOf(self, nickname: str) -> List[str]:
+        """返回本分片的用户加入的全部聊天室"""
+        with self.__lock:
+            return sorted(self.__memberRooms.get(nickname, ()))
+
+# 聊天室成员
+    def members(self, room: str) -> List[str]:
+        """返回聊天室的全部成员昵称(包括其他分片上的成员)
+
+        参数:
+            self:表明该函数是一个实例方法
+            room(str):聊天室名称
+
+        返回值:
+            List[str]:按昵称排序的成员列表
+        """
+        with self.__lock:
+            return sorted(set(self.__members.get(room, ())) | set(self.__remote.get(room, ())))
+
+# 全部聊天室
+    def listRooms(self) -> Dict[str, int]:
+        """返回全部聊天室及其成员数(包括其他分片上的成员)
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:
+            Dict[str, int]:聊天室名称到成员数的映射
+        """
+        with self.__lock:
+            rooms = set(self.__members) | set(self.__remote)
+            return {room: len(set(self.__members.get(room, ())) | set(self.__remote.get(room, ())))
+                    for room in sorted(rooms)}
+
+# 全部成员关系
+    def memberships(self) -> List[List[str]]:
+        """返回本分片全部的聊天室与成员组合，用于同步给新连上的分片"""
+        with self.__lock:
+            return [[room, nickname] for room, members in self.__members.items() for nickname in members]
+
+# 添加其他分片的成员
+    def addRemote(self, room: str, nickname: str, shard: int):
+        """记录其他分片上的用户加入了聊天室
+
+        参数:
+            self:表明该函数是一个实例方法
+            room(str):聊天室名称
+            nickname(str):用户昵称
+            shard(int):该用户所在的分片编号
+
+        返回值:None
+        """
+        with self.__lock:
+            self.__remote.setdefault(room, {})[nickname] = shard
+            self.__remoteRooms.setdefault(nickname, set()).add(room)
+        return None
+
+# 移除其他分片的成员
+    def removeRemote(self, nickname: str, shard: int, room: Union[str, None] = None):
+        """移除其他分片上的用户的聊天室成员关系，room为None时移除其加入的全部聊天室
+
+        参数:
+            self:表明该函数是一个实例方法
+            nickname(str):用户昵称
+            shard(int):该用户所在的分片编号
+            room(str):聊天室名称
+
+        返回值:None
+        """
+        with self.__lock:
+            rooms = self.__remoteRooms.get(nickname, set())
+            for name in ([room] if room is not None else list(rooms)):
+                members = self.__remote.get(name)
+                if members is not None and members.get(nickname) == shard:
+                    self.__removeRemoteMember(name, nickname)
+        return None
+
+# 移除其他分片的成员关系
+    def __removeRemoteMember(self, room: str, nickname: str):
+        """从两个索引中移除其他分片用户的一个成员关系，调用者需持有锁"""
+        members = self.__remote[room]
+        del members[nickname]
+        if not members:
+            del self.__remote[room]
+        rooms = self.__remoteRooms[nickname]
+        rooms.discard(room)
+        if not rooms:
+            del self.__remoteRooms[nickname]
+        return None
+
+# 移除一个分片的全部成员
+    def removeShard(self, shard: int):
+        """分片退出时移除该分片上的全部聊天室成员"""
+        with self.__lock:
+            for room, members in list(self.__remote.items()):
+                for nickname in [nickname for nickname, current in members.items() if current == shard]:
+                    self.__removeRemoteMember(room, nickname)
+        return None
+
+# 需要转发的分片
+    def remoteShards(self, room: str) -> Set[int]:
+        """返回有成员加入了该聊天室的其他分片"""
+        with self.__lock:
+            return set(self.__remote.get(room, {}).values())
+
+# 聊天室数量
+    def __len__(self) -> int:
+        """返回本分片有成员的聊天室数量"""
+        return len(self.__members)
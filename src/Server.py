@@ -1,10 +1,59 @@
 import socket as sk
 import threading as td
+import struct
 import time as t
-import json
 import sys
-from typing import Tuple, List, Union
+import traceback
+import argparse
+from typing import Dict, Tuple, List, Union
 import DatabaseOperation as do
+import Protocol as pt
+import Outbound as ob
+import SessionRegistry as sr
+import RoomRegistry as rr
+import StorageBackend as sb
+import MessageStore as ms
+import Mailbox as mb
+import Codec as cd
+import Compression as cz
+import Metrics as mt
+import ShardBus as bus
+import Heartbeat as hb
+import RateLimit as rl
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+# 提升文件描述符上限
+def raiseFileLimit() -> int:
+    """将当前进程可打开的文件描述符数量的软上限提升至硬上限，以便单个进程能够维持大量的客户端连接
+
+    返回值:
+        int:提升后的软上限，-1表示当前平台不支持该操作
+    """
+    if resource is None:
+        return -1
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if hard != resource.RLIM_INFINITY and soft < hard:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+        soft = hard
+    return soft
+
+
+# 单独统计的请求类型，其他类型统一计入unknown，避免客户端构造出无限多的指标名称
+REQUEST_TYPES = ('login', 'get', 'public', 'private', 'history', 'presence', 'stats', 'join', 'leave', 'rooms',
+                 'ping', 'pong', 'exit')
+# 登录时投递离线消息，拼接成一块放入发送队列的帧的最大总字节数
+MAILBOX_CHUNK_SIZE = 64 * 1024
+# 身份验证失败(密码错误)的登录结果，失败的连接不注册会话
+LOGIN_FAILED = 1
+# 解码或校验请求时因内容不合法而抛出的异常，只丢弃该请求，同一连接的后续请求照常处理
+MALFORMED_ERRORS = (ValueError, struct.error)
+# data必须是字符串的请求类型
+TEXT_REQUEST_TYPES = ('public', 'private', 'join', 'leave')
 
 
 class Server(object):
@@ -15,17 +64,74 @@ class Server(object):
         PORT(str):服务端程序使用的端口号
         listenSocket(socket对象):监听套接字，用于监听客户端的连接请求
         idClosed(bool):用于标识服务端是否已经关闭
-        connectionDict(Dictionary):用于存储已经与服务端建立连接的客户端的相关信息
+        sessionRegistry(SessionRegistry):以昵称为索引保存所有已登录客户端的会话
+        roomRegistry(RoomRegistry):聊天室与成员的双向索引，指定了聊天室的群聊消息只发给该聊天室的成员
+        slowConsumerPolicy(str):发送队列已满时的处理策略，drop 断开连接，lag 标记为滞后并丢弃消息
+        outboundWriter(OutboundWriter):线程模式下负责所有连接非阻塞发送的线程
+        broadcastLatency(LatencyRecorder):群发消息到达最后一个接收者的延迟统计
+        databaseUtils(DatabaseUtils):数据库工具对象，所有登录请求共用其连接池
+        messageStore(MessageStore):聊天记录存储对象，以写回方式批量保存转发过的消息
+        internTable(InternTable):昵称驻留表，二进制编码中使用id代替昵称
+        codecs(dict):编码名称到编码对象的映射，每个会话使用登录时协商的编码发送消息
+        compressor(FrameCompressor):帧压缩对象，为None时不接受压缩协商
+        metrics(MetricsRegistry):请求计数、收发字节数、登录结果以及处理延迟等指标
+        adminUsers(set):允许发送stats请求的用户昵称
+        metricsInterval(float):定期输出指标的间隔(秒)，0表示不输出
+        presenceCache(tuple):在线用户快照的版本号，以及各编码与压缩组合下已编码好的快照帧
+        reusePort(bool):是否为监听套接字设置SO_REUSEPORT，多进程模式下各工作进程共用同一个端口
+        shardBus(ShardBus):多进程模式下与其他分片通信的总线，单进程时为None
+        idleReaper(IdleReaper):使用时间轮跟踪每个连接的最近活动时间，回收超时未登录、心跳无回应的连接
+        rateLimiter(RateLimiter):按连接与请求类型进行令牌桶限速，超出限速的请求被丢弃并通知客户端
+        mailboxStore(MailboxStore):离线信箱，保存发给不在线用户的私聊消息，对方登录时批量投递
+        flushDelay(float):发送队列合并发送的延迟预算(秒)，0表示立即发送
+        writeBatch(int):线程模式下单次sendmsg最多发送的帧数，1表示每帧一次系统调用
     """
 
 # 构造函数
-    def __init__(self):
+    def __init__(self, ip: str = '127.0.0.1', port: int = 50000, slowConsumerPolicy: str = ob.POLICY_DROP,
+                 databaseUtils: 'DatabaseUtils' = None, compressionThreshold: Union[int, None] = cz.COMPRESSION_THRESHOLD,
+                 adminUsers: List[str] = (), metricsInterval: float = 60, reusePort: bool = False,
+                 shardBus: 'ShardBus' = None, idleTimeout: float = hb.IDLE_TIMEOUT,
+                 probeTimeout: float = hb.PROBE_TIMEOUT, loginTimeout: float = hb.LOGIN_TIMEOUT,
+                 rateLimits: Dict[str, Tuple[float, float]] = None, mailboxSize: int = mb.MAILBOX_SIZE,
+                 mailboxMemory: int = mb.MAILBOX_MEMORY, flushDelay: float = ob.FLUSH_DELAY,
+                 writeBatch: int = ob.WRITE_BATCH):
         """构造函数，用于服务端对象初始化"""
-        self.__IP = '127.0.0.1'
-        self.__PORT = 50000
+        self.__IP = ip
+        self.__PORT = port
         self.__listenSocket = None
         self.__isClosed = False
-        self.__connectionDict = {}
+        self.__sessionRegistry = sr.SessionRegistry(self.__onPresenceChange)
+        self.__presenceCache = (-1, {})
+        self.__roomRegistry = rr.RoomRegistry()
+        self.__slowConsumerPolicy = slowConsumerPolicy
+        self.__outboundWriter = None
+        self.__flushDelay = flushDelay
+        self.__writeBatch = writeBatch
+        self.__broadcastLatency = ob.LatencyRecorder()
+        self.__databaseUtils = databaseUtils if databaseUtils is not None else do.DatabaseUtils()
+        self.__messageStore = ms.MessageStore(self.__databaseUtils)
+        self.__internTable = cd.InternTable()
+        self.__binaryCodec = cd.BinaryCodec(self.__internTable)
+        self.__codecs = {cd.CODEC_JSON: cd.JSON_CODEC, cd.CODEC_BINARY: self.__binaryCodec}
+        self.__compressor = cz.FrameCompressor(compressionThreshold) if compressionThreshold is not None else None
+        self.__adminUsers = set(adminUsers)
+        self.__metricsInterval = metricsInterval
+        self.__metricsReporter = None
+        self.__metrics = mt.MetricsRegistry()
+        self.__reusePort = reusePort
+        self.__shardBus = shardBus
+        self.__idleReaper = hb.IdleReaper(self.probeConnection, self.reapConnection, idleTimeout, probeTimeout,
+                                          loginTimeout)
+        self.__rateLimiter = rl.RateLimiter(rateLimits)
+        self.__mailboxStore = mb.MailboxStore(self.__databaseUtils, mailboxSize, mailboxMemory,
+                                              shared=shardBus is not None)
+        self.__metrics.addGauge("sessions.active", lambda: len(self.__sessionRegistry))
+        self.__metrics.addGauge("connections.tracked", lambda: len(self.__idleReaper))
+        self.__metrics.addGauge("rooms.active", lambda: len(self.__roomRegistry))
+        self.__metrics.addGauge("messageStore.queueDepth", lambda: self.__messageStore.getStats()['queueDepth'])
+        self.__metrics.addGauge("mailbox.depth", self.__mailboxStore.depth)
+        self.__metrics.addGauge("mailbox.users", lambda: len(self.__mailboxStore))
 
 # 启动服务器
     def startServer(self):
@@ -38,13 +144,63 @@ class Server(object):
         """
         self.__listenSocket = sk.socket(sk.AF_INET, sk.SOCK_STREAM)
         self.__listenSocket.setsockopt(sk.SOL_SOCKET, sk.SO_REUSEADDR, True)
+        if self.__reusePort:
+            self.__listenSocket.setsockopt(sk.SOL_SOCKET, sk.SO_REUSEPORT, True)
         address = (self.__IP, self.__PORT)
         self.__listenSocket.bind(address)
-        self.__listenSocket.listen(5)
+        self.__listenSocket.listen(128)
         self.__listenSocket.settimeout(180)
+        raiseFileLimit()
+        self.__outboundWriter = ob.OutboundWriter(self.__flushDelay, self.__writeBatch)
+        self.__outboundWriter.start()
+        self.__idleReaper.start()
+        self.startServices()
         print("服务端启动成功，等待客户端连接·······")
         return None
 
+# 启动后台服务
+    def startServices(self):
+        """启动与服务模式无关的后台服务，线程模式与asyncio模式在启动时都会调用此函数
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:None
+        """
+        self.__messageStore.start()
+        self.__mailboxStore.start()
+        if self.__shardBus is not None:
+            self.__shardBus.start(self.onBusMessage)
+        if self.__metricsInterval > 0:
+            self.__metricsReporter = mt.MetricsReporter(self.__metrics, self.__metricsInterval)
+            self.__metricsReporter.start()
+        return None
+
+# 停止后台服务
+    def stopServices(self):
+        """停止后台服务，并将尚未写入的聊天记录写入数据库
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:None
+        """
+        if self.__metricsReporter is not None:
+            self.__metricsReporter.stop()
+        self.__idleReaper.stop()
+        print("空闲连接回收统计：{}".format(self.__idleReaper.getStats()))
+        if self.__shardBus is not None:
+            self.__shardBus.stop()
+            print("分片总线统计：{}".format(self.__shardBus.getStats()))
+        self.__messageStore.stop()
+        print("聊天记录写入统计：{}".format(self.__messageStore.getStats()))
+        self.__mailboxStore.stop()
+        print("离线信箱统计：{}".format(self.__mailboxStore.getStats()))
+        print(mt.formatText(self.__metrics.snapshot()))
+        if self.__compressor is not None:
+            print("压缩统计：{}".format(self.__compressor.getStats()))
+        return None
+
 # 连接处理
     def connectionProcess(self) -> Union['socket', str, None]:
         """用于处理客户端的连接请求并返回相应的连接套接字
@@ -63,7 +219,7 @@ class Server(object):
             self.closeServer()
             sys.exit("程序已退出")
         except sk.timeout:
-            if len(self.__connectionDict) == 0:
+            if self.connectionCount() == 0:
                 print("长时间无连接，服务器已关闭")
                 self.closeServer()
             else:
@@ -83,77 +239,942 @@ class Server(object):
         返回值:
             nicknameStatus(tuple):由用户名和验证结果组成的二元组
         """
-        dbOperation = do.DatabaseUtils()
         name, password = userInfo.split()
-        status = dbOperation.isExist(name=name, password=password)
+        status = self.__databaseUtils.isExist(name=name, password=password)
+        if status == LOGIN_FAILED:
+            self.__metrics.increment("login.failure")
+        else:
+            self.__metrics.increment("login.success" if status == 2 else "login.registered")
         nicknameStatus = (name, status)
         return nicknameStatus
 
 # 私聊消息处理
-    def relayPrivateMessage(self, sourceUser: str, targetUser: str, message: str):
-        """消息私发函数，用于对客户端发来的私聊消息进行转发
+    def relayPrivateMessage(self, sourceUser: str, targetUser: str, message: str, isRegistered: bool = None):
+        """消息私发函数，用于对客户端发来的私聊消息进行转发，目标用户不在任何分片上在线时存入其离线信箱，
+        目标用户不存在时消息被拒绝，不写入聊天记录
 
         参数:
             self:表明该函数是一个实例方法
             sourceUser(str):消息发送者的昵称
             targetUser(str):消息目标用户的昵称
             message(str):消息的具体内容
+            isRegistered(bool):目标用户是否已注册，None表示需要时查询数据库
 
         返回值:None
         """
+        startTime = t.perf_counter()
         messageDict = {'source': sourceUser, 'destination': targetUser, 'type': "private", 'data': message}
-        messageJSON = json.dumps(messageDict)
-        for nickname, connectSocket in self.__connectionDict.items():
-            if nickname == targetUser:
-                sock = connectSocket
-                break
-        sock.send(messageJSON.encode())
+        if not self.sendMessage(targetUser, messageDict):
+            shard = self.__sessionRegistry.remoteShard(targetUser) if self.__shardBus is not None else None
+            if shard is not None:
+                self.__shardBus.publish({'kind': "private", 'message': messageDict}, shard)
+            elif not self.depositMessage(sourceUser, targetUser, message, isRegistered):
+                return None
+        self.__messageStore.append("private", sourceUser, targetUser, message)
+        self.__metrics.record("relay.private", t.perf_counter() - startTime)
+        return None
+
+# 存入离线信箱
+    def depositMessage(self, sourceUser: str, targetUser: str, message: str, isRegistered: bool = None) -> bool:
+        """将私聊消息存入不在线用户的离线信箱，存入之后目标用户已经登录时说明登录时的投递可能早于存入，
+        此时立即取出信箱补发，该情况只会在线程模式下出现，
+        目标用户没有注册时不存入信箱并告知发送者，避免信箱为任意编造的昵称无限增长
+
+        参数:
+            self:表明该函数是一个实例方法
+            sourceUser(str):消息发送者的昵称
+            targetUser(str):消息目标用户的昵称
+            message(str):消息的具体内容
+            isRegistered(bool):目标用户是否已注册，None表示在此查询
+
+        返回值:
+            bool:False 表明目标用户不存在，消息被拒绝；True 表明已存入或因信箱已满被丢弃
+        """
+        if isRegistered is None:
+            isRegistered = self.isRegisteredUser(targetUser)
+        if not isRegistered:
+            self.__metrics.increment("mailbox.rejected")
+            self.sendMessage(sourceUser, {'source': None, 'destination': sourceUser, 'type': "private",
+                                          'data': {'user': targetUser, 'error': "unknown user"}})
+            return False
+        if not self.__mailboxStore.deposit(targetUser, sourceUser, message):
+            self.__metrics.increment("mailbox.dropped")
+            return True
+        self.__metrics.increment("mailbox.deposited")
+        session = self.__sessionRegistry.get(targetUser)
+        if session is not None:
+            self.deliverMailbox(session, self.takeMailbox(targetUser))
+        elif self.__shardBus is not None:
+            shard = self.__sessionRegistry.remoteShard(targetUser)
+            if shard is not None:
+                self.forwardMailbox(targetUser, shard)
+        return True
+
+# 判断用户是否已注册
+    def isRegisteredUser(self, nickname: str) -> bool:
+        """判断昵称是否属于已注册的用户，在线用户一定已注册，否则查询身份验证缓存或数据库，
+        asyncio模式在线程池中调用
+
+        参数:
+            self:表明该函数是一个实例方法
+            nickname(str):用户昵称
+
+        返回值:
+            bool:True 表明该用户已注册；False 表明该用户不存在
+        """
+        if self.isReachable(nickname):
+            return True
+        return self.__databaseUtils.isRegistered(nickname)
+
+# 判断用户是否在线
+    def isReachable(self, nickname: str) -> bool:
+        """判断用户是否在本分片或其他分片上在线，私聊消息可以直接转发而无需存入离线信箱
+
+        参数:
+            self:表明该函数是一个实例方法
+            nickname(str):用户昵称
+
+        返回值:
+            bool:True 表明该用户在线
+        """
+        if self.__sessionRegistry.get(nickname) is not None:
+            return True
+        return self.__shardBus is not None and self.__sessionRegistry.remoteShard(nickname) is not None
+
+# 转发离线信箱
+    def forwardMailbox(self, nickname: str, shard: int):
+        """多进程模式下用户登录到其他分片时调用，该分片负责取出数据库中的消息，
+        本分片内存中尚未转存的消息作为普通私聊消息转发给该分片投递
+
+        参数:
+            self:表明该函数是一个实例方法
+            nickname(str):登录到其他分片的用户的昵称
+            shard(int):该用户所在的分片编号
+
+        返回值:None
+        """
+        entries = self.__mailboxStore.release(nickname)
+        for source, message, createdAt in entries:
+            messageDict = {'source': source, 'destination': nickname, 'type': "private", 'data': message}
+            self.__shardBus.publish({'kind': "private", 'message': messageDict}, shard)
+        if len(entries) > 0:
+            self.__metrics.increment("mailbox.forwarded", len(entries))
         return None
 
+# 取出离线信箱
+    def takeMailbox(self, nickname: str) -> List[Tuple[str, str, float]]:
+        """取出用户的离线信箱并记录耗时，该函数可能访问数据库，asyncio模式下在线程池中执行
+
+        参数:
+            self:表明该函数是一个实例方法
+            nickname(str):登录用户的昵称
+
+        返回值:
+            List[tuple]:按时间正序排列的(发送者, 内容, 时间)元组
+        """
+        startTime = t.perf_counter()
+        entries = self.__mailboxStore.drain(nickname)
+        self.__metrics.record("mailbox.drain", t.perf_counter() - startTime)
+        return entries
+
+# 投递离线消息
+    def deliverMailbox(self, session: 'Session', entries: List[Tuple[str, str, float]]) -> int:
+        """将离线消息编码为普通的私聊帧，按MAILBOX_CHUNK_SIZE拼接成若干块，每块只放入发送队列一次，
+        旧客户端按帧解析不受影响，发送队列放不下时剩余的消息放回信箱，等待下一次登录
+
+        参数:
+            self:表明该函数是一个实例方法
+            session(Session):登录用户的会话
+            entries(List[tuple]):按时间正序排列的(发送者, 内容, 时间)元组
+
+        返回值:
+            int:放入发送队列的消息数
+        """
+        delivered = 0
+        while delivered < len(entries):
+            frames = []
+            size = 0
+            for source, message, createdAt in entries[delivered:]:
+                messageDict = {'source': source, 'destination': session.nickname, 'type': "private", 'data': message}
+                frame = self.encodeFrame(messageDict, session.codec, session.compression)
+                if len(frames) > 0 and size + len(frame) > MAILBOX_CHUNK_SIZE:
+                    break
+                frames.append(frame)
+                size += len(frame)
+            if not session.push(b"".join(frames)):
+                self.__mailboxStore.restore(session.nickname, entries[delivered:])
+                self.__metrics.increment("mailbox.deferred", len(entries) - delivered)
+                break
+            self.__metrics.increment("bytes.out", size)
+            delivered += len(frames)
+        if delivered > 0:
+            self.__metrics.increment("mailbox.delivered", delivered)
+        return delivered
+
 # 群聊消息处理
-    def relayPublicMessage(self, sourceUser: str, message: str):
-        """消息群发函数，用于对客户端发来的群聊消息进行转发
+    def relayPublicMessage(self, sourceUser: str, message: str, room: Union[str, None] = None):
+        """消息群发函数，用于对客户端发来的群聊消息进行转发，room为None时发给全部在线用户，
+        否则只发给该聊天室的成员，发送者必须已加入该聊天室
 
         参数:
             self:表明该函数是一个实例方法
             sourceUser(str):消息发送者的昵称
             message(str):消息的具体内容
+            room(str):聊天室名称
 
         返回值:None
         """
-        messageDict = {'source': sourceUser, 'destination': None, 'type': "public", 'data': message}
-        messageJSON = json.dumps(messageDict)
-        for nickname, connectSocket in self.__connectionDict.items():
-            if nickname == sourceUser:
-                continue
+        startTime = t.perf_counter()
+        messageDict = {'source': sourceUser, 'destination': room, 'type': "public", 'data': message}
+        if room is None:
+            recipients = [session for session in self.__sessionRegistry.snapshot() if session.nickname != sourceUser]
+            shards = None
+        elif self.__roomRegistry.isMember(room, sourceUser):
+            recipients = [session for session in self.__roomRegistry.recipients(room) if session.nickname != sourceUser]
+            shards = self.__roomRegistry.remoteShards(room)
+        else:
+            self.__metrics.increment("rooms.rejected")
+            self.sendMessage(sourceUser, {'source': None, 'destination': sourceUser, 'type': "rooms",
+                                          'data': {'room': room, 'error': "not a member"}})
+            return None
+        self.__broadcast(recipients, messageDict)
+        if self.__shardBus is not None:
+            if shards is None:
+                self.__shardBus.publish({'kind': "public", 'message': messageDict})
             else:
-                connectSocket.send(messageJSON.encode())
+                for shard in shards:
+                    self.__shardBus.publish({'kind': "public", 'message': messageDict}, shard)
+        self.__messageStore.append("public", sourceUser, room, message)
+        self.__metrics.record("relay.public" if room is None else "relay.room", t.perf_counter() - startTime)
+        return None
+
+# 加入聊天室
+    def joinRoom(self, session: 'Session', room: str, requestId: Union[int, None] = None):
+        """将用户加入聊天室并回复加入结果与聊天室的成员数
+
+        参数:
+            self:表明该函数是一个实例方法
+            session(Session):请求者的会话
+            room(str):聊天室名称
+            requestId(int):请求id，回复中原样带回
+
+        返回值:None
+        """
+        if not rr.isValidRoomName(room):
+            data = {'room': room, 'error': "invalid room name"}
+        elif self.__roomRegistry.join(room, session):
+            if self.__shardBus is not None:
+                self.__shardBus.publish({'kind': "roomJoin", 'room': room, 'nickname': session.nickname})
+            data = {'room': room, 'members': len(self.__roomRegistry.members(room))}
+        elif self.__roomRegistry.isMember(room, session.nickname):
+            data = {'room': room, 'members': len(self.__roomRegistry.members(room))}
+        else:
+            data = {'room': room, 'error': "too many rooms"}
+        self.sendMessage(session.nickname, {'source': None, 'destination': session.nickname, 'type': "join",
+                                            'data': data}, requestId)
+        return None
+
+# 离开聊天室
+    def leaveRoom(self, sourceUser: str, room: str, requestId: Union[int, None] = None):
+        """将用户移出聊天室并回复结果
+
+        参数:
+            self:表明该函数是一个实例方法
+            sourceUser(str):请求者的昵称
+            room(str):聊天室名称
+            requestId(int):请求id，回复中原样带回
+
+        返回值:None
+        """
+        if self.__roomRegistry.leave(room, sourceUser):
+            if self.__shardBus is not None:
+                self.__shardBus.publish({'kind': "roomLeave", 'room': room, 'nickname': sourceUser})
+            data = {'room': room}
+        else:
+            data = {'room': room, 'error': "not a member"}
+        self.sendMessage(sourceUser, {'source': None, 'destination': sourceUser, 'type': "leave", 'data': data},
+                         requestId)
+        return None
+
+# 发送聊天室列表
+    def sendRoomList(self, sourceUser: str, room: Union[str, None] = None, requestId: Union[int, None] = None):
+        """响应rooms请求，room为None时返回全部聊天室的成员数以及请求者加入的聊天室，否则返回该聊天室的成员
+
+        参数:
+            self:表明该函数是一个实例方法
+            sourceUser(str):请求者的昵称
+            room(str):聊天室名称
+            requestId(int):请求id，回复中原样带回
+
+        返回值:None
+        """
+        if room is None:
+            data = {'rooms': self.__roomRegistry.listRooms(), 'joined': self.__roomRegistry.roomsOf(sourceUser)}
+        else:
+            data = {'room': room, 'members': self.__roomRegistry.members(room)}
+        self.sendMessage(sourceUser, {'source': None, 'destination': sourceUser, 'type': "rooms", 'data': data},
+                         requestId)
+        return None
+
+# 离开全部聊天室
+    def leaveAllRooms(self, nickname: str):
+        """用户下线或重新登录时移除其全部聊天室成员关系，并通知其他分片"""
+        rooms = self.__roomRegistry.leaveAll(nickname)
+        if self.__shardBus is not None and rooms:
+            self.__shardBus.publish({'kind': "roomLeaveAll", 'nickname': nickname})
+        return None
+
+# 群发消息
+    def __broadcast(self, recipients: List['Session'], messageDict: dict, tracked: bool = True):
+        """将同一条消息发送给多个会话，每种编码与压缩方式的组合只编码、压缩一次，
+        使用相同组合的接收者共享同一个帧对象，所有组合都编码完成后才开始投递，
+        编码失败时没有任何接收者收到该消息，而不是只有一部分接收者收到
+
+        参数:
+            self:表明该函数是一个实例方法
+            recipients(List[Session]):接收者的会话
+            messageDict(dict):消息字典
+            tracked(bool):是否计入群发延迟统计，服务端自身产生的通知不计入
+
+        返回值:None
+        """
+        frames = {}
+        for session in recipients:
+            variant = (session.codec, session.compression)
+            if variant not in frames:
+                frames[variant] = self.encodeFrame(messageDict, session.codec, session.compression)
+        tracker = ob.BroadcastTracker(len(recipients), self.__broadcastLatency.record) if tracked else None
+        for session in recipients:
+            self.__deliverFrame(session, frames[(session.codec, session.compression)], tracker)
+        return None
+
+# 编码消息帧
+    def encodeFrame(self, messageDict: dict, codecName: str = cd.CODEC_JSON,
+                    compression: Union[str, None] = None) -> bytes:
+        """使用指定的编码将消息字典编码并封装成帧，协商了压缩的连接在帧体超过阈值时发送压缩帧
+
+        参数:
+            self:表明该函数是一个实例方法
+            messageDict(dict):消息字典
+            codecName(str):编码名称
+            compression(str):压缩方式，None表示不压缩
+
+        返回值:
+            bytes:编码好的帧
+        """
+        payload = self.__codecs[codecName].encode(messageDict)
+        if compression is None:
+            return pt.packFrame(payload)
+        return self.__compressor.packFrame(payload)
+
+# 解码消息
+    def decodeMessage(self, payload: Union[bytes, memoryview]) -> dict:
+        """自动识别帧体使用的编码并解码为消息字典
+
+        参数:
+            self:表明该函数是一个实例方法
+            payload(bytes|memoryview):帧体
+
+        返回值:
+            dict:消息字典
+        """
+        return cd.decodeMessage(payload, self.__binaryCodec)
+
+# 投递消息帧
+    def __deliverFrame(self, session: 'Session', frame: bytes, tracker: 'BroadcastTracker' = None):
+        """将编码好的帧放入目标用户的发送队列，队列已满时按照慢消费者策略进行处理
+
+        参数:
+            self:表明该函数是一个实例方法
+            session(Session):目标用户的会话
+            frame(bytes):已经编码好的帧
+            tracker(BroadcastTracker):群发跟踪对象，单发时为None
+
+        返回值:None
+        """
+        if session.push(frame, tracker):
+            self.__metrics.increment("bytes.out", len(frame))
+        elif session.queue.isLagging():
+            if self.__slowConsumerPolicy == ob.POLICY_DROP:
+                print("{}接收过慢，连接已被断开".format(session.nickname))
+                self.closeConnection(session.nickname, session)
+            else:
+                print("{}接收过慢，已标记为滞后并丢弃消息".format(session.nickname))
         return None
 
 # 发送在线用户信息
-    def sendOnlineUserInfo(self, sourceUser: str):
+    def sendOnlineUserInfo(self, sourceUser: str, requestId: Union[int, None] = None):
         """用于发送当前在线用户的信息，当客户端发来获取在线用户信息的请求时，调用此函数
 
         参数:
             self:表明该函数是一个实例方法
             sourceUser(str):消息发送者的昵称
+            requestId(int):请求id，回复中原样带回
 
         返回值:None
         """
-        onlineUserList = []
-        onlineUserStr = None
-        for nickname, connectSocket in self.__connectionDict.items():
-            if nickname == sourceUser:
-                sock = connectSocket
-            else:
-                onlineUserList.append(nickname)
+        onlineUserList = [nickname for nickname in self.__sessionRegistry.presence()[1] if nickname != sourceUser]
         onlineUserStr = " ".join(onlineUserList)
-        print(onlineUserStr)
         messageDict = {'source': sourceUser, 'destination': None, 'type': "get", 'data': onlineUserStr}
-        messageJSON = json.dumps(messageDict)
-        sock.send(messageJSON.encode())
+        self.sendMessage(sourceUser, messageDict, requestId)
+        return None
+
+# 发送消息
+    def sendMessage(self, nickname: str, messageDict: dict, requestId: Union[int, None] = None) -> bool:
+        """使用目标用户协商的编码将消息发送给指定的在线用户
+
+        参数:
+            self:表明该函数是一个实例方法
+            nickname(str):目标用户的昵称
+            messageDict(dict):消息字典
+            requestId(int):该消息是对某个请求的回复时为请求id，客户端据此将回复与请求配对
+
+        返回值:
+            bool:True 表明目标用户在线；False 表明目标用户不在线
+        """
+        session = self.__sessionRegistry.get(nickname)
+        if session is None:
+            return False
+        if requestId is not None:
+            messageDict = dict(messageDict, id=requestId)
+        self.__deliverFrame(session, self.encodeFrame(messageDict, session.codec, session.compression))
+        return True
+
+# 加载聊天记录
+    def loadHistory(self, sourceUser: str, targetUser: Union[str, None], cursor: Union[dict, None]) -> dict:
+        """查询一页聊天记录，targetUser为None时查询群聊记录，否则查询与该用户的私聊记录，
+        该函数会访问数据库，asyncio模式下在线程池中执行
+
+        参数:
+            self:表明该函数是一个实例方法
+            sourceUser(str):请求者的昵称
+            targetUser(str):私聊对象的昵称，群聊为None
+            cursor(dict):分页参数，before为游标(消息id)，limit为每页条数，None表示从最新的记录开始，
+                room为聊天室名称，指定时查询该聊天室的群聊记录，请求者必须已加入该聊天室
+
+        返回值:
+            dict:history消息字典
+        """
+        cursor = cursor or {}
+        room = cursor.get('room')
+        if room is not None:
+            if self.__roomRegistry.isMember(room, sourceUser):
+                history = self.__messageStore.getHistory("public", sourceUser, room, cursor.get('before'),
+                                                         cursor.get('limit', ms.HISTORY_PAGE_SIZE))
+            else:
+                history = {'messages': [], 'nextCursor': None, 'error': "not a member"}
+            return {'source': sourceUser, 'destination': None, 'type': "history", 'data': history}
+        messageType = "public" if targetUser is None else "private"
+        history = self.__messageStore.getHistory(messageType, sourceUser, targetUser, cursor.get('before'),
+                                                 cursor.get('limit', ms.HISTORY_PAGE_SIZE))
+        messageDict = {'source': sourceUser, 'destination': targetUser, 'type': "history", 'data': history}
+        return messageDict
+
+# 收到分片消息
+    def onBusMessage(self, message: dict):
+        """分片总线的消息处理函数，在总线的接收线程中调用，线程模式下直接处理
+
+        参数:
+            self:表明该函数是一个实例方法
+            message(dict):其他分片发来的消息
+
+        返回值:None
+        """
+        self.handleBusMessage(message)
         return None
 
+# 处理分片消息
+    def handleBusMessage(self, message: dict):
+        """处理其他分片发来的消息：hello、join、leave、down用于维护其他分片上的在线用户，
+        roomJoin、roomLeave、roomLeaveAll用于维护其他分片上的聊天室成员，
+        public与private是其他分片转发来的聊天消息，只投递给本分片的会话，
+        connected由本分片的总线产生，表示已连上一个分片，需要通过新连接发送本分片的在线用户
+
+        参数:
+            self:表明该函数是一个实例方法
+            message(dict):其他分片发来的消息，shard为发送方的分片编号
+
+        返回值:None
+        """
+        kind = message['kind']
+        shard = message['shard']
+        self.__metrics.increment("bus." + kind)
+        if kind == "join":
+            self.__sessionRegistry.addRemote(message['nickname'], shard)
+            self.forwardMailbox(message['nickname'], shard)
+        elif kind == "leave":
+            self.__sessionRegistry.removeRemote(message['nickname'], shard)
+            self.__roomRegistry.removeRemote(message['nickname'], shard)
+        elif kind == "roomJoin":
+            self.__roomRegistry.addRemote(message['room'], message['nickname'], shard)
+        elif kind == "roomLeave":
+            self.__roomRegistry.removeRemote(message['nickname'], shard, message['room'])
+        elif kind == "roomLeaveAll":
+            self.__roomRegistry.removeRemote(message['nickname'], shard)
+        elif kind == "public":
+            messageDict = message['message']
+            room = messageDict['destination']
+            sessions = self.__sessionRegistry.snapshot() if room is None else self.__roomRegistry.recipients(room)
+            recipients = [session for session in sessions if session.nickname != messageDict['source']]
+            self.__broadcast(recipients, messageDict)
+        elif kind == "private":
+            messageDict = message['message']
+            if not self.sendMessage(messageDict['destination'], messageDict):
+                self.depositMessage(messageDict['source'], messageDict['destination'], messageDict['data'])
+        elif kind == "connected":
+            nicknames = [session.nickname for session in self.__sessionRegistry.snapshot()]
+            self.__shardBus.publish({'kind': "hello", 'nicknames': nicknames,
+                                     'rooms': self.__roomRegistry.memberships()}, shard)
+        elif kind == "hello":
+            for nickname in message['nicknames']:
+                self.__sessionRegistry.addRemote(nickname, shard)
+            for room, nickname in message['rooms']:
+                self.__roomRegistry.addRemote(room, nickname, shard)
+        elif kind == "down":
+            self.__sessionRegistry.removeShard(shard)
+            self.__roomRegistry.removeShard(shard)
+        return None
+
+# 记录请求指标
+    def recordRequest(self, messageType: str, size: int, seconds: float):
+        """记录一次请求的类型、字节数与处理耗时，线程模式与asyncio模式在处理完每个请求后调用
+
+        参数:
+            self:表明该函数是一个实例方法
+            messageType(str):请求的消息类型
+            size(int):请求在网络上的字节数
+            seconds(float):处理耗时(秒)
+
+        返回值:None
+        """
+        name = messageType if messageType in REQUEST_TYPES else "unknown"
+        self.__metrics.increment("requests." + name)
+        self.__metrics.increment("bytes.in", size)
+        self.__metrics.record("dispatch." + name, seconds)
+        return None
+
+# 校验请求
+    def validateRequest(self, messageDict: dict):
+        """在分发之前检查请求的字段是否齐全、类型是否符合各处理函数的要求，
+        非法请求在此被拒绝，分发过程中出现的异常因此不会被当作非法请求
+
+        参数:
+            self:表明该函数是一个实例方法
+            messageDict(dict):解码后的消息
+
+        返回值:None
+
+        异常:
+            ValueError:字段缺失或类型错误
+        """
+        if not isinstance(messageDict, dict) or not isinstance(messageDict.get('type'), str):
+            raise ValueError("消息缺少type")
+        for field in ('source', 'destination', 'data'):
+            if field not in messageDict:
+                raise ValueError("消息缺少{}".format(field))
+        for field in ('source', 'destination'):
+            if not isinstance(messageDict[field], (str, type(None))):
+                raise ValueError("{}必须是字符串".format(field))
+        messageType = messageDict['type']
+        data = messageDict['data']
+        if messageType == 'login':
+            if not isinstance(data, str) or len(data.split()) != 2:
+                raise ValueError("登录信息必须由用户名和密码组成")
+            for field in ('codecs', 'compression'):
+                if not isinstance(messageDict.get(field), (list, type(None))):
+                    raise ValueError("{}必须是列表".format(field))
+        elif messageType in TEXT_REQUEST_TYPES:
+            if not isinstance(data, str):
+                raise ValueError("data必须是字符串")
+            if messageType == 'private' and messageDict['destination'] is None:
+                raise ValueError("私聊消息缺少destination")
+        elif messageType == 'rooms':
+            if not isinstance(data, (str, type(None))):
+                raise ValueError("data必须是字符串")
+        elif messageType == 'history' and data is not None:
+            if not isinstance(data, dict) or not isinstance(data.get('room'), (str, type(None))):
+                raise ValueError("聊天记录游标不合法")
+            for field in ('before', 'limit'):
+                value = data.get(field)
+                if value is not None and (not isinstance(value, int) or isinstance(value, bool)):
+                    raise ValueError("{}必须是整数".format(field))
+        return None
+
+# 记录非法请求
+    def recordMalformed(self, size: int):
+        """记录一次因解码或校验失败而被丢弃的请求，例如缺少字段、字段类型错误或无法解码的帧体
+
+        参数:
+            self:表明该函数是一个实例方法
+            size(int):请求在网络上的字节数
+
+        返回值:None
+        """
+        self.__metrics.increment("requests.malformed")
+        self.__metrics.increment("bytes.in", size)
+        return None
+
+# 记录处理失败的请求
+    def recordFailure(self, messageType: str):
+        """记录一次通过校验但在处理过程中抛出异常的请求，并输出异常栈以便定位处理函数中的问题，
+        该连接的后续请求照常处理，在except子句中调用
+
+        参数:
+            self:表明该函数是一个实例方法
+            messageType(str):请求的消息类型
+
+        返回值:None
+        """
+        print("处理{}请求时出现异常".format(messageType))
+        traceback.print_exc()
+        self.__metrics.increment("requests.failed")
+        return None
+
+# 获取统计信息
+    def getStats(self) -> dict:
+        """返回全部指标以及各组件的统计信息，用于响应stats请求
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:
+            dict:指标快照，另外包含群发延迟、聊天记录存储、压缩、发送合并、连接池、身份验证缓存、空闲连接回收与离线信箱的统计信息
+        """
+        stats = self.__metrics.snapshot()
+        stats['broadcastLatency'] = self.getBroadcastLatency()
+        stats['messageStore'] = self.getMessageStoreStats()
+        stats['compression'] = self.getCompressionStats()
+        stats['outbound'] = self.getOutboundStats()
+        stats['databasePool'] = self.__databaseUtils.getPoolStats()
+        stats['authCache'] = self.__databaseUtils.getAuthCacheStats()
+        stats['idleReaper'] = self.__idleReaper.getStats()
+        stats['mailbox'] = self.__mailboxStore.getStats()
+        return stats
+
+# 发送统计信息
+    def sendStats(self, session: 'Session', requestId: Union[int, None] = None):
+        """响应stats请求，只有管理员用户可以获取统计信息，管理员身份按请求所在连接登录的会话判断，
+        不使用消息中由客户端填写的source
+
+        参数:
+            self:表明该函数是一个实例方法
+            session(Session):发出请求的连接登录后的会话
+            requestId(int):请求id，回复中原样带回
+
+        返回值:None
+        """
+        nickname = session.nickname
+        if nickname in self.__adminUsers:
+            data = self.getStats()
+        else:
+            data = {'error': "permission denied"}
+        self.sendMessage(nickname, {'source': nickname, 'destination': None, 'type': "stats", 'data': data},
+                         requestId)
+        return None
+
+# 获取聊天记录存储统计信息
+    def getMessageStoreStats(self) -> dict:
+        """返回聊天记录写回队列深度、批量大小和刷新耗时等统计信息
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:
+            dict:统计信息
+        """
+        return self.__messageStore.getStats()
+
+# 注册连接
+    def registerConnection(self, nickname: str, conn: 'socket', codecName: str = cd.CODEC_JSON,
+                           compression: Union[str, None] = None, presence: bool = False) -> 'Session':
+        """用于在客户端登录后为连接创建发送队列和会话，并将会话加入注册表，
+        同一昵称重复登录时关闭原有的连接并退出原有连接加入的聊天室，上线的昵称会被驻留并通知使用二进制编码的客户端
+
+        参数:
+            self:表明该函数是一个实例方法
+            nickname(str):登录用户的昵称
+            conn(socket对象):与该用户对应的连接
+            codecName(str):登录时协商的编码
+            compression(str):登录时协商的压缩方式，None表示不压缩
+            presence(bool):是否订阅在线用户的增量推送
+
+        返回值:
+            session(Session):该用户的会话
+        """
+        userId, isNew = self.__internTable.intern(nickname)
+        if isNew:
+            internDict = {'source': None, 'destination': None, 'type': "intern", 'data': [[userId, nickname]]}
+            self.__broadcast([session for session in self.__sessionRegistry.snapshot()
+                              if session.codec == cd.CODEC_BINARY], internDict, tracked=False)
+        session = sr.Session(nickname, self.createOutboundQueue(conn), codecName, compression, presence)
+        oldSession = self.__sessionRegistry.add(session)
+        if oldSession is not None:
+            oldSession.queue.close()
+            self.leaveAllRooms(nickname)
+        elif self.__shardBus is not None:
+            self.__shardBus.publish({'kind': "join", 'nickname': nickname})
+        print("{}已登录，当前在线人数：{}".format(nickname, len(self.__sessionRegistry)))
+        return session
+
+# 完成登录
+    def completeLogin(self, conn: 'socket', messageDict: dict, nickname: str, status: int,
+                      size: int = 0) -> Union['Session', None]:
+        """身份验证完成后注册会话并回复登录结果，login消息中带有codecs时进行编码与压缩协商，
+        回复包含登录结果、协商的编码、压缩方式以及驻留表，否则按原有格式只回复登录结果，
+        login消息中presence为True时，在回复之后发送一次在线用户快照，此后只推送增量，
+        heartbeat为True表示客户端会回应ping，空闲时由服务端发送ping探测，login消息带有请求id时回复中原样带回，
+        身份验证失败时只在该连接上直接回复登录结果，不注册会话，也不影响该昵称已经在线的会话
+
+        参数:
+            self:表明该函数是一个实例方法
+            conn(socket对象):客户端对应的连接
+            messageDict(dict):客户端发来的login消息
+            nickname(str):登录用户的昵称
+            status(int):身份验证结果
+            size(int):login消息在网络上的字节数
+
+        返回值:
+            session(Session):该用户的会话，身份验证失败时为None
+        """
+        offeredCodecs = messageDict.get('codecs')
+        requestId = cd.getRequestId(messageDict)
+        if status == LOGIN_FAILED:
+            if offeredCodecs is None:
+                frame = pt.packFrame(str(status).encode())
+            else:
+                replyDict = {'source': None, 'destination': nickname, 'type': "login",
+                             'data': {'status': status, 'codec': cd.CODEC_JSON, 'compression': None,
+                                      'userId': None, 'users': []}}
+                if requestId is not None:
+                    replyDict['id'] = requestId
+                frame = self.encodeFrame(replyDict)
+            try:
+                conn.sendall(frame)
+            except OSError:
+                pass
+            return None
+
+        codecName = cd.negotiate(offeredCodecs)
+        compression = cz.negotiate(messageDict.get('compression')) if self.__compressor is not None else None
+        session = self.registerConnection(nickname, conn, codecName, compression,
+                                          offeredCodecs is not None and bool(messageDict.get('presence')))
+        session.recordIn(size)
+        liveness = self.__idleReaper.lookup(conn)
+        if liveness is not None:
+            liveness.session = session
+            liveness.heartbeat = offeredCodecs is not None and bool(messageDict.get('heartbeat'))
+        if offeredCodecs is None:
+            self.__deliverFrame(session, pt.packFrame(str(status).encode()))
+        else:
+            users = self.__internTable.items() if codecName == cd.CODEC_BINARY else []
+            replyDict = {'source': None, 'destination': nickname, 'type': "login",
+                         'data': {'status': status, 'codec': codecName, 'compression': compression,
+                                  'userId': self.__internTable.lookupId(nickname), 'users': users}}
+            if requestId is not None:
+                replyDict['id'] = requestId
+            self.__deliverFrame(session, self.encodeFrame(replyDict))
+        if session.presence:
+            self.sendPresenceSnapshot(session)
+        return session
+
+# 发送在线用户快照
+    def sendPresenceSnapshot(self, session: 'Session'):
+        """发送带有版本号的在线用户快照，快照帧按编码与压缩组合缓存，在线用户集合变化后才重新编码
+
+        参数:
+            self:表明该函数是一个实例方法
+            session(Session):接收快照的会话
+
+        返回值:None
+        """
+        version, nicknames = self.__sessionRegistry.presence()
+        cachedVersion, frames = self.__presenceCache
+        if cachedVersion != version:
+            frames = {}
+            self.__presenceCache = (version, frames)
+        variant = (session.codec, session.compression)
+        frame = frames.get(variant)
+        if frame is None:
+            presenceDict = {'source': None, 'destination': None, 'type': "presence",
+                            'data': {'version': version, 'users': list(nicknames)}}
+            frame = frames[variant] = self.encodeFrame(presenceDict, session.codec, session.compression)
+        self.__deliverFrame(session, frame)
+        return None
+
+# 在线用户变化
+    def __onPresenceChange(self, change: str, nickname: str, version: int):
+        """在线用户集合变化时由会话注册表调用，向订阅了推送的其他会话发送增量，
+        客户端发现版本号不连续时会发送presence请求重新获取快照
+
+        参数:
+            self:表明该函数是一个实例方法
+            change(str):join 表示上线；leave 表示下线
+            nickname(str):发生变化的用户昵称
+            version(int):变化后的版本号
+
+        返回值:None
+        """
+        key = "joined" if change == "join" else "left"
+        deltaDict = {'source': None, 'destination': None, 'type': "presence",
+                     'data': {'version': version, key: [nickname]}}
+        recipients = [session for session in self.__sessionRegistry.snapshot()
+                      if session.presence and session.nickname != nickname]
+        self.__broadcast(recipients, deltaDict, tracked=False)
+        return None
+
+# 创建发送队列
+    def createOutboundQueue(self, conn: 'socket') -> 'OutboundQueue':
+        """为连接创建发送队列，线程模式下队列由发送线程统一进行非阻塞发送
+
+        参数:
+            self:表明该函数是一个实例方法
+            conn(socket对象):客户端对应的连接
+
+        返回值:
+            OutboundQueue:该连接的发送队列
+        """
+        return ob.OutboundQueue(conn, self.__outboundWriter.schedule)
+
+# 获取发送合并统计
+    def getOutboundStats(self) -> Union[dict, None]:
+        """返回发送线程的发送轮次、系统调用次数、发送的帧数以及平均每次系统调用发送的帧数
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:
+            dict:统计信息，发送线程尚未启动时返回None
+        """
+        if self.__outboundWriter is None:
+            return None
+        return self.__outboundWriter.getStats()
+
+# 获取压缩统计
+    def getCompressionStats(self) -> Union[dict, None]:
+        """返回压缩比与压缩耗时等统计信息
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:
+            dict:压缩统计信息，None表示未启用压缩
+        """
+        return self.__compressor.getStats() if self.__compressor is not None else None
+
+# 获取群发延迟
+    def getBroadcastLatency(self) -> dict:
+        """返回群发消息到达最后一个接收者的延迟统计
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:
+            dict:延迟统计摘要，时间单位为毫秒
+        """
+        return self.__broadcastLatency.summary()
+
+# 获取连接数量
+    def connectionCount(self) -> int:
+        """返回当前已登录的客户端连接数量
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:
+            int:当前已登录的连接数量
+        """
+        return len(self.__sessionRegistry)
+
+# 获取会话信息
+    def getSessionInfo(self) -> List[dict]:
+        """返回全部在线用户的会话统计信息
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:
+            List[dict]:每个会话的昵称、登录时间、最近活动时间以及收发字节数
+        """
+        return [session.info() for session in self.__sessionRegistry.snapshot()]
+
+# 消息分发
+    def dispatchMessage(self, conn: 'socket', liveness: 'Liveness', messageDict: dict, size: int = 0) -> bool:
+        """消息分发函数，根据消息类型调用相应的处理函数，线程模式与asyncio模式共用此函数，
+        请求带有id时对该请求的回复中原样带回，exit请求的回复是服务端关闭连接，
+        请求者的身份取自该连接登录后的会话而不是消息中的source，尚未登录的连接只能发送login与exit
+
+        参数:
+            self:表明该函数是一个实例方法
+            conn(socket对象):发来该消息的客户端对应的连接
+            liveness(Liveness):该连接的活跃状态，用于找到该连接已登录的会话
+            messageDict(dict):解包后的消息字典
+            size(int):该消息在网络上的字节数，用于会话统计
+
+        返回值:
+            bool:False 表明客户端请求关闭连接，调用者应结束该连接的处理；True 表明继续处理
+        """
+    # 消息解包
+        messageType = messageDict['type']
+        messageDestination = messageDict['destination']
+        message = messageDict['data']
+        requestId = cd.getRequestId(messageDict)
+        session = self.authenticatedSession(liveness)
+
+    # 根据消息类型进行相应操作
+        if messageType == 'login':
+            nickname, status = self.identityVerification(message)
+            session = self.completeLogin(conn, messageDict, nickname, status, size)
+            if session is not None:
+                self.deliverMailbox(session, self.takeMailbox(nickname))
+            return True
+        if messageType == "exit":
+            if session is not None:
+                self.closeConnection(session.nickname, session)
+            return False
+        if session is None:
+            self.__metrics.increment("requests.unauthenticated")
+            return True
+        messageSource = session.nickname
+        session.recordIn(size)
+        if messageType == 'get':
+            self.sendOnlineUserInfo(messageSource, requestId)
+        elif messageType == 'public':
+            self.relayPublicMessage(messageSource, message, messageDestination)
+        elif messageType == 'private':
+            self.relayPrivateMessage(messageSource, messageDestination, message)
+        elif messageType == 'history':
+            self.sendMessage(messageSource, self.loadHistory(messageSource, messageDestination, message), requestId)
+        elif messageType == 'stats':
+            self.sendStats(session, requestId)
+        elif messageType == 'presence':
+            self.sendPresenceSnapshot(session)
+        elif messageType == 'join':
+            self.joinRoom(session, message, requestId)
+        elif messageType == 'leave':
+            self.leaveRoom(messageSource, message, requestId)
+        elif messageType == 'rooms':
+            self.sendRoomList(messageSource, message, requestId)
+        elif messageType == 'ping':
+            self.sendMessage(messageSource, {'source': None, 'destination': messageSource, 'type': "pong",
+                                             'data': message}, requestId)
+        return True
+
+# 获取已登录的会话
+    def authenticatedSession(self, liveness: 'Liveness') -> Union['Session', None]:
+        """返回该连接登录后仍在注册表中的会话，尚未登录或已被同名用户重新登录替换时返回None
+
+        参数:
+            self:表明该函数是一个实例方法
+            liveness(Liveness):该连接的活跃状态
+
+        返回值:
+            Union[Session, None]:该连接自己的会话
+        """
+        session = liveness.session
+        if session is None or self.__sessionRegistry.get(session.nickname) is not session:
+            return None
+        return session
+
 # 请求处理
     def requestProcess(self, conn: 'socket'):
         """请求处理函数，针对客户端发来的不同请求进行相应的处理
@@ -164,56 +1185,291 @@ class Server(object):
 
         返回值:None
         """
-        while True:
-            receiveData = conn.recv(1024).decode()
-            print(receiveData)
-            messageDict = json.loads(receiveData)
-
-        # 消息解包
-            messageType = messageDict['type']
-            messageSource = messageDict['source']
-            messageDestination = messageDict['destination']
-            message = messageDict['data']
-
-        # 根据消息类型进行相应操作
-            if messageType == 'login':
-                loginInfo = messageDict['data']
-                nickname, status = self.identityVerification(loginInfo)
-                self.__connectionDict.update({nickname: conn})
-                print(self.__connectionDict)
-                conn.send(str(status).encode())
-            elif messageType == 'get':
-                self.sendOnlineUserInfo(messageSource)
-            elif messageType == 'public':
-                self.relayPublicMessage(messageSource, message)
-            elif messageType == 'private':
-                self.relayPrivateMessage(messageSource, messageDestination, message)
-            elif messageType == "exit":
-                self.closeConnection(messageSource)
-                break
-            else:
-                continue
+        decoder = pt.FrameDecoder()
+        hb.enableKeepalive(conn)
+        ob.enableNoDelay(conn)
+        liveness = self.trackConnection(conn)
+        peer = self.peerAddress(conn)
+        isAlive = True
+        try:
+            while isAlive:
+                self.waitWritable(liveness)
+            # 数据直接读入该连接可复用的接收缓冲区，帧体是指向缓冲区的memoryview，在下一次读取之前处理完
+                try:
+                    frames = decoder.receiveInto(conn)
+                except OSError:
+                    break
+                except pt.FrameError as error:
+                    print("非法数据帧：{}".format(error))
+                    break
+                if frames is None:
+                    break
+                liveness.touch()
+            # 一次读取可能包含零个或多个完整的消息
+                for frame in frames:
+                    startTime = t.perf_counter()
+                    try:
+                        messageDict = self.decodeMessage(frame)
+                        self.validateRequest(messageDict)
+                    except MALFORMED_ERRORS:
+                        self.recordMalformed(pt.HEADER.size + len(frame))
+                        continue
+                    isAdmitted, waitTime = self.admitRequest(peer, liveness, messageDict)
+                    if not isAdmitted:
+                        continue
+                    if waitTime > 0:
+                        t.sleep(waitTime)
+                    try:
+                        isAlive = self.dispatchMessage(conn, liveness, messageDict, pt.HEADER.size + len(frame))
+                    except Exception:
+                        self.recordFailure(messageDict['type'])
+                        continue
+                    self.recordRequest(messageDict['type'], pt.HEADER.size + len(frame),
+                                       t.perf_counter() - startTime)
+                    if not isAlive:
+                        break
+        finally:
+            self.releaseConnection(liveness)
+        # 已登录连接的套接字由发送线程在队列关闭后关闭，未登录的连接在此关闭
+            if liveness.session is None:
+                conn.close()
 
         return None
 
+# 对端地址
+    def peerAddress(self, conn: 'socket') -> Union[str, None]:
+        """返回连接对端的IP地址，用作登录请求与未登录连接的限速对象，连接已断开时返回None
+
+        参数:
+            self:表明该函数是一个实例方法
+            conn(socket对象):客户端连接
+
+        返回值:
+            Union[str, None]:对端IP地址
+        """
+        try:
+            peerName = conn.getpeername()
+        except OSError:
+            return None
+        return peerName[0] if isinstance(peerName, tuple) else peerName
+
+# 请求限速
+    def admitRequest(self, peer: Union[str, None], liveness: 'Liveness', messageDict: dict) -> Tuple[bool, float]:
+        """在分发请求之前检查限速：login请求超出限速时延迟处理，预支的令牌达到上限后关闭该连接，
+        其他请求超出限速时被丢弃，并向客户端发送throttle通知，告知被限速的请求类型与建议的等待秒数，
+        带有请求id的请求正在被客户端等待，每次被丢弃都会收到带有该id的通知，
+        已登录连接的请求按昵称限速，login请求按所登录的昵称与对端地址限速，
+        同一地址(例如NAT之后)的不同用户互不影响，未登录连接的其他请求按对端地址限速，
+        令牌桶保存在限速器的注册表中，断开重连不会重置
+
+        参数:
+            self:表明该函数是一个实例方法
+            peer(Union[str, None]):该连接的对端地址，无法获取时以该连接代替
+            liveness(Liveness):该连接的活跃状态，用于找到已登录的会话
+            messageDict(dict):解包后的消息字典
+
+        返回值:
+            Tuple[bool, float]:是否处理该请求，以及处理之前需要等待的秒数
+        """
+        messageType = messageDict['type']
+        isLogin = messageType == 'login'
+        if not self.__rateLimiter.isEnabled():
+            return True, 0.0
+        peerKey = peer if peer is not None else id(liveness)
+        if isLogin:
+            loginInfo = messageDict['data']
+            rateKey = ("login", loginInfo.split(" ", 1)[0] if isinstance(loginInfo, str) else None, peerKey)
+        elif liveness.session is not None:
+            rateKey = ("user", liveness.session.nickname)
+        else:
+            rateKey = ("address", peerKey)
+        rateState = self.__rateLimiter.stateFor(rateKey)
+        if isLogin:
+            waitTime = self.__rateLimiter.reserve(rateState, messageType)
+            if waitTime == 0:
+                return True, 0.0
+            self.__metrics.increment("throttle.login")
+            if waitTime is not None:
+                return True, waitTime
+        # 预支已达上限，不再让该连接等待，直接关闭
+            self.__metrics.increment("throttle.loginRejected")
+            liveness.connection.close()
+            return False, 0.0
+        waitTime = self.__rateLimiter.check(rateState, messageType)
+        if waitTime == 0:
+            return True, 0.0
+        self.__metrics.increment("throttle." + (messageType if messageType in REQUEST_TYPES else "unknown"))
+        session = liveness.session
+        requestId = cd.getRequestId(messageDict)
+        if session is not None and (requestId is not None or self.__rateLimiter.shouldNotify(rateState, messageType)):
+            self.__metrics.increment("throttle.notices")
+            noticeDict = {'source': None, 'destination': session.nickname, 'type': "throttle",
+                          'data': {'request': messageType, 'retryAfter': round(waitTime, 3), 'reason': "rate"}}
+            if requestId is not None:
+                noticeDict['id'] = requestId
+            self.__deliverFrame(session, self.encodeFrame(noticeDict, session.codec, session.compression))
+        return False, waitTime
+
+# 等待发送队列回落
+    def waitWritable(self, liveness: 'Liveness'):
+        """连接的发送队列超过高水位时暂停读取该连接的请求，直到队列回落到低水位以下或被关闭，
+        暂停期间内核接收缓冲区被填满后客户端的发送会被TCP流量控制阻塞
+
+        参数:
+            self:表明该函数是一个实例方法
+            liveness(Liveness):该连接的活跃状态
+
+        返回值:None
+        """
+        session = liveness.session
+        if session is None or not session.queue.isBackpressured():
+            return None
+        startTime = t.perf_counter()
+        while session.queue.isBackpressured() and not session.queue.isClosed():
+            session.queue.waitWritable(1.0)
+        self.recordBackpressure(t.perf_counter() - startTime)
+        return None
+
+# 记录背压
+    def recordBackpressure(self, seconds: float):
+        """记录一次因发送队列超过高水位而暂停读取的时长"""
+        self.__metrics.increment("backpressure.pauses")
+        self.__metrics.record("backpressure.pause", seconds)
+        return None
+
+# 登记连接
+    def trackConnection(self, conn: 'socket') -> 'Liveness':
+        """将新建立的连接登记到空闲连接回收器，线程模式与asyncio模式在开始读取连接前调用
+
+        参数:
+            self:表明该函数是一个实例方法
+            conn(socket对象):客户端对应的连接
+
+        返回值:
+            Liveness:该连接的活跃状态，读取到数据时调用其touch方法
+        """
+        return self.__idleReaper.track(conn)
+
+# 释放连接
+    def releaseConnection(self, liveness: 'Liveness'):
+        """连接的读取结束时调用，客户端没有发送exit就断开时在此移除其会话，避免会话一直留在注册表中
+
+        参数:
+            self:表明该函数是一个实例方法
+            liveness(Liveness):该连接的活跃状态
+
+        返回值:None
+        """
+        self.__idleReaper.release(liveness)
+        session = liveness.session
+        if session is not None and self.__sessionRegistry.get(session.nickname) is session:
+            self.closeConnection(session.nickname, session)
+        return None
+
+# 检查空闲连接
+    def reapIdleConnections(self) -> int:
+        """推进空闲连接回收器的时间轮并处理到期的连接，asyncio模式在事件循环中每个刻度调用一次
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:
+            int:本次回收的连接数
+        """
+        return self.__idleReaper.tick()
+
+# 探测空闲连接
+    def probeConnection(self, liveness: 'Liveness'):
+        """向空闲的已登录连接发送ping，客户端回应pong或发送任何数据都会更新最近活动时间
+
+        参数:
+            self:表明该函数是一个实例方法
+            liveness(Liveness):该连接的活跃状态
+
+        返回值:None
+        """
+        session = liveness.session
+        self.__metrics.increment("heartbeat.probes")
+        self.__deliverFrame(session, self.encodeFrame({'source': None, 'destination': session.nickname,
+                                                       'type': "ping", 'data': None},
+                                                      session.codec, session.compression))
+        return None
+
+# 回收连接
+    def reapConnection(self, liveness: 'Liveness', reason: str):
+        """回收超时未登录或心跳无回应的连接：移除会话并中断连接的读取，使对应的线程或协程结束
+
+        参数:
+            self:表明该函数是一个实例方法
+            liveness(Liveness):该连接的活跃状态
+            reason(str):login 表示超时未登录；idle 表示心跳无回应
+
+        返回值:None
+        """
+        self.__metrics.increment("heartbeat.reaped." + reason)
+        session = liveness.session
+        if session is not None:
+            print("{}长时间没有回应，连接已被回收".format(session.nickname))
+            self.closeConnection(session.nickname, session)
+        self.abortConnection(liveness.connection)
+        return None
+
+# 中断连接
+    def abortConnection(self, conn: 'socket'):
+        """关闭连接的读写两个方向，阻塞在recv中的线程会立即返回
+
+        参数:
+            self:表明该函数是一个实例方法
+            conn(socket对象):客户端对应的连接
+
+        返回值:None
+        """
+        try:
+            conn.shutdown(sk.SHUT_RDWR)
+        except OSError:
+            pass
+        return None
+
+# 释放昵称id
+    def releaseNickname(self, nickname: str):
+        """用户下线时从驻留表中释放其id，并通知使用二进制编码的客户端不再使用该id，
+        驻留表因此只包含在线用户，登录回复中下发的映射与在线人数成正比
+
+        参数:
+            self:表明该函数是一个实例方法
+            nickname(str):下线用户的昵称
+
+        返回值:None
+        """
+        userId = self.__internTable.release(nickname)
+        if userId is not None:
+            internDict = {'source': None, 'destination': None, 'type': "intern", 'data': [[userId, None]]}
+            self.__broadcast([session for session in self.__sessionRegistry.snapshot()
+                              if session.codec == cd.CODEC_BINARY], internDict, tracked=False)
+        return None
+
 # 关闭客户端连接
-    def closeConnection(self, sourceUser: str):
+    def closeConnection(self, sourceUser: str, session: 'Session' = None):
         """用于关闭服务端与客户端的连接，当客户端发来关闭连接的请求时调用此函数
 
         参数:
             self:表明该函数是一个实例方法
             sourceUser(str):消息发送者的昵称
+            session(Session):指定时只关闭该会话，避免误关同名用户重新登录后的新连接
 
         返回值:None
         """
-        try:
-            conn = self.__connectionDict.pop(sourceUser)
-            print("与{}的连接已被关闭".format(sourceUser))
-            conn.close()
-        except KeyError:
+        session = self.__sessionRegistry.remove(sourceUser, session)
+        if session is None:
             print("连接已关闭")
-        finally:
-            print("剩余连接的个数：{}\n{}".format(len(self.__connectionDict), self.__connectionDict))
+        else:
+            print("与{}的连接已被关闭".format(sourceUser))
+            session.queue.close()
+            self.leaveAllRooms(sourceUser)
+            self.releaseNickname(sourceUser)
+            if self.__shardBus is not None:
+                self.__shardBus.publish({'kind': "leave", 'nickname': sourceUser})
+        print("剩余连接的个数：{}".format(len(self.__sessionRegistry)))
         return None
 
 
@@ -229,6 +1485,11 @@ class Server(object):
         self.__isClosed = True
         t.sleep(1)
         self.__listenSocket.close()
+        if self.__outboundWriter is not None:
+            print("群发延迟统计：{}".format(self.getBroadcastLatency()))
+            print("发送合并统计：{}".format(self.getOutboundStats()))
+            self.__outboundWriter.stop()
+        self.stopServices()
         return None
 
 
@@ -273,9 +1534,111 @@ class Server(object):
         return 0
 
 
+# 解析启动参数
+def parseArguments(argv: List[str] = None) -> argparse.Namespace:
+    """用于解析服务端的启动参数
+
+    参数:
+        argv(List[str]):命令行参数列表，为None时使用sys.argv
+
+    返回值:
+        Namespace:解析后的参数对象
+    """
+    parser = argparse.ArgumentParser(description="在线聊天室服务端")
+    parser.add_argument("--mode", choices=("threaded", "asyncio"), default="threaded",
+                        help="服务模式：threaded 每个连接一个线程；asyncio 所有连接运行在同一个事件循环中")
+    parser.add_argument("--ip", default="127.0.0.1", help="服务端监听的IP地址")
+    parser.add_argument("--port", type=int, default=50000, help="服务端监听的端口号")
+    parser.add_argument("--slow-policy", dest="slowPolicy", choices=(ob.POLICY_DROP, ob.POLICY_LAG),
+                        default=ob.POLICY_DROP, help="慢消费者处理策略：drop 断开连接；lag 标记为滞后并丢弃消息")
+    parser.add_argument("--storage", choices=tuple(sb.BACKENDS.keys()), default="mysql",
+                        help="存储后端：mysql 使用MySQL服务器；sqlite 使用嵌入式SQLite数据库文件")
+    parser.add_argument("--db-path", dest="dbPath", default="chatroom.db", help="SQLite数据库文件路径")
+    parser.add_argument("--db-host", dest="dbHost", default="localhost", help="MySQL服务器地址")
+    parser.add_argument("--db-port", dest="dbPort", type=int, default=3306, help="MySQL服务器端口")
+    parser.add_argument("--db-user", dest="dbUser", default=None, help="MySQL用户名")
+    parser.add_argument("--db-password", dest="dbPassword", default=None, help="MySQL密码")
+    parser.add_argument("--db-name", dest="dbName", default=None, help="MySQL数据库名")
+    parser.add_argument("--db-table", dest="dbTable", default=None, help="用户数据表名，SQLite默认为users")
+    parser.add_argument("--compression-threshold", dest="compressionThreshold", type=int,
+                        default=cz.COMPRESSION_THRESHOLD, help="协商了压缩的连接上，帧体不小于该字节数时进行压缩")
+    parser.add_argument("--no-compression", dest="compression", action="store_false",
+                        help="不接受客户端的压缩协商")
+    parser.add_argument("--admin-users", dest="adminUsers", default="",
+                        help="允许发送stats请求获取统计信息的用户昵称，以逗号分隔")
+    parser.add_argument("--metrics-interval", dest="metricsInterval", type=float, default=60,
+                        help="定期输出指标的间隔秒数，0表示不输出")
+    parser.add_argument("--idle-timeout", dest="idleTimeout", type=float, default=hb.IDLE_TIMEOUT,
+                        help="支持心跳的连接空闲该秒数后发送ping探测")
+    parser.add_argument("--probe-timeout", dest="probeTimeout", type=float, default=hb.PROBE_TIMEOUT,
+                        help="发送ping后在该秒数内没有回应则回收连接")
+    parser.add_argument("--login-timeout", dest="loginTimeout", type=float, default=hb.LOGIN_TIMEOUT,
+                        help="建立连接后在该秒数内没有完成登录则回收连接")
+    parser.add_argument("--rate-limits", dest="rateLimits", type=rl.parseRateLimits, default=None,
+                        help="每个连接的限速，格式为 类型=每秒令牌数/容量，以逗号分隔，*表示全部请求，none表示不限速")
+    parser.add_argument("--mailbox-size", dest="mailboxSize", type=int, default=mb.MAILBOX_SIZE,
+                        help="每个用户的离线信箱最多保存的消息数，信箱已满时丢弃新消息")
+    parser.add_argument("--mailbox-memory", dest="mailboxMemory", type=int, default=mb.MAILBOX_MEMORY,
+                        help="离线信箱在内存中占用的字节数上限，超过后将最大的信箱转存到数据库")
+    parser.add_argument("--flush-delay", dest="flushDelay", type=float, default=ob.FLUSH_DELAY * 1000,
+                        help="发送队列合并发送的延迟预算(毫秒)，0表示有数据时立即发送")
+    parser.add_argument("--write-batch", dest="writeBatch", type=int, default=ob.WRITE_BATCH,
+                        help="线程模式下单次sendmsg最多发送的帧数，1表示每帧一次系统调用")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="工作进程数，大于1时各进程通过SO_REUSEPORT共用端口，跨进程的消息经分片总线转发")
+    parser.add_argument("--shard-id", dest="shardId", type=int, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--shard-count", dest="shardCount", type=int, default=1, help=argparse.SUPPRESS)
+    parser.add_argument("--bus-dir", dest="busDir", default=None, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+# 创建服务端
+def createServer(arguments: argparse.Namespace) -> 'Server':
+    """根据启动参数创建对应模式的服务端对象
+
+    参数:
+        arguments(Namespace):解析后的启动参数
+
+    返回值:
+        Server:线程模式返回Server对象，asyncio模式返回AsyncServer对象
+    """
+    if arguments.storage == "sqlite":
+        backend = sb.createBackend("sqlite", path=arguments.dbPath, table=arguments.dbTable or "users")
+    else:
+        backend = sb.createBackend("mysql", host=arguments.dbHost, port=arguments.dbPort, user=arguments.dbUser,
+                                   password=arguments.dbPassword, database=arguments.dbName, table=arguments.dbTable)
+    databaseUtils = do.DatabaseUtils(backend=backend)
+    compressionThreshold = arguments.compressionThreshold if arguments.compression else None
+    adminUsers = [nickname for nickname in arguments.adminUsers.split(",") if nickname]
+    shardBus = None
+    if arguments.shardId is not None:
+        shardBus = bus.ShardBus(arguments.shardId, arguments.shardCount, arguments.busDir)
+    if arguments.mode == "asyncio":
+        import AsyncServer as asv
+        return asv.AsyncServer(ip=arguments.ip, port=arguments.port, slowConsumerPolicy=arguments.slowPolicy,
+                               databaseUtils=databaseUtils, compressionThreshold=compressionThreshold,
+                               adminUsers=adminUsers, metricsInterval=arguments.metricsInterval,
+                               reusePort=shardBus is not None, shardBus=shardBus, idleTimeout=arguments.idleTimeout,
+                               probeTimeout=arguments.probeTimeout, loginTimeout=arguments.loginTimeout,
+                               rateLimits=arguments.rateLimits, mailboxSize=arguments.mailboxSize,
+                               mailboxMemory=arguments.mailboxMemory, flushDelay=arguments.flushDelay / 1000,
+                               writeBatch=arguments.writeBatch)
+    return Server(ip=arguments.ip, port=arguments.port, slowConsumerPolicy=arguments.slowPolicy,
+                  databaseUtils=databaseUtils, compressionThreshold=compressionThreshold,
+                  adminUsers=adminUsers, metricsInterval=arguments.metricsInterval,
+                  reusePort=shardBus is not None, shardBus=shardBus, idleTimeout=arguments.idleTimeout,
+                  probeTimeout=arguments.probeTimeout, loginTimeout=arguments.loginTimeout,
+                  rateLimits=arguments.rateLimits, mailboxSize=arguments.mailboxSize,
+                  mailboxMemory=arguments.mailboxMemory, flushDelay=arguments.flushDelay / 1000,
+                  writeBatch=arguments.writeBatch)
+
+
 # 运行程序
 if __name__ == "__main__":
-    server = Server()
+    arguments = parseArguments()
+    if arguments.workers > 1 and arguments.shardId is None:
+        sys.exit(bus.runWorkers(__file__, sys.argv[1:], arguments.workers))
+    server = createServer(arguments)
     server.startServer()
     try:
         server.main()
@@ -0,0 +1,137 @@
+import socket as sk
+import subprocess as sp
+import time as t
+import json
+import os
+import sys
+import argparse
+from typing import List, Dict
+from Server import raiseFileLimit
+
+
+# 读取进程状态
+def readProcessStatus(pid: int) -> Dict[str, int]:
+    """读取Linux下/proc/<pid>/status中的常驻内存与线程数
+
+    参数:
+        pid(int):被测服务端进程的进程号
+
+    返回值:
+        Dict[str, int]:rssKB为常驻内存大小(KB)，threads为线程数
+    """
+    status = {'rssKB': -1, 'threads': -1}
+    try:
+        with open("/proc/{}/status".format(pid)) as statusFile:
+            for line in statusFile:
+                if line.startswith("VmRSS:"):
+                    status['rssKB'] = int(line.split()[1])
+                elif line.startswith("Threads:"):
+                    status['threads'] = int(line.split()[1])
+    except FileNotFoundError:
+        pass
+    return status
+
+
+# 启动被测服务端
+def startServerProcess(mode: str, port: int, extraArguments: List[str] = ()) -> 'Popen':
+    """以子进程方式启动指定模式的服务端，并等待其开始监听
+
+    参数:
+        mode(str):服务模式，threaded 或 asyncio
+        port(int):服务端监听的端口号
+        extraArguments(List[str]):传给服务端的其他启动参数
+
+    返回值:
+        Popen:服务端子进程对象
+    """
+    serverPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Server.py")
+    process = sp.Popen([sys.executable, serverPath, "--mode", mode, "--port", str(port)] + list(extraArguments),
+                       cwd=os.path.dirname(serverPath), stdout=sp.DEVNULL, stderr=sp.DEVNULL)
+    deadline = t.time() + 10
+    while t.time() < deadline:
+        try:
+            sk.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process
+        except OSError:
+            t.sleep(0.1)
+    process.kill()
+    raise RuntimeError("服务端启动超时")
+
+
+# 单个模式的测试
+def benchmarkMode(mode: str, port: int, connections: int, step: int) -> List[Dict[str, int]]:
+    """对一种服务模式建立大量空闲连接，每建立step个连接记录一次服务端的内存和线程数
+
+    参数:
+        mode(str):服务模式，threaded 或 asyncio
+        port(int):服务端监听的端口号
+        connections(int):需要建立的空闲连接总数
+        step(int):采样间隔(连接数)
+
+    返回值:
+        List[Dict[str, int]]:每个采样点的连接数、常驻内存和线程数
+    """
+    process = startServerProcess(mode, port)
+    samples = []
+    sockets = []
+    try:
+        t.sleep(0.5)
+        samples.append(dict(connections=0, **readProcessStatus(process.pid)))
+        while len(sockets) < connections:
+            try:
+                sockets.append(sk.create_connection(('127.0.0.1', port), timeout=5))
+            except OSError as error:
+                print("{}模式在第{}个连接处失败：{}".format(mode, len(sockets) + 1, error))
+                break
+            if len(sockets) % step == 0:
+            # 等待服务端完成accept后再采样
+                t.sleep(0.5)
+                samples.append(dict(connections=len(sockets), **readProcessStatus(process.pid)))
+        if len(sockets) % step != 0:
+            t.sleep(0.5)
+            samples.append(dict(connections=len(sockets), **readProcessStatus(process.pid)))
+    finally:
+        for sock in sockets:
+            sock.close()
+        process.kill()
+        process.wait()
+    return samples
+
+
+# 主函数
+def main(argv: List[str] = None) -> int:
+    """依次测试线程模式与asyncio模式，输出空闲连接数与服务端内存、线程数的对比
+
+    参数:
+        argv(List[str]):命令行参数列表，为None时使用sys.argv
+
+    返回值:
+        int:返回数字0表明程序正常执行结束
+    """
+    parser = argparse.ArgumentParser(description="线程模式与asyncio模式的空闲连接对比测试")
+    parser.add_argument("--connections", type=int, default=10000, help="每种模式建立的空闲连接数")
+    parser.add_argument("--step", type=int, default=1000, help="采样间隔(连接数)")
+    parser.add_argument("--port", type=int, default=61000, help="被测服务端使用的端口号")
+    parser.add_argument("--modes", default="threaded,asyncio", help="需要测试的模式，以逗号分隔")
+    parser.add_argument("--json", dest="jsonPath", default=None, help="将结果以JSON格式写入该文件")
+    arguments = parser.parse_args(argv)
+    raiseFileLimit()
+
+    results = {}
+    for index, mode in enumerate(arguments.modes.split(",")):
+        results[mode] = benchmarkMode(mode, arguments.port + index, arguments.connections, arguments.step)
+
+    print("{:<10}{:>12}{:>14}{:>10}".format("mode", "connections", "rss(KB)", "threads"))
+    for mode, samples in results.items():
+        for sample in samples:
+            print("{:<10}{:>12}{:>14}{:>10}".format(mode, sample['connections'], sample['rssKB'], sample['threads']))
+
+    if arguments.jsonPath is not None:
+        with open(arguments.jsonPath, "w") as jsonFile:
+            json.dump(results, jsonFile, indent=2)
+    return 0
+
+
+# 运行程序
+if __name__ == "__main__":
+    sys.exit(main())
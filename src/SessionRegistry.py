@@ -0,0 +1,307 @@
+import threading as td
+import time as t
+from typing import Callable, Dict, List, Tuple, Union
+
+
+class Session(object):
+    """会话类，记录一个已登录用户的连接、发送队列以及统计信息
+
+    属性:
+        nickname(str):用户昵称
+        queue(OutboundQueue):该用户连接的发送队列
+        codec(str):登录时协商的消息编码
+        compression(str):登录时协商的压缩方式，None表示不压缩
+        presence(bool):是否订阅在线用户的增量推送
+        loginTime(float):登录时间
+        lastActivity(float):最近一次收到该用户消息的时间
+        bytesIn(int):累计收到该用户的字节数
+        bytesOut(int):累计发往该用户的字节数
+    """
+
+# 构造函数
+    def __init__(self, nickname: str, queue: 'OutboundQueue', codec: str = "json", compression: str = None,
+                 presence: bool = False):
+        """构造函数，用于会话对象初始化"""
+        self.nickname = nickname
+        self.queue = queue
+        self.codec = codec
+        self.compression = compression
+        self.presence = presence
+        self.loginTime = t.time()
+        self.lastActivity = self.loginTime
+        self.bytesIn = 0
+        self.bytesOut = 0
+        self.__lock = td.Lock()
+
+# 记录收到的数据
+    def recordIn(self, size: int):
+        """记录收到该用户的一条消息
+
+        参数:
+            self:表明该函数是一个实例方法
+            size(int):消息的字节数
+
+        返回值:None
+        """
+        with self.__lock:
+            self.bytesIn += size
+            self.lastActivity = t.time()
+        return None
+
+# 发送一帧
+    def push(self, frame: bytes, tracker: 'BroadcastTracker' = None) -> bool:
+        """将一帧放入该用户的发送队列并记录发送字节数
+
+        参数:
+            self:表明该函数是一个实例方法
+            frame(bytes):已经编码好的帧
+            tracker(BroadcastTracker):群发跟踪对象，单发时为None
+
+        返回值:
+            bool:True 表明已放入队列；False 表明队列已满或已关闭
+        """
+        accepted = self.queue.push(frame, tracker)
+        if accepted:
+            with self.__lock:
+                self.bytesOut += len(frame)
+        return accepted
+
+# 获取会话信息
+    def info(self) -> Dict[str, Union[str, int, float, bool]]:
+        """返回会话的统计信息
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:
+            Dict:包含昵称、编码、压缩方式、登录时间、最近活动时间、收发字节数以及是否滞后
+        """
+        with self.__lock:
+            return {'nickname': self.nickname, 'codec': self.codec, 'compression': self.compression,
+                    'loginTime': self.loginTime, 'lastActivity': self.lastActivity,
+                    'bytesIn': self.bytesIn, 'bytesOut': self.bytesOut, 'isLagging': self.queue.isLagging()}
+
+
+class SessionRegistry(object):
+    """会话注册表类，以昵称为索引保存所有已登录用户的会话，查找为O(1)，
+    遍历时使用只读快照，快照只在会话增减时重建，遍历期间其他线程增删会话不会产生影响，
+    在线用户集合每次变化时版本号加一，并在释放锁后通知监听函数，
+    多进程模式下在线用户集合还包括其他分片上登录的用户，这些用户只记录所在的分片
+
+    属性:
+        sessions(dict):昵称到会话对象的映射
+        remote(dict):其他分片上在线用户的昵称到分片编号的映射
+        snapshot(tuple):当前全部会话的只读快照，会话增减时置为None
+        version(int):在线用户集合的版本号
+        presence(tuple):版本号与在线昵称组成的缓存，在线用户集合变化时置为None
+        onChange(Callable):在线用户集合变化时调用的函数，参数为join或leave、昵称以及变化后的版本号
+        lock(RLock):保护注册表的锁
+    """
+
+# 构造函数
+    def __init__(self, onChange: Callable[[str, str, int], None] = None):
+        """构造函数，用于会话注册表对象初始化"""
+        self.__sessions = {}
+        self.__remote = {}
+        self.__snapshot = ()
+        self.__version = 0
+        self.__presence = None
+        self.__onChange = onChange
+        self.__lock = td.RLock()
+
+# 添加会话
+    def add(self, session: 'Session') -> Union['Session', None]:
+        """添加一个会话，昵称已存在时替换原有会话
+
+        参数:
+            self:表明该函数是一个实例方法
+            session(Session):新登录用户的会话
+
+        返回值:
+            Session:被替换的原有会话，None表示该昵称此前不存在
+        """
+        with self.__lock:
+            oldSession = self.__sessions.get(session.nickname)
+        # 同名用户重新登录或该用户已在其他分片登录时在线用户集合不变
+            wasOnline = oldSession is not None or session.nickname in self.__remote
+            self.__sessions[session.nickname] = session
+            self.__snapshot = None
+            version = self.__bumpVersion() if not wasOnline else None
+        self.__notify("join", session.nickname, version)
+        return oldSession
+
+# 移除会话
+    def remove(self, nickname: str, session: 'Session' = None) -> Union['Session', None]:
+        """移除一个会话，指定session时只有当前注册的会话就是它时才移除，避免误删重新登录的新会话
+
+        参数:
+            self:表明该函数是一个实例方法
+            nickname(str):用户昵称
+            session(Session):期望移除的会话对象
+
+        返回值:
+            Session:被移除的会话，None表示没有会话被移除
+        """
+        with self.__lock:
+            current = self.__sessions.get(nickname)
+            if current is None or (session is not None and current is not session):
+                return None
+            del self.__sessions[nickname]
+            self.__snapshot = None
+            version = self.__bumpVersion() if nickname not in self.__remote else None
+        self.__notify("leave", nickname, version)
+        return current
+
+# 添加其他分片的用户
+    def addRemote(self, nickname: str, shard: int):
+        """记录在其他分片上登录的用户
+
+        参数:
+            self:表明该函数是一个实例方法
+            nickname(str):用户昵称
+            shard(int):该用户所在的分片编号
+
+        返回值:None
+        """
+        with self.__lock:
+            wasOnline = nickname in self.__sessions or nickname in self.__remote
+            self.__remote[nickname] = shard
+            version = self.__bumpVersion() if not wasOnline else None
+        self.__notify("join", nickname, version)
+        return None
+
+# 移除其他分片的用户
+    def removeRemote(self, nickname: str, shard: int = None) -> bool:
+        """移除在其他分片上登录的用户，指定shard时只有该用户仍记录在这个分片上才移除
+
+        参数:
+            self:表明该函数是一个实例方法
+            nickname(str):用户昵称
+            shard(int):期望移除的分片编号
+
+        返回值:
+            bool:True 表明已移除；False 表明没有记录被移除
+        """
+        with self.__lock:
+            current = self.__remote.get(nickname)
+            if current is None or (shard is not None and current != shard):
+                return False
+            del self.__remote[nickname]
+            version = self.__bumpVersion() if nickname not in self.__sessions else None
+        self.__notify("leave", nickname, version)
+        return True
+
+# 移除一个分片的全部用户
+    def removeShard(self, shard: int) -> List[str]:
+        """分片退出时移除记录在该分片上的全部用户
+
+        参数:
+            self:表明该函数是一个实例方法
+            shard(int):分片编号
+
+        返回值:
+            List[str]:被移除的用户昵称
+        """
+        with self.__lock:
+            nicknames = [nickname for nickname, current in self.__remote.items() if current == shard]
+        return [nickname for nickname in nicknames if self.removeRemote(nickname, shard)]
+
+# 查找用户所在分片
+    def remoteShard(self, nickname: str) -> Union[int, None]:
+        """返回在其他分片上登录的用户所在的分片编号
+
+        参数:
+            self:表明该函数是一个实例方法
+            nickname(str):用户昵称
+
+        返回值:
+            int:分片编号，None表示该用户不在其他分片上
+        """
+        return self.__remote.get(nickname)
+
+# 更新版本号
+    def __bumpVersion(self) -> int:
+        """在线用户集合发生变化时调用，调用者需持有锁"""
+        self.__version += 1
+        self.__presence = None
+        return self.__version
+
+# 通知监听函数
+    def __notify(self, change: str, nickname: str, version: Union[int, None]):
+        """在释放锁之后通知监听函数，version为None表示在线用户集合没有变化"""
+        if version is not None and self.__onChange is not None:
+            self.__onChange(change, nickname, version)
+        return None
+
+# 查找会话
+    def get(self, nickname: str) -> Union['Session', None]:
+        """根据昵称查找会话
+
+        参数:
+            self:表明该函数是一个实例方法
+            nickname(str):用户昵称
+
+        返回值:
+            Session:对应的会话，None表示该用户不在线
+        """
+        return self.__sessions.get(nickname)
+
+# 获取快照
+    def snapshot(self) -> Tuple['Session', ...]:
+        """返回当前全部会话的只读快照，可在不持有锁的情况下安全遍历
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:
+            Tuple[Session, ...]:全部会话组成的元组
+        """
+        snapshot = self.__snapshot
+        if snapshot is None:
+            with self.__lock:
+                if self.__snapshot is None:
+                    self.__snapshot = tuple(self.__sessions.values())
+                snapshot = self.__snapshot
+        return snapshot
+
+# 获取在线昵称
+    def nicknames(self) -> List[str]:
+        """返回全部在线用户的昵称
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:
+            List[str]:在线用户昵称列表
+        """
+        return [session.nickname for session in self.snapshot()]
+
+# 获取在线用户集合
+    def presence(self) -> Tuple[int, Tuple[str, ...]]:
+        """返回在线用户集合的版本号与全部在线昵称(包括其他分片上的用户)，两者在同一次加锁中读取，保证一致，
+        结果会被缓存，直到在线用户集合发生变化
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:
+            Tuple[int, Tuple[str, ...]]:版本号与在线昵称
+        """
+        presence = self.__presence
+        if presence is None:
+            with self.__lock:
+                if self.__presence is None:
+                    self.__presence = (self.__version, tuple(self.__sessions.keys()) + tuple(
+                        nickname for nickname in self.__remote if nickname not in self.__sessions))
+                presence = self.__presence
+        return presence
+
+# 会话数量
+    def __len__(self) -> int:
+        """返回当前会话数量"""
+        return len(self.__sessions)
+
+# 是否在线
+    def __contains__(self, nickname: str) -> bool:
+        """判断用户是否在线"""
+        return nickname in self.__sessions
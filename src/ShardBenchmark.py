@@ -0,0 +1,113 @@
+import subprocess as sp
+import tempfile
+import json
+import os
+import sys
+import argparse
+from typing import List, Dict, Union
+from Server import raiseFileLimit
+from ServerModeBenchmark import startServerProcess
+
+
+# 单个工作进程数的测试
+def benchmarkWorkers(arguments: argparse.Namespace, workers: int, port: int) -> Dict[str, Union[int, float]]:
+    """以指定的工作进程数启动服务端，同时运行多个LoadBenchmark进程连接该服务端，汇总各进程的吞吐量，
+    负载由多个进程产生，避免单个客户端进程成为瓶颈
+
+    参数:
+        arguments(Namespace):解析后的命令行参数
+        workers(int):服务端的工作进程数
+        port(int):服务端监听的端口号
+
+    返回值:
+        Dict:工作进程数、发送与送达的消息数、每秒送达数、丢失数以及各进程私聊延迟的最大p99
+    """
+    directory = tempfile.mkdtemp(prefix="shardbench-")
+    dbPath = os.path.join(directory, "chatroom.db")
+    loadPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), "LoadBenchmark.py")
+    server = startServerProcess(arguments.mode, port, ["--workers", str(workers), "--storage", "sqlite",
+                                                       "--db-path", dbPath, "--metrics-interval", "0",
+                                                       "--rate-limits", "none"])
+    results = []
+    try:
+        clients = []
+        for index in range(arguments.clients):
+            jsonPath = os.path.join(directory, "client-{}.json".format(index))
+            clients.append((jsonPath, sp.Popen(
+                [sys.executable, loadPath, "--mode", "external", "--port", str(port),
+                 "--users", str(arguments.users), "--rate", str(arguments.rate),
+                 "--duration", str(arguments.duration), "--mix", arguments.mix, "--size", str(arguments.size),
+                 "--prefix", "w{}c{}u".format(workers, index), "--seed", str(index + 1), "--json", jsonPath],
+                stdout=sp.DEVNULL, stderr=sp.DEVNULL)))
+        for jsonPath, client in clients:
+            client.wait()
+            if os.path.exists(jsonPath):
+                with open(jsonPath) as jsonFile:
+                    results.append(json.load(jsonFile))
+    finally:
+    # 多进程模式下主进程收到SIGTERM后才会结束并清理工作进程
+        server.terminate()
+        server.wait()
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+
+    return {'workers': workers, 'clients': len(results),
+            'sent': sum(sum(result['throughput']['sent'].values()) for result in results),
+            'deliveries': sum(result['throughput']['deliveries'] for result in results),
+            'deliveriesPerSecond': sum(result['throughput']['deliveriesPerSecond'] for result in results),
+            'lost': sum(result['errors']['lost'] for result in results),
+            'privateP99Ms': max((result['latency']['private']['p99Ms'] for result in results), default=0.0)}
+
+
+# 主函数
+def main(argv: List[str] = None) -> int:
+    """依次以不同的工作进程数启动服务端并施加相同的负载，输出每秒送达数、相对单进程的加速比与扩展效率
+
+    参数:
+        argv(List[str]):命令行参数列表，为None时使用sys.argv
+
+    返回值:
+        int:返回数字0表明程序正常执行结束
+    """
+    parser = argparse.ArgumentParser(description="多进程分片服务端的扩展性测试")
+    parser.add_argument("--workers", default="1,2,4", help="需要测试的工作进程数，以逗号分隔")
+    parser.add_argument("--clients", type=int, default=4, help="同时运行的负载测试进程数")
+    parser.add_argument("--users", type=int, default=50, help="每个负载测试进程的模拟用户数")
+    parser.add_argument("--rate", type=float, default=500, help="每个负载测试进程每秒发送的消息数")
+    parser.add_argument("--duration", type=float, default=10, help="发送阶段持续的秒数")
+    parser.add_argument("--mix", default="public=0,private=9,get=1", help="各类消息的比例")
+    parser.add_argument("--size", type=int, default=32, help="聊天消息内容的填充字节数")
+    parser.add_argument("--mode", choices=("threaded", "asyncio"), default="asyncio", help="工作进程的服务模式")
+    parser.add_argument("--port", type=int, default=61300, help="被测服务端使用的端口号")
+    parser.add_argument("--json", dest="jsonPath", default=None, help="将结果以JSON格式写入该文件")
+    arguments = parser.parse_args(argv)
+    raiseFileLimit()
+
+    results = []
+    for index, workers in enumerate(int(value) for value in arguments.workers.split(",")):
+        results.append(benchmarkWorkers(arguments, workers, arguments.port + index))
+
+# 加速比以第一个工作进程数为基准，扩展效率为加速比与进程数倍数之比
+    base = results[0]
+    for result in results:
+        result['speedup'] = (result['deliveriesPerSecond'] / base['deliveriesPerSecond']
+                             if base['deliveriesPerSecond'] > 0 else 0.0)
+        result['efficiency'] = result['speedup'] / (result['workers'] / base['workers'])
+
+    print("{:<9}{:>12}{:>14}{:>9}{:>12}{:>8}{:>12}".format("workers", "deliveries", "deliveries/s", "speedup",
+                                                           "efficiency", "lost", "p99(ms)"))
+    for result in results:
+        print("{:<9}{:>12}{:>14.1f}{:>9.2f}{:>12.2f}{:>8}{:>12.2f}".format(
+            result['workers'], result['deliveries'], result['deliveriesPerSecond'], result['speedup'],
+            result['efficiency'], result['lost'], result['privateP99Ms']))
+
+    if arguments.jsonPath is not None:
+        with open(arguments.jsonPath, "w") as jsonFile:
+            json.dump(results, jsonFile, indent=2)
+    return 0
+
+
+# 运行程序
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,254 @@
+import socket as sk
+import selectors as sl
+import subprocess as sp
+import threading as td
+import time as t
+import json
+import os
+import sys
+import signal
+import queue
+import tempfile
+from typing import Callable, Dict, List
+import Protocol as pt
+
+# 分片之间的套接字文件名
+SOCKET_NAME = "shard-{}.sock"
+# 连接其他分片的最长等待时间(秒)
+CONNECT_TIMEOUT = 10
+
+
+class ShardBus(object):
+    """分片总线类，多进程模式下每个工作进程(分片)持有一个总线对象，分片之间通过Unix域套接字两两相连，
+    每个分片监听自己的套接字接收其他分片发来的消息，并通过到其他分片的连接发送消息，
+    消息为带长度前缀的JSON帧，发送由单独的线程完成，publish不会阻塞调用者
+
+    属性:
+        shardId(int):本分片的编号
+        shardCount(int):分片总数
+        directory(str):套接字文件所在的目录
+        onMessage(Callable):收到其他分片的消息时调用的函数，在接收线程中调用
+        peers(dict):分片编号到发往该分片的连接的映射
+        outbox(Queue):等待发送的(目标分片列表, 帧)
+        stats(dict):发送、接收与丢弃的消息数
+    """
+
+# 构造函数
+    def __init__(self, shardId: int, shardCount: int, directory: str):
+        """构造函数，用于分片总线对象初始化"""
+        self.__shardId = shardId
+        self.__shardCount = shardCount
+        self.__directory = directory
+        self.__onMessage = None
+        self.__peers = {}
+        self.__outbox = queue.Queue()
+        self.__listenSocket = None
+        self.__selector = sl.DefaultSelector()
+        self.__isRunning = False
+        self.__threads = []
+        self.__stats = {'sent': 0, 'received': 0, 'dropped': 0}
+
+# 分片编号
+    def shardId(self) -> int:
+        """返回本分片的编号"""
+        return self.__shardId
+
+# 启动
+    def start(self, onMessage: Callable[[dict], None]):
+        """监听本分片的套接字，并启动接收、发送与连接其他分片的线程
+
+        参数:
+            self:表明该函数是一个实例方法
+            onMessage(Callable):收到其他分片的消息时调用的函数
+
+        返回值:None
+        """
+        self.__onMessage = onMessage
+        path = os.path.join(self.__directory, SOCKET_NAME.format(self.__shardId))
+        if os.path.exists(path):
+            os.remove(path)
+        self.__listenSocket = sk.socket(sk.AF_UNIX, sk.SOCK_STREAM)
+        self.__listenSocket.bind(path)
+        self.__listenSocket.listen(self.__shardCount)
+        self.__listenSocket.setblocking(False)
+        self.__selector.register(self.__listenSocket, sl.EVENT_READ, None)
+        self.__isRunning = True
+        for target, name in ((self.__receiveLoop, "ShardBusReceiver"), (self.__sendLoop, "ShardBusSender"),
+                             (self.__connectPeers, "ShardBusConnector")):
+            thread = td.Thread(target=target, name=name, daemon=True)
+            thread.start()
+            self.__threads.append(thread)
+        return None
+
+# 连接其他分片
+    def __connectPeers(self):
+        """连接全部其他分片，每连上一个分片就在本地分发一条connected消息，
+        由服务端通过新连接发送hello消息告知对方本分片的在线用户"""
+        deadline = t.time() + CONNECT_TIMEOUT
+        pending = [shard for shard in range(self.__shardCount) if shard != self.__shardId]
+        while pending and self.__isRunning and t.time() < deadline:
+            for shard in list(pending):
+                connection = sk.socket(sk.AF_UNIX, sk.SOCK_STREAM)
+                try:
+                    connection.connect(os.path.join(self.__directory, SOCKET_NAME.format(shard)))
+                except OSError:
+                    connection.close()
+                    continue
+                self.__peers[shard] = connection
+                pending.remove(shard)
+                self.__dispatch({'kind': "connected", 'shard': shard})
+            if pending:
+                t.sleep(0.05)
+        for shard in pending:
+            print("分片{}无法连接分片{}".format(self.__shardId, shard))
+        return None
+
+# 发布消息
+    def publish(self, message: dict, shard: int = None):
+        """将消息发送给指定分片，shard为None时发送给全部其他分片，消息中会加入本分片的编号
+
+        参数:
+            self:表明该函数是一个实例方法
+            message(dict):消息字典
+            shard(int):目标分片编号
+
+        返回值:None
+        """
+        message['shard'] = self.__shardId
+        targets = [shard] if shard is not None else [peer for peer in range(self.__shardCount)
+                                                      if peer != self.__shardId]
+        self.__outbox.put((targets, pt.packFrame(json.dumps(message).encode())))
+        return None
+
+# 发送循环
+    def __sendLoop(self):
+        """发送线程主体，按顺序将帧写入到目标分片的连接，尚未连接的分片的消息被丢弃"""
+        while True:
+            item = self.__outbox.get()
+            if item is None:
+                return None
+            targets, frame = item
+            for shard in targets:
+                connection = self.__peers.get(shard)
+                if connection is None:
+                    self.__stats['dropped'] += 1
+                    continue
+                try:
+                    connection.sendall(frame)
+                    self.__stats['sent'] += 1
+                except OSError:
+                    self.__peers.pop(shard, None)
+                    connection.close()
+                    self.__stats['dropped'] += 1
+
+# 接收循环
+    def __receiveLoop(self):
+        """接收线程主体，接受其他分片的连接并解析消息，连接断开表示对方分片已退出"""
+        decoders = {}
+        while self.__isRunning:
+            for key, _ in self.__selector.select(timeout=0.5):
+                if key.fileobj is self.__listenSocket:
+                    try:
+                        connection, _ = self.__listenSocket.accept()
+                    except OSError:
+                        continue
+                    connection.setblocking(True)
+                    decoders[connection] = pt.FrameDecoder()
+                    self.__selector.register(connection, sl.EVENT_READ, None)
+                    continue
+                connection = key.fileobj
+                try:
+                    data = connection.recv(pt.RECEIVE_SIZE)
+                    frames = decoders[connection].feed(data) if data else None
+                except (OSError, pt.FrameError):
+                    frames = None
+                if frames is None:
+                    self.__selector.unregister(connection)
+                    connection.close()
+                    del decoders[connection]
+                    self.__dispatch({'kind': "down", 'shard': key.data})
+                    continue
+                for frame in frames:
+                    message = json.loads(str(frame, "utf-8"))
+                # 记录连接对应的分片，断开时据此清理该分片的用户
+                    if key.data is None:
+                        self.__selector.modify(connection, sl.EVENT_READ, message['shard'])
+                        key = self.__selector.get_key(connection)
+                    self.__stats['received'] += 1
+                    self.__dispatch(message)
+        return None
+
+# 分发消息
+    def __dispatch(self, message: dict):
+        """调用消息处理函数，处理函数的异常不会终止接收线程"""
+        if message.get('shard') is None:
+            return None
+        try:
+            self.__onMessage(message)
+        except Exception as error:
+            print("分片消息处理失败：{}".format(error))
+        return None
+
+# 获取统计信息
+    def getStats(self) -> Dict[str, int]:
+        """返回发送、接收与丢弃的消息数以及已连接的分片数"""
+        return dict(self.__stats, peers=len(self.__peers))
+
+# 停止
+    def stop(self):
+        """停止总线，关闭全部连接并删除套接字文件"""
+        self.__isRunning = False
+        self.__outbox.put(None)
+        for thread in self.__threads:
+            thread.join(1)
+        for connection in list(self.__peers.values()):
+            connection.close()
+        if self.__listenSocket is not None:
+            self.__listenSocket.close()
+            path = os.path.join(self.__directory, SOCKET_NAME.format(self.__shardId))
+            if os.path.exists(path):
+                os.remove(path)
+        return None
+
+
+# 运行多进程服务端
+def runWorkers(serverPath: str, argv: List[str], workers: int) -> int:
+    """启动workers个工作进程，各进程通过SO_REUSEPORT共用同一个端口，由内核分配新连接，
+    工作进程之间通过ShardBus转发跨分片的消息，主进程只负责启动和回收工作进程
+
+    参数:
+        serverPath(str):Server.py的路径
+        argv(List[str]):原始的命令行参数，会原样传给每个工作进程
+        workers(int):工作进程数
+
+    返回值:
+        int:返回数字0表明程序正常执行结束
+    """
+    directory = tempfile.mkdtemp(prefix="chatroom-shards-")
+    processes = []
+
+    # 收到SIGTERM时与Ctrl+C一样结束全部工作进程
+    def terminate(signum, frame):
+        raise KeyboardInterrupt
+
+    signal.signal(signal.SIGTERM, terminate)
+    try:
+        for shard in range(workers):
+            processes.append(sp.Popen([sys.executable, serverPath] + list(argv) +
+                                      ["--shard-id", str(shard), "--shard-count", str(workers),
+                                       "--bus-dir", directory]))
+        print("已启动{}个工作进程".format(workers))
+        for process in processes:
+            process.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+        for process in processes:
+            process.wait()
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+    return 0
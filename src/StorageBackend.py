@@ -0,0 +1,222 @@
+import sqlite3
+from abc import ABC, abstractmethod
+
+try:
+    import pymysql as pq
+except ImportError:
+    pq = None
+
+
+class StorageBackend(ABC):
+    """存储后端抽象基类，DatabaseUtils通过该接口创建连接并生成语句，不同的数据库只需提供各自的实现，
+    子类必须实现connect与quoteIdentifier
+
+    属性:
+        placeholder(str):该后端驱动使用的参数占位符
+        integrityError(tuple):违反唯一约束时该后端驱动抛出的异常类型，用于except子句
+        userTable(str):已加引号、可直接拼接进语句的用户表名
+        messageTable(str):已加引号、可直接拼接进语句的聊天记录表名
+        mailboxTable(str):已加引号、可直接拼接进语句的离线消息表名
+    """
+    placeholder = "%s"
+    integrityError = ()
+
+# 创建连接
+    @abstractmethod
+    def connect(self) -> 'Connection':
+        """创建一个新的数据库连接，供连接池调用
+
+        参数:
+            self:表明该函数是一个实例方法
+
+        返回值:
+            conn(Connection):符合DB-API规范的连接对象
+        """
+
+# 引用标识符
+    @abstractmethod
+    def quoteIdentifier(self, name: str) -> str:
+        """为表名等标识符加上引号，标识符无法作为查询参数传递，只能以这种方式拼接
+
+        参数:
+            self:表明该函数是一个实例方法
+            name(str):标识符
+
+        返回值:
+            str:加上引号并转义后的标识符
+        """
+
+# 初始化数据表
+    def initialize(self, conn: 'Connection'):
+        """在第一次使用前创建所需的数据表和索引，已存在时不做任何操作
+
+        参数:
+            self:表明该函数是一个实例方法
+            conn(Connection):数据库连接
+
+        返回值:None
+        """
+        return None
+
+# 开始事务
+    def beginTransaction(self, conn: 'Connection'):
+        """在自动提交的连接上显式开始一个事务，用于批量写入
+
+        参数:
+            self:表明该函数是一个实例方法
+            conn(Connection):数据库连接
+
+        返回值:None
+        """
+        conn.begin()
+        return None
+
+# 生成占位符列表
+    def placeholders(self, count: int) -> str:
+        """生成由逗号分隔的若干个参数占位符，用于 in (...) 等语句
+
+        参数:
+            self:表明该函数是一个实例方法
+            count(int):占位符数量
+
+        返回值:
+            str:占位符字符串
+        """
+        return ", ".join([self.placeholder] * count)
+
+
+class MySQLBackend(StorageBackend):
+    """MySQL存储后端，使用pymysql连接已有的MySQL服务器
+
+    属性:
+        host(str):数据库服务器的主机名或IP地址
+        port(int):数据库使用的端口
+        user(str):数据库的用户名
+        password(str):数据库用户的密码
+        database(str):存储数据的数据库名
+        table(str):存储用户数据的数据表名
+    """
+    placeholder = "%s"
+    integrityError = (pq.IntegrityError,) if pq is not None else ()
+
+# 构造函数
+    def __init__(self, host="localhost", port=3306, user=None, password=None, database=None, table=None,
+                 messageTable="messages", mailboxTable="mailbox"):
+        """构造函数，用于MySQL存储后端对象初始化"""
+        self.__host = host
+        self.__port = port
+        self.__user = user
+        self.__password = password
+        self.__database = database
+        self.userTable = "{}.{}".format(self.quoteIdentifier(database), self.quoteIdentifier(table))
+        self.messageTable = "{}.{}".format(self.quoteIdentifier(database), self.quoteIdentifier(messageTable))
+        self.mailboxTable = "{}.{}".format(self.quoteIdentifier(database), self.quoteIdentifier(mailboxTable))
+
+# 创建连接
+    def connect(self) -> 'Connection':
+        """创建一个新的MySQL连接"""
+        if pq is None:
+            raise RuntimeError("使用MySQL存储后端需要安装pymysql")
+        return pq.connect(host=self.__host, port=self.__port, db=self.__database,
+                          user=self.__user, password=self.__password, charset="utf8", autocommit=True)
+
+# 引用标识符
+    def quoteIdentifier(self, name: str) -> str:
+        """MySQL使用反引号引用标识符"""
+        return "`{}`".format(str(name).replace("`", "``"))
+
+# 初始化数据表
+    def initialize(self, conn: 'Connection'):
+        """用户表沿用已有的表结构，聊天记录表与离线消息表不存在时创建"""
+        cursor = conn.cursor()
+        cursor.execute("create table if not exists {} (id bigint auto_increment primary key, "
+                       "conversation varchar(255) not null, source varchar(64), destination varchar(64), "
+                       "type varchar(16) not null, data text, createdAt double not null, "
+                       "index idx_conversation_id (conversation, id))".format(self.messageTable))
+        cursor.execute("create table if not exists {} (id bigint auto_increment primary key, "
+                       "recipient varchar(64) not null, source varchar(64), data text, createdAt double not null, "
+                       "index idx_recipient_id (recipient, id))".format(self.mailboxTable))
+        cursor.close()
+        return None
+
+
+class SQLiteBackend(StorageBackend):
+    """嵌入式SQLite存储后端，无需外部数据库服务，使用WAL模式以支持读写并发，
+    数据表与name索引在第一次连接时自动创建
+
+    属性:
+        path(str):数据库文件路径
+        table(str):存储用户数据的数据表名
+    """
+    placeholder = "?"
+    integrityError = (sqlite3.IntegrityError,)
+
+# 构造函数
+    def __init__(self, path: str = "chatroom.db", table: str = "users", messageTable: str = "messages",
+                 mailboxTable: str = "mailbox"):
+        """构造函数，用于SQLite存储后端对象初始化"""
+        self.__path = path
+        self.__table = table
+        self.__messageTable = messageTable
+        self.__mailboxTable = mailboxTable
+        self.userTable = self.quoteIdentifier(table)
+        self.messageTable = self.quoteIdentifier(messageTable)
+        self.mailboxTable = self.quoteIdentifier(mailboxTable)
+
+# 创建连接
+    def connect(self) -> 'Connection':
+        """创建一个新的SQLite连接，连接由连接池保证同一时间只被一个线程使用"""
+        conn = sqlite3.connect(self.__path, timeout=5, isolation_level=None, check_same_thread=False)
+        conn.execute("pragma journal_mode=WAL")
+        conn.execute("pragma synchronous=NORMAL")
+        return conn
+
+# 引用标识符
+    def quoteIdentifier(self, name: str) -> str:
+        """SQLite使用双引号引用标识符"""
+        return '"{}"'.format(str(name).replace('"', '""'))
+
+# 初始化数据表
+    def initialize(self, conn: 'Connection'):
+        """创建用户表、聊天记录表、离线消息表以及name、(conversation, id)和(recipient, id)上的索引"""
+        conn.execute("create table if not exists {} (id integer primary key, "
+                     "name text not null, password text not null)".format(self.userTable))
+        conn.execute("create unique index if not exists {} on {} (name)".format(
+            self.quoteIdentifier("idx_{}_name".format(self.__table)), self.userTable))
+        conn.execute("create table if not exists {} (id integer primary key autoincrement, "
+                     "conversation text not null, source text, destination text, type text not null, "
+                     "data text, createdAt real not null)".format(self.messageTable))
+        conn.execute("create index if not exists {} on {} (conversation, id)".format(
+            self.quoteIdentifier("idx_{}_conversation_id".format(self.__messageTable)), self.messageTable))
+        conn.execute("create table if not exists {} (id integer primary key autoincrement, "
+                     "recipient text not null, source text, data text, createdAt real not null)".format(
+                         self.mailboxTable))
+        conn.execute("create index if not exists {} on {} (recipient, id)".format(
+            self.quoteIdentifier("idx_{}_recipient_id".format(self.__mailboxTable)), self.mailboxTable))
+        return None
+
+# 开始事务
+    def beginTransaction(self, conn: 'Connection'):
+        """自动提交模式下的SQLite连接使用begin语句开始事务"""
+        conn.execute("begin")
+        return None
+
+
+# 后端类型
+BACKENDS = {'mysql': MySQLBackend, 'sqlite': SQLiteBackend}
+
+
+# 创建存储后端
+def createBackend(kind: str, **options) -> 'StorageBackend':
+    """根据配置创建存储后端
+
+    参数:
+        kind(str):后端类型，mysql 或 sqlite
+        options:传给对应后端构造函数的参数
+
+    返回值:
+        StorageBackend:存储后端对象
+    """
+    if kind not in BACKENDS:
+        raise ValueError("未知的存储后端：{}".format(kind))
+    return BACKENDS[kind](**options)
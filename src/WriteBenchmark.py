@@ -0,0 +1,164 @@
+import subprocess as sp
+import tempfile
+import json
+import os
+import sys
+import argparse
+from typing import List, Dict, Tuple, Union
+from Client import Client
+from Server import raiseFileLimit
+from ServerModeBenchmark import startServerProcess
+
+# 读取统计信息的管理员昵称
+ADMIN_USER = "writebench-admin"
+
+
+# 读取进程的CPU时间
+def readProcessCpu(pid: int) -> float:
+    """读取Linux下/proc/<pid>/stat中进程的用户态与内核态CPU时间之和
+
+    参数:
+        pid(int):被测服务端进程的进程号
+
+    返回值:
+        float:CPU秒数，无法读取时为-1
+    """
+    try:
+        with open("/proc/{}/stat".format(pid)) as statFile:
+            fields = statFile.read().rsplit(")", 1)[1].split()
+    except (FileNotFoundError, IndexError):
+        return -1.0
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+# 解析测试配置
+def parseConfigs(text: str) -> List[Tuple[int, float]]:
+    """解析形如 "1:0,512:0,512:0.5" 的测试配置，冒号前为单次发送的最大帧数，冒号后为延迟预算(毫秒)
+
+    参数:
+        text(str):测试配置
+
+    返回值:
+        List[Tuple[int, float]]:(单次发送的最大帧数, 延迟预算毫秒数)组成的列表
+    """
+    configs = []
+    for item in text.split(","):
+        batch, _, delay = item.partition(":")
+        configs.append((int(batch), float(delay or 0)))
+    return configs
+
+
+# 查询服务端统计信息
+def queryServerStats(port: int) -> dict:
+    """以管理员身份登录并发送stats请求
+
+    参数:
+        port(int):服务端监听的端口号
+
+    返回值:
+        dict:服务端的统计信息
+    """
+    client = Client("127.0.0.1", port, usePresence=False)
+    client.getConnection(timeout=5)
+    client.loginCheck("{} bench".format(ADMIN_USER), 5)
+    client.setNickname(ADMIN_USER)
+    try:
+        return client.waitResponse(client.request(client.processMessage(None, "stats", None)), 5)['data']
+    finally:
+        client.closeConnection()
+
+
+# 单个配置的测试
+def benchmarkConfig(arguments: argparse.Namespace, batch: int, delay: float,
+                    port: int) -> Dict[str, Union[int, float]]:
+    """以指定的单次发送帧数与延迟预算启动服务端，运行一次以群聊为主的负载测试，
+    再从服务端的统计信息中读取发送的系统调用次数与帧数
+
+    参数:
+        arguments(Namespace):解析后的命令行参数
+        batch(int):单次发送的最大帧数
+        delay(float):延迟预算(毫秒)
+        port(int):服务端监听的端口号
+
+    返回值:
+        Dict:配置、每秒送达数、系统调用次数、每条消息的系统调用次数、群聊延迟与服务端CPU时间
+    """
+    directory = tempfile.mkdtemp(prefix="writebench-")
+    dbPath = os.path.join(directory, "chatroom.db")
+    jsonPath = os.path.join(directory, "load.json")
+    loadPath = os.path.join(os.path.dirname(os.path.abspath(__file__)), "LoadBenchmark.py")
+    server = startServerProcess(arguments.mode, port, ["--storage", "sqlite", "--db-path", dbPath,
+                                                       "--metrics-interval", "0", "--rate-limits", "none",
+                                                       "--admin-users", ADMIN_USER, "--write-batch", str(batch),
+                                                       "--flush-delay", str(delay)])
+    try:
+        cpuStart = readProcessCpu(server.pid)
+        sp.run([sys.executable, loadPath, "--mode", "external", "--port", str(port),
+                "--users", str(arguments.users), "--rate", str(arguments.rate),
+                "--duration", str(arguments.duration), "--mix", arguments.mix, "--size", str(arguments.size),
+                "--json", jsonPath], stdout=sp.DEVNULL, stderr=sp.DEVNULL)
+        cpuSeconds = readProcessCpu(server.pid) - cpuStart
+        outbound = queryServerStats(port)['outbound']
+        with open(jsonPath) as jsonFile:
+            load = json.load(jsonFile)
+    finally:
+        server.kill()
+        server.wait()
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+
+    return {'batch': batch, 'delayMs': delay, 'deliveries': load['throughput']['deliveries'],
+            'deliveriesPerSecond': load['throughput']['deliveriesPerSecond'], 'lost': load['errors']['lost'],
+            'sendCalls': outbound['sendCalls'], 'frames': outbound['frames'],
+            'syscallsPerMessage': outbound['sendCalls'] / outbound['frames'] if outbound['frames'] > 0 else 0.0,
+            'publicP50Ms': load['latency']['public']['p50Ms'], 'publicP99Ms': load['latency']['public']['p99Ms'],
+            'cpuSeconds': cpuSeconds}
+
+
+# 主函数
+def main(argv: List[str] = None) -> int:
+    """依次以不同的发送合并配置启动服务端并施加相同的群聊负载，
+    输出每条消息的发送系统调用次数、每秒送达数、群聊延迟与服务端CPU时间
+
+    参数:
+        argv(List[str]):命令行参数列表，为None时使用sys.argv
+
+    返回值:
+        int:返回数字0表明程序正常执行结束
+    """
+    parser = argparse.ArgumentParser(description="发送合并与向量化发送的对比测试")
+    parser.add_argument("--configs", default="1:0,512:0,512:0.5",
+                        help="需要测试的配置，格式为 单次发送的最大帧数:延迟预算毫秒数，以逗号分隔，1:0 即每帧一次系统调用")
+    parser.add_argument("--mode", choices=("threaded", "asyncio"), default="threaded", help="服务模式")
+    parser.add_argument("--users", type=int, default=50, help="模拟用户数")
+    parser.add_argument("--rate", type=float, default=500, help="所有用户合计每秒发送的消息数")
+    parser.add_argument("--duration", type=float, default=5, help="发送阶段持续的秒数")
+    parser.add_argument("--mix", default="public=1", help="各类消息的比例")
+    parser.add_argument("--size", type=int, default=32, help="聊天消息内容的填充字节数")
+    parser.add_argument("--port", type=int, default=61400, help="被测服务端使用的端口号")
+    parser.add_argument("--json", dest="jsonPath", default=None, help="将结果以JSON格式写入该文件")
+    arguments = parser.parse_args(argv)
+    raiseFileLimit()
+
+    results = []
+    for index, (batch, delay) in enumerate(parseConfigs(arguments.configs)):
+        results.append(benchmarkConfig(arguments, batch, delay, arguments.port + index))
+
+    print("{:<8}{:>10}{:>14}{:>12}{:>12}{:>12}{:>10}{:>10}{:>10}".format(
+        "batch", "delay(ms)", "deliveries/s", "sendCalls", "frames", "calls/msg", "p50(ms)", "p99(ms)", "cpu(s)"))
+    for result in results:
+        print("{:<8}{:>10.2f}{:>14.1f}{:>12}{:>12}{:>12.3f}{:>10.2f}{:>10.2f}{:>10.2f}".format(
+            result['batch'], result['delayMs'], result['deliveriesPerSecond'], result['sendCalls'],
+            result['frames'], result['syscallsPerMessage'], result['publicP50Ms'], result['publicP99Ms'],
+            result['cpuSeconds']))
+
+    if arguments.jsonPath is not None:
+        with open(arguments.jsonPath, "w") as jsonFile:
+            json.dump(results, jsonFile, indent=2)
+    return 0
+
+
+# 运行程序
+if __name__ == "__main__":
+    sys.exit(main())